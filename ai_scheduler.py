@@ -0,0 +1,153 @@
+import threading
+from collections import deque
+
+from error_logger import log_error
+
+
+class QueueFullError(Exception):
+    """Очередь генерации заполнена, запрос отклонен"""
+
+
+class InferenceScheduler:
+    """
+    Очередь запросов к AI-модели со своими рабочими потоками
+
+    Генерация занимает десятки секунд, поэтому выполняется отдельно от
+    обработчиков бота: обработчик только ставит запрос в очередь. Запросы
+    разных пользователей выбираются по кругу, так что один пользователь не
+    может занять модель серией запросов. Очередь ограничена общим размером и
+    числом запросов на пользователя - лишние запросы сразу отклоняются.
+    """
+
+    def __init__(self, generate, max_queue=20, max_per_user=2, workers=1):
+        """
+        Args:
+            generate: функция генерации ответа по тексту запроса
+            max_queue: сколько запросов может ждать в очереди
+            max_per_user: сколько запросов одного пользователя может быть в очереди
+            workers: сколько запросов генерируется одновременно
+        """
+        self.generate = generate
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self._lock = threading.Lock()
+        self._has_work = threading.Condition(self._lock)
+        # Очереди запросов по пользователям и порядок обхода пользователей
+        self._queues = {}
+        self._users = deque()
+        self._queued = 0
+        self._running = 0
+        self._idle_callback = None
+        for i in range(workers):
+            threading.Thread(target=self._worker, daemon=True, name=f"ai-worker-{i}").start()
+
+    def submit(self, user_id, text, on_start=None, on_done=None):
+        """
+        Ставит запрос в очередь
+
+        Args:
+            on_start: вызывается без аргументов, когда начинается генерация
+            on_done: вызывается с ответом модели
+
+        Returns:
+            int: позиция запроса в очереди, 0 - генерация начнется сразу
+
+        Raises:
+            QueueFullError: очередь или лимит пользователя заполнены
+        """
+        with self._lock:
+            if self._queued >= self.max_queue:
+                raise QueueFullError("Очередь запросов к AI заполнена")
+            user_queue = self._queues.get(user_id)
+            if user_queue is not None and len(user_queue) >= self.max_per_user:
+                raise QueueFullError("Слишком много запросов пользователя в очереди")
+
+            job = (text, on_start, on_done)
+            if user_queue is None:
+                user_queue = self._queues[user_id] = deque()
+                self._users.append(user_id)
+            user_queue.append(job)
+            self._queued += 1
+            self._has_work.notify()
+            return self._position(job)
+
+    def _position(self, job):
+        """Считает место запроса при обходе пользователей по кругу"""
+        if self._running == 0 and self._queued == 1:
+            return 0
+        queues = [list(self._queues[user_id]) for user_id in self._users]
+        position = 0
+        for depth in range(self.max_per_user):
+            for user_queue in queues:
+                if depth < len(user_queue):
+                    position += 1
+                    if user_queue[depth] is job:
+                        return position
+        return position
+
+    def run_when_idle(self, callback):
+        """Выполняет callback в рабочем потоке, когда очередь опустеет (например, выгрузку модели)"""
+        with self._lock:
+            self._idle_callback = callback
+            self._has_work.notify()
+
+    def pending_count(self):
+        """Возвращает количество ожидающих и выполняемых запросов"""
+        with self._lock:
+            return self._queued + self._running
+
+    def _next_job(self):
+        """Берет запрос следующего по кругу пользователя; вызывается под блокировкой"""
+        user_id = self._users.popleft()
+        user_queue = self._queues[user_id]
+        job = user_queue.popleft()
+        if user_queue:
+            self._users.append(user_id)
+        else:
+            del self._queues[user_id]
+        self._queued -= 1
+        return job
+
+    def _worker(self):
+        """Рабочий поток: выполняет запросы по очереди"""
+        while True:
+            with self._lock:
+                while not self._users and not (self._idle_callback and self._running == 0):
+                    self._has_work.wait()
+                if self._users:
+                    job, callback = self._next_job(), None
+                    self._running += 1
+                else:
+                    job, callback = None, self._idle_callback
+                    self._idle_callback = None
+
+            if callback is not None:
+                try:
+                    callback()
+                except Exception as e:
+                    log_error(f"Ошибка в задаче очереди AI: {str(e)}", "system", "ai_scheduler")
+                continue
+
+            text, on_start, on_done = job
+            try:
+                # Ошибка уведомления (например, сообщение удалено) не отменяет генерацию
+                self._call(on_start)
+                try:
+                    response = self.generate(text)
+                except Exception as e:
+                    log_error(f"Ошибка при обработке запроса к AI: {str(e)}", "system", "ai_scheduler")
+                else:
+                    self._call(on_done, response)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._has_work.notify()
+
+    def _call(self, callback, *args):
+        """Вызывает callback запроса, записывая его ошибки в лог"""
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception as e:
+            log_error(f"Ошибка в обработчике запроса к AI: {str(e)}", "system", "ai_scheduler")
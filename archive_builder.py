@@ -0,0 +1,231 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from contextlib import contextmanager
+
+from shared_files import write_atomic
+
+# Ограничение Telegram на размер файла, отправляемого ботом, - 50 МБ; оставляем запас
+VOLUME_SIZE = 45 * 1024 * 1024
+
+# Форматы, которые уже сжаты: повторное сжатие только тратит процессор
+STORED_EXTENSIONS = {
+    '.docx', '.xlsx', '.pptx', '.odt', '.epub', '.pdf', '.djvu', '.zip', '.gz', '.7z', '.rar',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3', '.mp4', '.mkv'
+}
+
+# Запас на заголовки записи zip сверх размера самого файла
+ENTRY_OVERHEAD = 1024
+
+
+class ArchiveManager:
+    """
+    Готовые архивы каталога или его отдельной категории, хранящиеся на диске
+
+    Архив помечается подписью версии файлов, которые в него входят, и
+    пересобирается только при ее изменении. Если файлы только добавлялись,
+    новые файлы дописываются в копию последнего тома без повторного сжатия
+    остальных. Архив делится на тома не больше volume_size, чтобы каждый
+    можно было отправить через Telegram; файлы пишутся с диска по частям,
+    поэтому память не зависит от размера библиотеки.
+
+    Сборка и отправка архива защищены файловой блокировкой области архива,
+    общей для потоков и процессов бота: отправка держит разделяемую
+    блокировку, сборка - исключительную, поэтому тома не пересобираются и не
+    удаляются, пока их отправляют.
+    """
+
+    def __init__(self, file_handler, archive_dir='archives', archive_name='programming-documentation',
+                 volume_size=VOLUME_SIZE):
+        self.file_handler = file_handler
+        self.archive_dir = archive_dir
+        self.archive_name = archive_name
+        self.volume_size = volume_size
+        os.makedirs(archive_dir, exist_ok=True)
+
+    def scope_name(self, category=None, subcategory=None):
+        """Возвращает имя архива для всего каталога, категории или подкатегории"""
+        parts = [self.archive_name] + [part for part in (category, subcategory) if part]
+        return "-".join(parts)
+
+    def _volume_path(self, scope_name, number):
+        return os.path.join(self.archive_dir, f"{scope_name}.part{number}.zip")
+
+    def _meta_path(self, scope_name):
+        return os.path.join(self.archive_dir, f"{scope_name}.json")
+
+    def _lock_path(self, scope_name):
+        return os.path.join(self.archive_dir, f"{scope_name}.lock")
+
+    def _temp_path(self, target_path):
+        """Создает временный файл с уникальным именем рядом с томом"""
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(target_path)}.", suffix='.tmp',
+                                        dir=self.archive_dir)
+        os.close(fd)
+        return tmp_path
+
+    def _catalog_manifest(self, category=None, subcategory=None):
+        """Возвращает версии файлов, входящих в архив: {путь: [размер, mtime]}"""
+        manifest = {}
+        for entry in self.file_handler.iter_entries():
+            if category and entry['category'] != category:
+                continue
+            if subcategory and entry['subcategory'] != subcategory:
+                continue
+            manifest[entry['path']] = [entry['size'], entry['mtime']]
+        return manifest
+
+    def _signature(self, manifest):
+        """Считает подпись версии по списку файлов и их версиям"""
+        data = json.dumps(sorted(manifest.items()), ensure_ascii=False)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def _load_meta(self, scope_name):
+        """Загружает описание собранного архива"""
+        try:
+            with open(self._meta_path(scope_name), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not all(os.path.exists(volume) for volume in meta['volumes']):
+            return None
+        return meta
+
+    def _save_meta(self, scope_name, meta):
+        """Атомарно сохраняет описание собранного архива"""
+        write_atomic(self._meta_path(scope_name), json.dumps(meta, ensure_ascii=False))
+
+    @contextmanager
+    def open_archive(self, category=None, subcategory=None):
+        """
+        Дает актуальные тома архива, собирая их только при изменении файлов
+
+        Пока блок with выполняется, тома не пересобираются: одновременные
+        отправки того же архива идут параллельно, а сборка ждет их окончания.
+
+        Yields:
+            tuple: список путей к томам и подпись версии файлов
+        """
+        scope_name = self.scope_name(category, subcategory)
+        with open(self._lock_path(scope_name), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+            try:
+                while True:
+                    manifest = self._catalog_manifest(category, subcategory)
+                    signature = self._signature(manifest)
+                    meta = self._load_meta(scope_name)
+                    if meta and meta['signature'] == signature:
+                        break
+                    # Смена блокировки не атомарна: после возврата к разделяемой
+                    # проверяем версию заново - архив мог пересобрать другой процесс
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    self._update_archive(scope_name, category, subcategory)
+                    fcntl.flock(lock_file, fcntl.LOCK_SH)
+                yield meta['volumes'], signature
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _update_archive(self, scope_name, category, subcategory):
+        """Пересобирает или дополняет архив; вызывается под исключительной блокировкой"""
+        manifest = self._catalog_manifest(category, subcategory)
+        signature = self._signature(manifest)
+        meta = self._load_meta(scope_name)
+        if meta and meta['signature'] == signature:
+            # Пока ждали блокировку, архив собрали
+            return
+
+        if meta and self._only_added(meta['entries'], manifest):
+            new_paths = [path for path in manifest if path not in meta['entries']]
+            volumes, entries = self._append(scope_name, meta, new_paths, manifest)
+        else:
+            volumes, entries = self._build(scope_name, list(manifest), manifest)
+
+        self._save_meta(scope_name, {'signature': signature, 'entries': entries, 'volumes': volumes})
+
+    def _only_added(self, old_entries, manifest):
+        """Проверяет, что с момента сборки файлы только добавлялись"""
+        return all(manifest.get(path) == version[:2] for path, version in old_entries.items())
+
+    def _build(self, scope_name, paths, manifest):
+        """Собирает архив заново"""
+        for volume in self._existing_volumes(scope_name):
+            os.remove(volume)
+        return self._write_volumes(scope_name, [], {}, paths, manifest)
+
+    def _append(self, scope_name, meta, paths, manifest):
+        """Дописывает новые файлы в последний том и, при необходимости, в новые тома"""
+        return self._write_volumes(scope_name, list(meta['volumes']), dict(meta['entries']), paths, manifest)
+
+    def _existing_volumes(self, scope_name):
+        prefix = f"{scope_name}.part"
+        return [os.path.join(self.archive_dir, name) for name in os.listdir(self.archive_dir)
+                if name.startswith(prefix) and name.endswith('.zip')]
+
+    def _write_volumes(self, scope_name, volumes, entries, paths, manifest):
+        """
+        Распределяет файлы по томам не больше volume_size
+
+        Последний существующий том дописывается в копии, чтобы не трогать файл,
+        который в этот момент может отправляться. Файл больше тома получает
+        отдельный том целиком.
+        """
+        zipf = None
+        tmp_path = None
+        target_path = None
+        # Размер последнего тома; None, если томов еще нет
+        size = os.path.getsize(volumes[-1]) if volumes else None
+        try:
+            for path in paths:
+                needed = manifest[path][0] + ENTRY_OVERHEAD
+                if size is None or (size > 0 and size + needed > self.volume_size):
+                    if zipf is not None:
+                        zipf.close()
+                        os.replace(tmp_path, target_path)
+                    target_path = self._volume_path(scope_name, len(volumes) + 1)
+                    volumes.append(target_path)
+                    tmp_path = self._temp_path(target_path)
+                    zipf = zipfile.ZipFile(tmp_path, 'w')
+                    size = 0
+                elif zipf is None:
+                    target_path = volumes[-1]
+                    tmp_path = self._temp_path(target_path)
+                    shutil.copyfile(target_path, tmp_path)
+                    zipf = zipfile.ZipFile(tmp_path, 'a')
+
+                zipf.write(
+                    os.path.join(self.file_handler.base_dir, path),
+                    path,
+                    compress_type=self._compression_for(path)
+                )
+                zipf.fp.flush()
+                size = os.path.getsize(tmp_path)
+                entries[path] = manifest[path] + [len(volumes)]
+
+            if zipf is not None:
+                zipf.close()
+                os.replace(tmp_path, target_path)
+                zipf = None
+        finally:
+            if zipf is not None:
+                zipf.close()
+                os.remove(tmp_path)
+
+        # Пустой каталог - пустой архив из одного тома
+        if not volumes:
+            target_path = self._volume_path(scope_name, 1)
+            tmp_path = self._temp_path(target_path)
+            with zipfile.ZipFile(tmp_path, 'w'):
+                pass
+            os.replace(tmp_path, target_path)
+            volumes.append(target_path)
+        return volumes, entries
+
+    def _compression_for(self, path):
+        """Не сжимает повторно уже сжатые форматы"""
+        if os.path.splitext(path)[1].lower() in STORED_EXTENSIONS:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
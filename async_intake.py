@@ -0,0 +1,117 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot.async_telebot import AsyncTeleBot
+
+from error_logger import log_error
+
+
+def update_chat_id(update):
+    """Возвращает id чата, к которому относится обновление"""
+    if update.message:
+        return update.message.chat.id
+    if update.callback_query and update.callback_query.message:
+        return update.callback_query.message.chat.id
+    if update.callback_query:
+        return update.callback_query.from_user.id
+    return None
+
+
+class AsyncIntake:
+    """
+    Прием обновлений через AsyncTeleBot с обработкой в пулах потоков
+
+    Асинхронна только доставка: обновления получаются через long polling в
+    цикле asyncio, а ожидающие обработки обновления - задачи asyncio, а не
+    потоки. Сами обработчики бота синхронные: каждое обрабатываемое
+    обновление, включая скачивание и отправку файлов, занимает поток пула.
+    Обычные запросы выполняются в общем пуле, тяжелые задачи (сборка
+    архивов) - в отдельных пулах, чтобы не занимать общий. Перевод
+    обработчиков на корутины AsyncTeleBot не сделан: для этого их нужно
+    переписать, а не запускать из цикла asyncio.
+
+    Обновления одного чата обрабатываются по порядку (от этого зависят
+    пошаговые обработчики), обновления разных чатов - параллельно.
+    """
+
+    def __init__(self, token, process_update, route=None, pool_sizes=None,
+                 max_in_flight=1000, poll_timeout=20, retry_delay=5):
+        """
+        Args:
+            token: токен бота
+            process_update: синхронная функция обработки одного обновления
+            route: функция, возвращающая имя пула для обновления (по умолчанию 'io')
+            pool_sizes: {имя пула: количество потоков}
+            max_in_flight: сколько обновлений может обрабатываться и ждать одновременно
+        """
+        self.bot = AsyncTeleBot(token)
+        self.process_update = process_update
+        self.route = route or (lambda update: 'io')
+        self.pools = {
+            name: ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"bot-{name}")
+            for name, size in (pool_sizes or {'io': 32}).items()
+        }
+        self.max_in_flight = max_in_flight
+        self.poll_timeout = poll_timeout
+        self.retry_delay = retry_delay
+        # Последняя задача каждого чата: следующая задача чата ждет ее завершения
+        self._chat_tails = {}
+
+    def run(self):
+        """Запускает получение и обработку обновлений до остановки процесса"""
+        try:
+            asyncio.run(self._run())
+        finally:
+            for pool in self.pools.values():
+                pool.shutdown(wait=False)
+
+    async def _run(self):
+        """Получает обновления и закрывает сессию aiohttp при остановке"""
+        try:
+            await self._poll()
+        finally:
+            # Выполняется и при отмене задачи, когда asyncio.run завершается из-за сигнала
+            await self.bot.close_session()
+
+    async def _poll(self):
+        """Получает обновления и распределяет их по пулам"""
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        offset = None
+        while True:
+            try:
+                updates = await self.bot.get_updates(offset=offset, timeout=self.poll_timeout)
+            except Exception as e:
+                log_error(f"Ошибка получения обновлений: {str(e)}", "system", "async_intake")
+                await asyncio.sleep(self.retry_delay)
+                continue
+
+            for update in updates:
+                offset = update.update_id + 1
+                # При перегрузке перестаем забирать обновления - они ждут в Telegram
+                await self._in_flight.acquire()
+                self._schedule(update)
+
+    def _schedule(self, update):
+        """Ставит обработку обновления в очередь его чата"""
+        chat_id = update_chat_id(update)
+        previous = self._chat_tails.get(chat_id)
+        task = asyncio.ensure_future(self._handle(update, previous))
+        self._chat_tails[chat_id] = task
+
+        def forget(done_task):
+            if self._chat_tails.get(chat_id) is done_task:
+                del self._chat_tails[chat_id]
+
+        task.add_done_callback(forget)
+
+    async def _handle(self, update, previous):
+        """Дожидается предыдущего обновления чата и обрабатывает обновление в нужном пуле"""
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            pool = self.pools.get(self.route(update), self.pools['io'])
+            await asyncio.get_running_loop().run_in_executor(pool, self.process_update, update)
+        except Exception as e:
+            log_error(f"Ошибка обработки обновления: {str(e)}", update_chat_id(update), "async_intake")
+        finally:
+            self._in_flight.release()
@@ -0,0 +1,192 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from error_logger import log_error
+from shared_files import file_lock, file_version, write_atomic
+
+
+def link_new(src_path, dest_path):
+    """
+    Атомарно публикует файл под новым именем, не перезаписывая существующий
+
+    Raises:
+        FileExistsError: файл с таким именем уже есть
+    """
+    try:
+        os.link(src_path, dest_path)
+    except FileExistsError:
+        raise
+    except OSError:
+        # Файловая система без жестких ссылок: занимаем имя через O_EXCL и заменяем файл
+        os.close(os.open(dest_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+        os.replace(src_path, dest_path)
+        return
+    os.remove(src_path)
+
+
+class BlobStore:
+    """
+    Хранилище содержимого файлов, адресуемое по SHA-256
+
+    Каждое уникальное содержимое хранится один раз в директории с разветвлением
+    по первым символам хеша, а файлы в категориях являются жесткими ссылками
+    на него. Манифест связывает пути в каталоге и file_unique_id из Telegram
+    с хешем содержимого. Манифест общий для всех процессов бота: изменения
+    вносятся под файловой блокировкой в свежую версию файла, а чтение
+    подхватывает изменения других процессов по mtime манифеста.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp_dir = os.path.join(root, 'tmp')
+        self.manifest_file = os.path.join(root, 'manifest.json')
+        self._lock = threading.Lock()
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._manifest = {'refs': {}, 'unique_ids': {}}
+        # Версия файла, из которой загружен манифест в памяти
+        self._loaded_version = None
+        with self._lock:
+            self._refresh()
+
+    def _load_manifest(self):
+        """Загружает манифест ссылок"""
+        manifest = {'refs': {}, 'unique_ids': {}}
+        if os.path.exists(self.manifest_file):
+            try:
+                with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                    manifest.update(json.load(f))
+            except (OSError, ValueError) as e:
+                # Без манифеста хранилище работает, только не находит уже сохраненное содержимое
+                log_error(f"Не удалось прочитать манифест блобов: {str(e)}", "system", self.manifest_file)
+        return manifest
+
+    def _refresh(self):
+        """Перечитывает манифест, если файл изменился; вызывается под _lock"""
+        version = file_version(self.manifest_file)
+        if version != self._loaded_version:
+            self._manifest = self._load_manifest()
+            self._loaded_version = version
+
+    @contextmanager
+    def _changing_manifest(self):
+        """Дает изменить свежую версию манифеста и сохраняет ее"""
+        with self._lock, file_lock(self.manifest_file):
+            self._refresh()
+            yield self._manifest
+            write_atomic(self.manifest_file, json.dumps(self._manifest, ensure_ascii=False))
+            self._loaded_version = file_version(self.manifest_file)
+
+    def blob_path(self, sha256):
+        """Возвращает путь к блобу с указанным хешем"""
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def has(self, sha256):
+        """Проверяет, есть ли содержимое с таким хешем в хранилище"""
+        return os.path.exists(self.blob_path(sha256))
+
+    def put(self, tmp_path, sha256):
+        """
+        Перемещает временный файл в хранилище под его хешем
+
+        Returns:
+            bool: True, если содержимое новое, False, если такой блоб уже был
+        """
+        blob_path = self.blob_path(sha256)
+        if os.path.exists(blob_path):
+            os.remove(tmp_path)
+            return False
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(tmp_path, blob_path)
+        return True
+
+    def link(self, sha256, dest_path, overwrite=True):
+        """
+        Атомарно создает в каталоге ссылку на блоб
+
+        Raises:
+            FileExistsError: файл уже есть, а overwrite=False
+        """
+        blob_path = self.blob_path(sha256)
+        dest_dir = os.path.dirname(dest_path)
+        tmp_link = os.path.join(dest_dir, f".{sha256[:16]}.{threading.get_ident()}.link.part")
+        try:
+            os.link(blob_path, tmp_link)
+        except OSError:
+            # Файловая система без жестких ссылок - копируем содержимое
+            fd, tmp_link = tempfile.mkstemp(prefix='.', suffix='.part', dir=dest_dir)
+            os.close(fd)
+            shutil.copyfile(blob_path, tmp_link)
+        try:
+            if overwrite:
+                os.replace(tmp_link, dest_path)
+            else:
+                link_new(tmp_link, dest_path)
+        except BaseException:
+            os.remove(tmp_link)
+            raise
+
+    def add_ref(self, rel_path, sha256, size, mtime, file_unique_id=None):
+        """Запоминает, что файл каталога ссылается на блоб"""
+        with self._changing_manifest() as manifest:
+            manifest['refs'][rel_path] = {'sha256': sha256, 'size': size, 'mtime': mtime}
+            if file_unique_id:
+                manifest['unique_ids'][file_unique_id] = sha256
+
+    def remove_ref(self, rel_path):
+        """
+        Забывает ссылку удаленного файла каталога
+
+        Если на содержимое больше ничего не ссылается, блоб удаляется.
+        """
+        with self._lock:
+            self._refresh()
+            if rel_path not in self._manifest['refs']:
+                # Ссылку уже удалил этот или другой процесс
+                return
+
+        with self._changing_manifest() as manifest:
+            ref = manifest['refs'].pop(rel_path, None)
+            if ref is None:
+                return
+            sha256 = ref['sha256']
+            if any(other['sha256'] == sha256 for other in manifest['refs'].values()):
+                return
+            # Последняя ссылка: вместе с блобом забываем и file_unique_id, указывающие на него
+            manifest['unique_ids'] = {
+                unique_id: sha for unique_id, sha in manifest['unique_ids'].items() if sha != sha256
+            }
+            blob_path = self.blob_path(sha256)
+            try:
+                # Жесткие ссылки, не попавшие в манифест, держат блоб живым
+                if os.stat(blob_path).st_nlink <= 1:
+                    os.remove(blob_path)
+            except OSError:
+                pass
+
+    def sha_for_path(self, rel_path, size, mtime):
+        """Возвращает хеш содержимого файла, если файл не менялся после сохранения"""
+        with self._lock:
+            self._refresh()
+            ref = self._manifest['refs'].get(rel_path)
+        if ref and ref['size'] == size and ref['mtime'] == mtime:
+            return ref['sha256']
+        return None
+
+    def sha_for_unique_id(self, file_unique_id):
+        """Возвращает хеш уже сохраненного содержимого по file_unique_id из Telegram"""
+        with self._lock:
+            self._refresh()
+            sha256 = self._manifest['unique_ids'].get(file_unique_id)
+        if sha256 and self.has(sha256):
+            return sha256
+        return None
+
+    def find_refs(self, sha256):
+        """Возвращает пути каталога, ссылающиеся на содержимое"""
+        with self._lock:
+            self._refresh()
+            return [path for path, ref in self._manifest['refs'].items() if ref['sha256'] == sha256]
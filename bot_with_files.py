@@ -1,14 +1,29 @@
 import telebot
 from file_handler import FileHandler
+from file_id_cache import FileIdCache
+from text_search import SearchIndex, sync_with_catalog
+from text_extraction import ExtractionPipeline
+from fuzzy_search import build_name_index
+from archive_builder import ArchiveManager
+from stats_store import StatsStore
+from user_cache import UserCache, format_user_name
+from async_intake import AsyncIntake
+from ai_scheduler import InferenceScheduler, QueueFullError
+from webhook_server import WebhookServer
+from outbound import OutboundDispatcher
+from state_store import create_state_store
+from cluster import IntakeLease, run_cluster, worker_loop
+from download_gateway import DownloadGateway
 from telebot import types
 import os
-import json
 from dotenv import load_dotenv
 from error_logger import log_error
-import zipfile
-import io
+import requests
+import threading
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 import logging
-from datetime import datetime
+from datetime import date, datetime
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
 import time
@@ -91,53 +106,173 @@ load_dotenv()
 # Получаем токен из переменной окружения
 TOKEN = os.getenv('TOKEN')
 
+# Middleware нужны для запоминания имен пользователей из входящих сообщений
+telebot.apihelper.ENABLE_MIDDLEWARE = True
+
+# Режим работы: polling - синхронный TeleBot, async_intake - получение обновлений через
+# AsyncTeleBot с обработкой в пулах потоков (обработчики остаются синхронными и на время
+# работы, например сборки архива, занимают поток пула; асинхронных обработчиков нет),
+# webhook - прием обновлений встроенным HTTP-сервером, cluster - один экземпляр-лидер получает
+# обновления и раздает их процессам-обработчикам
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
 # Инициализация бота и обработчика файлов
-bot = telebot.TeleBot(TOKEN)
-file_handler = FileHandler()
+# В режимах async_intake и webhook обработчики выполняются в своих пулах, а не в потоках TeleBot
+bot = telebot.TeleBot(TOKEN, threaded=BOT_MODE == 'polling')
+# Все запросы бота к API проходят через ограничитель частоты отправки
+outbound = OutboundDispatcher(
+    lambda chat_id, text, parse_mode: bot.send_message(chat_id, text, parse_mode=parse_mode)
+)
+telebot.apihelper.CUSTOM_REQUEST_SENDER = outbound.request_sender
+file_handler = FileHandler(storage_mode=os.getenv('STORAGE_MODE', 'plain'))
+file_id_cache = FileIdCache()
+archive_manager = ArchiveManager(file_handler)
+search_index = SearchIndex()
+
+# Большие файлы вместо отправки в Telegram отдаются встроенным HTTP-шлюзом
+# по подписанной ссылке; шлюз включается, если заданы секрет и внешний адрес
+GATEWAY_MIN_SIZE = int(os.getenv('GATEWAY_MIN_SIZE_MB', '20')) * 1024 * 1024
+download_gateway = None
+if os.getenv('GATEWAY_SECRET') and os.getenv('GATEWAY_URL'):
+    download_gateway = DownloadGateway(
+        file_handler,
+        os.getenv('GATEWAY_SECRET'),
+        os.getenv('GATEWAY_URL'),
+        host=os.getenv('GATEWAY_HOST', '0.0.0.0'),
+        port=int(os.getenv('GATEWAY_PORT', '8080')),
+        link_ttl=int(os.getenv('GATEWAY_LINK_TTL', '3600'))
+    )
 
-# Словарь для хранения информации о загружаемых файлах
-uploading_files = {}
 
-# Словарь для хранения текущего контекста пользователя
-user_context = {}
+def add_to_search_index(entry, text):
+    """Добавляет извлеченный в фоне текст документа в полнотекстовый индекс"""
+    search_index.add_document(entry['path'], text, entry['size'], entry['mtime'])
 
-# Путь к файлу статистики
-STATS_FILE = 'download_stats.json'
 
+# Текст документов извлекается в пуле процессов, индекс сохраняется в фоне
+extraction_pipeline = ExtractionPipeline(file_handler, on_result=add_to_search_index)
 
-# Загружаем статистику из файла при запуске
-def load_stats():
-    if os.path.exists(STATS_FILE):
-        with open(STATS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
 
+def update_search_index(event, entry):
+    """Обновляет полнотекстовый индекс при изменении каталога"""
+    if event == "added":
+        extraction_pipeline.submit(entry)
+    else:
+        search_index.remove_document(entry['path'])
 
-# Сохраняем статистику в файл
-def save_stats():
-    try:
-        with open(STATS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(download_stats, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        error_msg = f"Ошибка при сохранении статистики: {str(e)}"
-        log_error(error_msg, "system", "save_stats")
-        print(error_msg)  # Выводим ошибку в консоль для отладки
 
+def update_name_index(event, entry):
+    """Поддерживает триграммный индекс имен в синхронизации с каталогом"""
+    if event == "added":
+        name_index.add(entry['path'], entry['name'])
+    else:
+        name_index.remove(entry['path'])
+
+
+name_index = build_name_index(file_handler)
+file_handler.add_listener(update_name_index)
+
+# Как часто основной процесс кластерного режима находит файлы, загруженные
+# процессами-обработчиками, и отправляет их на индексацию
+CATALOG_SYNC_INTERVAL = int(os.getenv('CATALOG_SYNC_INTERVAL', '30'))
+
+
+def sync_search_index():
+    """Досинхронизирует полнотекстовый индекс с каталогом при запуске, а в кластерном режиме - периодически"""
+    while True:
+        try:
+            sync_with_catalog(search_index, file_handler, extraction_pipeline)
+        except Exception as e:
+            log_error(f"Ошибка синхронизации поискового индекса: {str(e)}", "system")
+        if BOT_MODE != 'cluster':
+            return
+        time.sleep(CATALOG_SYNC_INTERVAL)
+
+
+# Документы альбома приходят отдельными сообщениями: ждем их столько секунд,
+# прежде чем спросить категорию, и скачиваем не больше UPLOAD_WORKERS файлов сразу
+MEDIA_GROUP_WINDOW = 1.5
+UPLOAD_WORKERS = 4
+# Защищает добавление файлов альбома в состояние чата; {media_group_id: таймер запроса категории}
+uploads_lock = threading.Lock()
+media_group_timers = {}
+
+# Состояние диалогов по чатам: текущий шаг, выбранная категория, загружаемый файл,
+# режим чата с AI. Хранится вне процесса, поэтому переживает перезапуск бота
+state_store = create_state_store(os.getenv('STATE_STORE', 'sqlite:///state.db'))
+
+# Снапшот статистики и его журнал лежат в одной директории, которая монтируется
+# в контейнер целиком: журнал должен переживать пересоздание контейнера,
+# а снапшот - атомарно заменяться переименованием
+STATS_DIR = os.getenv('STATS_DIR', 'stats')
+STATS_FILE = os.path.join(STATS_DIR, 'download_stats.json')
+os.makedirs(STATS_DIR, exist_ok=True)
+# Переносим статистику из прежнего расположения в корне проекта
+for legacy_file in ('download_stats.json', 'download_stats.json.log'):
+    if os.path.isfile(legacy_file) and not os.path.exists(os.path.join(STATS_DIR, legacy_file)):
+        os.replace(legacy_file, os.path.join(STATS_DIR, legacy_file))
+
+# Размер части при потоковом скачивании загружаемых файлов
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Сколько найденных по имени файлов показывать; общее количество сообщается отдельно
+SEARCH_RESULTS_LIMIT = 50
 
-# Инициализируем статистику
-download_stats = load_stats()
 
-# Удаляем вебхук перед запуском
-bot.remove_webhook()
+# Инициализируем статистику: снапшот и журнал событий, дописываемый в фоне
+# В кластерном режиме статистику ведут несколько процессов одновременно
+stats_store = StatsStore(STATS_FILE, shared=BOT_MODE == 'cluster')
 
-# Установка команд бота
-bot.set_my_commands([
-    types.BotCommand("start", "Запустить бота и показать главное меню"),
-    types.BotCommand("files", "Показать список сохраненных файлов"),
-    types.BotCommand("get", "Скачать файл по имени"),
-    types.BotCommand("search", "Поиск файлов по части имени"),
-    types.BotCommand("help", "Показать справку по командам")
-])
+# Кэш имен пользователей для отображения статистики
+user_cache = UserCache()
+
+# Список файлов показывается постранично inline-кнопками
+BROWSER_PAGE_SIZE = 10
+
+# Подробная статистика показывается постранично
+STATS_PAGE_SIZE = 5
+STATS_USERS_PER_FILE = 10
+ARCHIVE_STATS_NAME = "📦 programming-documentation.zip"
+# Кэш построенных страниц статистики для текущей версии статистики
+stats_pages = {'version': None, 'pages': {}}
+stats_pages_lock = threading.Lock()
+
+
+@bot.middleware_handler(update_types=['message'])
+def remember_user(bot_instance, message):
+    """Запоминает имя отправителя, чтобы не запрашивать его у Telegram при показе статистики"""
+    user_cache.remember(message.from_user)
+
+
+def resolve_user_names(chat_id, user_ids):
+    """Возвращает имена пользователей из кэша, запрашивая у Telegram только неизвестных"""
+    return user_cache.resolve_many(
+        user_ids,
+        lambda user_id: bot.get_chat_member(chat_id, int(user_id)).user
+    )
+
+
+def start_main_process():
+    """
+    Выполняет запуск, нужный один раз на экземпляр бота
+
+    Вызывается только в основном процессе: процессы-обработчики кластерного
+    режима заново импортируют модуль и не должны повторять установку команд
+    и индексацию. Полнотекстовый индекс пишет только основной процесс со своим
+    пулом извлечения текста, обработчики лишь читают сохраненный индекс.
+    """
+    # Установка команд бота
+    bot.set_my_commands([
+        types.BotCommand("start", "Запустить бота и показать главное меню"),
+        types.BotCommand("files", "Показать список сохраненных файлов"),
+        types.BotCommand("get", "Скачать файл по имени"),
+        types.BotCommand("search", "Поиск файлов по части имени"),
+        types.BotCommand("archive", "Скачать архив категории"),
+        types.BotCommand("help", "Показать справку по командам")
+    ])
+    file_handler.add_listener(update_search_index)
+    # Досинхронизируем индекс с каталогом в фоне, чтобы не задерживать запуск
+    threading.Thread(target=sync_search_index, daemon=True).start()
 
 
 def create_main_menu():
@@ -188,26 +323,6 @@ def create_subcategory_menu(category):
     return markup
 
 
-def create_files_menu(files, category, subcategory=None):
-    """Создает меню со списком файлов для скачивания"""
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-
-    # Сначала добавляем кнопки навигации
-    nav_buttons = []
-    if subcategory:
-        nav_buttons.append(types.KeyboardButton('⬅️ Назад к подкатегориям'))
-    nav_buttons.append(types.KeyboardButton('⬅️ Назад к категориям'))
-    nav_buttons.append(types.KeyboardButton('🔙 Вернуться в главное меню'))
-    markup.add(*nav_buttons)
-
-    # Затем добавляем кнопки для каждого файла
-    for file in files:
-        btn = types.KeyboardButton(f"📥 {file['name']}")
-        markup.add(btn)
-
-    return markup
-
-
 def create_additional_menu():
     """Создает меню дополнительных функций"""
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
@@ -217,13 +332,18 @@ def create_additional_menu():
     btn4 = types.KeyboardButton('👤 Мои скачивания')
     btn5 = types.KeyboardButton('📦 Скачать архив со всеми файлами')
     btn6 = types.KeyboardButton('🤖 Чат с AI')
-    markup.add(btn1, btn2, btn3, btn4, btn5, btn6)
+    btn7 = types.KeyboardButton('⏱ За 24 часа')
+    btn8 = types.KeyboardButton('🗓 За 7 дней')
+    btn9 = types.KeyboardButton('📅 За месяц')
+    markup.add(btn1, btn2, btn3, btn4, btn5, btn6, btn7, btn8, btn9)
     return markup
 
 
 @bot.message_handler(commands=['start'])
 def start(message):
     """Обработчик команды /start"""
+    # Начинаем с главного меню: незавершенный диалог отменяется
+    state_store.clear(message.chat.id, 'step', 'uploads', 'upload_group', 'upload_category')
     markup = create_main_menu()
     bot.send_message(
         message.chat.id,
@@ -242,6 +362,7 @@ def help_command(message):
         "/files - Показать список сохраненных файлов\n"
         "/get filename - Скачать файл по имени\n"
         "/search query - Поиск файлов по части имени\n"
+        "/archive Категория[/Подкатегория] - Скачать архив категории\n"
         "/help - Показать это сообщение\n\n"
         "Также вы можете использовать кнопки меню для навигации."
     )
@@ -268,7 +389,7 @@ def show_categories(message, view_only=False):
 def show_subcategories(message, category):
     """Показывает меню с подкатегориями"""
     # Сохраняем текущую категорию в контексте пользователя
-    user_context[message.chat.id] = {'category': category}
+    state_store.update(message.chat.id, category=category, subcategory=None)
 
     markup = create_subcategory_menu(category)
     bot.send_message(
@@ -279,59 +400,266 @@ def show_subcategories(message, category):
 
 
 def list_files(message, category, subcategory=None):
-    """Показывает список файлов в выбранной категории или подкатегории"""
-    # Сохраняем текущий контекст
-    user_context[message.chat.id] = {
-        'category': category,
-        'subcategory': subcategory
-    }
-
-    files = file_handler.get_files_list(category, subcategory)
-    if not files:
-        if subcategory:
-            markup = create_subcategory_menu(category)
-            bot.send_message(
-                message.chat.id,
-                f"📭 В подкатегории {subcategory} категории {category} пока нет файлов.",
-                reply_markup=markup
-            )
-        else:
-            markup = create_category_menu()
-            bot.send_message(
-                message.chat.id,
-                f"📭 В категории {category} пока нет файлов.",
-                reply_markup=markup
-            )
+    """Показывает первую страницу файлов выбранной категории или подкатегории"""
+    if category not in file_handler.categories or (
+            subcategory and subcategory not in file_handler.subcategories.get(category, [])):
+        bot.send_message(message.chat.id, "❌ Категория не найдена", reply_markup=create_category_menu())
         return
 
-    response = f"📁 Файлы в "
+    # Сохраняем текущий контекст
+    state_store.update(message.chat.id, category=category, subcategory=subcategory)
+
+    category_index = file_handler.categories.index(category)
+    subcategory_index = None
     if subcategory:
-        response += f"подкатегории {subcategory} категории {category}:\n\n"
-    else:
-        response += f"категории {category}:\n\n"
+        subcategory_index = file_handler.subcategories[category].index(subcategory)
+    text, markup = render_location_page(category_index, subcategory_index, 0)
+    bot.send_message(message.chat.id, text, reply_markup=markup)
+
+
+def page_buttons(prefix, page, pages_count):
+    """Возвращает кнопки перехода между страницами с callback-данными prefix + номер страницы"""
+    buttons = []
+    if page > 0:
+        buttons.append(types.InlineKeyboardButton('⬅️', callback_data=f"{prefix}{page - 1}"))
+    buttons.append(types.InlineKeyboardButton(f"{page + 1}/{pages_count}", callback_data=f"{prefix}{page}"))
+    if page < pages_count - 1:
+        buttons.append(types.InlineKeyboardButton('➡️', callback_data=f"{prefix}{page + 1}"))
+    return buttons
+
+
+def edit_inline_message(call, text, markup, parse_mode=None):
+    """Заменяет текст и клавиатуру сообщения, на кнопку которого нажали"""
+    try:
+        bot.edit_message_text(
+            text,
+            call.message.chat.id,
+            call.message.message_id,
+            parse_mode=parse_mode,
+            reply_markup=markup
+        )
+    except telebot.apihelper.ApiTelegramException as e:
+        # Повторное нажатие на текущую страницу не меняет сообщение
+        if 'message is not modified' not in str(e):
+            raise
+
+
+def browser_entry_id(category, subcategory, file_name):
+    """Возвращает короткий идентификатор файла для callback-данных кнопки (не больше 64 байт)"""
+    key = f"{category}/{subcategory or ''}/{file_name}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
 
-    # Сначала показываем подкатегории, если они есть
-    if not subcategory and category in file_handler.subcategories:
-        response += "📂 Подкатегории:\n"
-        for subcat in file_handler.subcategories[category]:
-            response += f"📁 {subcat}\n"
-        response += "\n"
 
-    # Затем показываем файлы
-    response += "📑 Файлы:\n"
+def browser_file_data(category, subcategory, file_name):
+    """
+    Возвращает callback-данные кнопки файла: индексы папки каталога и идентификатор имени
+
+    Папка хранится в самой кнопке, поэтому бот не держит таблицу идентификаторов,
+    а кнопки старых сообщений продолжают работать после перезапуска.
+    """
+    category_index = file_handler.categories.index(category)
+    subcategory_index = ''
+    if subcategory:
+        subcategory_index = file_handler.subcategories[category].index(subcategory)
+    entry_id = browser_entry_id(category, subcategory, file_name)
+    return f"browse:f:{category_index}:{subcategory_index}:{entry_id}"
+
+
+def find_browser_entry(category_index, subcategory_index, entry_id):
+    """Находит файл по данным кнопки, просматривая только ее папку каталога"""
+    try:
+        category = file_handler.categories[int(category_index)]
+        subcategory = None
+        if subcategory_index:
+            subcategory = file_handler.subcategories[category][int(subcategory_index)]
+    except (ValueError, IndexError, KeyError):
+        return None
+    for file in file_handler.get_files_list(category, subcategory):
+        if browser_entry_id(category, subcategory, file['name']) == entry_id:
+            return file_handler.get_file_entry(file['name'], category, subcategory)
+    return None
+
+
+def add_file_buttons(markup, files):
+    """Добавляет кнопки скачивания файлов страницы, по одной в строке"""
     for file in files:
-        file_path = f"{category}"
-        if 'subcategory' in file:
-            file_path += f"/{file['subcategory']}"
-        file_path += f"/{file['name']}"
+        callback_data = browser_file_data(file['category'], file.get('subcategory'), file['name'])
+        markup.add(types.InlineKeyboardButton(f"📥 {file['name']}", callback_data=callback_data))
+
 
+def render_file_lines(files, with_path=False):
+    """Формирует описание файлов страницы"""
+    response = ""
+    for file in files:
         response += f"📄 {file['name']}\n"
-        response += f"📂 Путь: {file_path}\n"
+        if with_path:
+            response += f"📂 Путь: {file['category']}"
+            if 'subcategory' in file:
+                response += f"/{file['subcategory']}"
+            response += "\n"
         response += f"📊 Размер: {file['size']}\n"
         response += f"🕒 Дата: {file['date']}\n\n"
+    return response
+
+
+def render_browser_categories():
+    """Строит страницу выбора категории"""
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    markup.add(*[
+        types.InlineKeyboardButton(f"📂 {category}", callback_data=f"browse:l:{i}::0")
+        for i, category in enumerate(file_handler.categories)
+    ])
+    markup.add(types.InlineKeyboardButton("📚 Все файлы", callback_data="browse:a:0"))
+    return "📋 Выберите категорию для просмотра списка файлов:", markup
+
+
+def render_location_page(category_index, subcategory_index, page):
+    """Строит страницу файлов категории или подкатегории по индексу каталога"""
+    category = file_handler.categories[category_index]
+    subcategory = None
+    if subcategory_index is not None:
+        subcategory = file_handler.subcategories[category][subcategory_index]
+
+    files = sorted(file_handler.get_files_list(category, subcategory), key=lambda x: x['name'])
+    pages_count = max(1, (len(files) + BROWSER_PAGE_SIZE - 1) // BROWSER_PAGE_SIZE)
+    page = min(max(page, 0), pages_count - 1)
+    page_files = files[page * BROWSER_PAGE_SIZE:(page + 1) * BROWSER_PAGE_SIZE]
+
+    markup = types.InlineKeyboardMarkup(row_width=3)
+    if subcategory:
+        response = f"📁 Файлы в подкатегории {subcategory} категории {category}"
+    else:
+        response = f"📁 Файлы в категории {category}"
+        # Подкатегории показываем кнопками перед файлами
+        subcategories = file_handler.subcategories.get(category, [])
+        if subcategories:
+            markup.add(*[
+                types.InlineKeyboardButton(f"📁 {subcat}", callback_data=f"browse:l:{category_index}:{i}:0")
+                for i, subcat in enumerate(subcategories)
+            ])
+
+    if files:
+        response += f" ({len(files)}):\n\n" + render_file_lines(page_files)
+    else:
+        response += ":\n\n📭 Пока нет файлов."
 
-    markup = create_files_menu(files, category, subcategory)
-    bot.send_message(message.chat.id, response, reply_markup=markup)
+    add_file_buttons(markup, page_files)
+    if pages_count > 1:
+        markup.add(*page_buttons(f"browse:l:{category_index}:{'' if subcategory_index is None else subcategory_index}:", page, pages_count))
+    if subcategory:
+        markup.add(types.InlineKeyboardButton(f"⬅️ {category}", callback_data=f"browse:l:{category_index}::0"))
+    markup.add(types.InlineKeyboardButton("⬅️ Категории", callback_data="browse:c"))
+    return response, markup
+
+
+def render_all_files_page(page):
+    """Строит страницу списка всех файлов каталога"""
+    all_files = file_handler.get_all_files()
+    if not all_files:
+        return "📭 Файлы не найдены", None
+
+    # Сортируем файлы по категории, подкатегории и имени
+    all_files.sort(key=lambda x: (x['category'], x.get('subcategory', ''), x['name']))
+    pages_count = (len(all_files) + BROWSER_PAGE_SIZE - 1) // BROWSER_PAGE_SIZE
+    page = min(max(page, 0), pages_count - 1)
+    page_files = all_files[page * BROWSER_PAGE_SIZE:(page + 1) * BROWSER_PAGE_SIZE]
+
+    response = f"📊 СТАТИСТИКА ФАЙЛОВ\n📚 Всего файлов в системе: {len(all_files)}\n\n"
+    response += render_file_lines(page_files, with_path=True)
+
+    markup = types.InlineKeyboardMarkup(row_width=3)
+    add_file_buttons(markup, page_files)
+    if pages_count > 1:
+        markup.add(*page_buttons("browse:a:", page, pages_count))
+    markup.add(types.InlineKeyboardButton("📂 По категориям", callback_data="browse:c"))
+    return response, markup
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('browse:'))
+def browser_callback(call):
+    """Обрабатывает кнопки просмотра каталога: переходы редактируют сообщение, файлы отправляются"""
+    parts = call.data.split(':')
+    action = parts[1]
+    if action == 'f':
+        entry = find_browser_entry(*parts[2:5]) if len(parts) == 5 else None
+        if entry is None:
+            bot.answer_callback_query(call.id, "❌ Файл не найден", show_alert=True)
+            return
+        bot.answer_callback_query(call.id)
+        try:
+            send_stored_file(call.message.chat.id, entry)
+            # Обновляем статистику скачиваний
+            stats_store.record(entry['name'], call.from_user.id)
+        except Exception as e:
+            error_msg = f"Произошла ошибка при получении файла: {str(e)}"
+            log_error(error_msg, call.from_user.id, f"File: {entry['name']}")
+            bot.send_message(call.message.chat.id, f"❌ {error_msg}")
+        return
+
+    if action == 'c':
+        text, markup = render_browser_categories()
+    elif action == 'a':
+        text, markup = render_all_files_page(int(parts[2]))
+    else:
+        subcategory_index = int(parts[3]) if parts[3] else None
+        text, markup = render_location_page(int(parts[2]), subcategory_index, int(parts[4]))
+    edit_inline_message(call, text, markup)
+    bot.answer_callback_query(call.id)
+
+
+def send_stored_file(chat_id, entry):
+    """Отправляет файл из хранилища, повторно используя file_id, если файл не менялся"""
+    if download_gateway and entry['size'] >= GATEWAY_MIN_SIZE:
+        bot.send_message(
+            chat_id,
+            f"📥 {entry['name']} ({entry['size'] / (1024 * 1024):.1f} МБ)\n"
+            f"Файл большой, скачайте его по ссылке (действует {download_gateway.link_ttl // 60} мин):\n"
+            f"{download_gateway.make_link(entry)}",
+            disable_web_page_preview=True
+        )
+        return
+
+    cache_key, cache_mtime = file_id_cache_key(entry)
+    send_cached_document(
+        chat_id,
+        file_handler.get_file_path(entry),
+        entry['name'],
+        cache_key,
+        entry['size'],
+        cache_mtime
+    )
+
+
+def send_cached_document(chat_id, file_path, visible_file_name, cache_key, size, version, caption=None):
+    """Отправляет документ по file_id из кэша, а при его отсутствии загружает файл и запоминает file_id"""
+    file_id = file_id_cache.get(cache_key, size, version)
+    if file_id:
+        try:
+            bot.send_document(chat_id, file_id, caption=caption)
+            return
+        except telebot.apihelper.ApiTelegramException as e:
+            # Telegram больше не принимает этот file_id - загружаем файл заново
+            logger.warning(f"Не удалось отправить {cache_key} по file_id: {e}")
+            file_id_cache.invalidate(cache_key)
+
+    with open(file_path, 'rb') as f:
+        sent = bot.send_document(chat_id, f, visible_file_name=visible_file_name, caption=caption)
+    if sent and sent.document:
+        file_id_cache.put(cache_key, size, version, sent.document.file_id)
+
+
+def file_id_cache_key(entry):
+    """
+    Возвращает ключ кэша file_id и mtime для проверки актуальности
+
+    Если хеш содержимого известен, ключ строится по содержимому и имени файла:
+    одинаковые файлы в разных категориях используют один file_id. Имя входит
+    в ключ, потому что при отправке по file_id Telegram показывает имя,
+    с которым файл был загружен впервые.
+    """
+    if entry.get('sha256'):
+        return f"sha256:{entry['sha256']}:{entry['name']}", None
+    return entry['path'], entry['mtime']
 
 
 @bot.message_handler(commands=['files'])
@@ -351,38 +679,28 @@ def get_command(message):
             return
 
         file_name = parts[1].strip()
-        found = False
-
-        # Ищем файл во всех категориях и подкатегориях
-        for category in file_handler.categories:
-            file_data = file_handler.get_file(file_name, category)
-            if file_data is not None:
-                bot.send_document(
-                    message.chat.id,
-                    file_data,
-                    visible_file_name=file_name
-                )
-                found = True
-                break
 
-            if category in file_handler.subcategories:
-                for subcategory in file_handler.subcategories[category]:
-                    file_data = file_handler.get_file(file_name, category, subcategory)
-                    if file_data is not None:
-                        bot.send_document(
-                            message.chat.id,
-                            file_data,
-                            visible_file_name=file_name
-                        )
-                        found = True
-                        break
-                if found:
-                    break
+        # Путь вида Категория/[Подкатегория/]имя указывает файл однозначно
+        if '/' in file_name:
+            entry = file_handler.resolve_path(file_name)
+            matches = [entry] if entry else []
+        else:
+            matches = file_handler.resolve(file_name)
 
-        if not found:
+        if not matches:
             error_msg = f"Файл {file_name} не найден"
             log_error(error_msg, message.from_user.id, f"Command: /get {file_name}")
-            bot.reply_to(message, f"❌ {error_msg}")
+            response = f"❌ {error_msg}"
+            suggestions = suggest_file_names(file_name)
+            if suggestions:
+                response += "\n\n💡 Возможно, вы имели в виду:\n" + "\n".join(f"/get {name}" for name in suggestions)
+            bot.reply_to(message, response)
+        elif len(matches) > 1:
+            response = f"📂 Найдено несколько файлов с именем {file_name}. Укажите путь:\n\n"
+            response += "\n".join(f"/get {entry['path']}" for entry in matches)
+            bot.reply_to(message, response)
+        else:
+            send_stored_file(message.chat.id, matches[0])
     except Exception as e:
         error_msg = f"Произошла ошибка при получении файла: {str(e)}"
         log_error(error_msg, message.from_user.id,
@@ -406,35 +724,77 @@ def handle_document(message):
             bot.reply_to(message, f"❌ {error_msg}")
             return
 
-        # Сохраняем информацию о файле
-        uploading_files[message.chat.id] = {
+        file_info = {
             'file_id': message.document.file_id,
-            'file_name': message.document.file_name
+            'file_name': message.document.file_name,
+            'file_unique_id': message.document.file_unique_id
         }
+        media_group_id = message.media_group_id
+        with uploads_lock:
+            # Документы одного альбома собираются вместе, отдельный документ заменяет прежний
+            state = state_store.get(message.chat.id)
+            uploads = []
+            if media_group_id and state.get('upload_group') == media_group_id:
+                uploads = state.get('uploads', [])
+            uploads.append(file_info)
+            # Следующее сообщение - выбор категории
+            state_store.update(
+                message.chat.id,
+                step='upload_category',
+                uploads=uploads,
+                upload_group=media_group_id,
+                upload_category=None
+            )
+            if media_group_id:
+                # Категорию спрашиваем один раз, когда придут все документы альбома
+                if media_group_id not in media_group_timers:
+                    timer = threading.Timer(
+                        MEDIA_GROUP_WINDOW, ask_upload_category, args=(message.chat.id, media_group_id)
+                    )
+                    timer.daemon = True
+                    media_group_timers[media_group_id] = timer
+                    timer.start()
+                return
 
-        markup = create_category_menu()
-        bot.send_message(
-            message.chat.id,
-            "📂 Выберите категорию для файла:",
-            reply_markup=markup
-        )
-        bot.register_next_step_handler(message, process_category_selection)
+        ask_upload_category(message.chat.id)
     except Exception as e:
         error_msg = f"Ошибка при обработке документа: {str(e)}"
         log_error(error_msg, message.from_user.id)
         bot.reply_to(message, f"❌ {error_msg}")
 
 
+def ask_upload_category(chat_id, media_group_id=None):
+    """Предлагает выбрать категорию для загружаемых файлов"""
+    try:
+        if media_group_id:
+            with uploads_lock:
+                media_group_timers.pop(media_group_id, None)
+        state = state_store.get(chat_id)
+        if state.get('step') != 'upload_category' or not state.get('uploads'):
+            # Категорию уже выбрали или загрузку отменили
+            return
+
+        count = len(state['uploads'])
+        text = "📂 Выберите категорию для файла:" if count == 1 else f"📂 Выберите категорию для {count} файлов:"
+        markup = create_category_menu()
+        bot.send_message(chat_id, text, reply_markup=markup)
+    except Exception as e:
+        log_error(f"Ошибка при выборе категории для загрузки: {str(e)}", chat_id)
+
+
 def process_category_selection(message):
     """Обработчик выбора категории"""
     if message.text == '🔙 Вернуться в главное меню':
         markup = create_main_menu()
         bot.send_message(message.chat.id, "Главное меню:", reply_markup=markup)
-        # Очищаем контекст при возврате в главное меню
-        user_context.pop(message.chat.id, None)
+        # Очищаем контекст и отменяем загрузку при возврате в главное меню
+        state_store.clear(message.chat.id, 'category', 'subcategory', 'step', 'uploads', 'upload_group')
         return
 
-    category = message.text[2:].strip() if message.text.startswith('📂 ') else "Other"
+    if message.text == '📚 Книги':
+        category = "Книги"
+    else:
+        category = message.text[2:].strip() if message.text.startswith('📂 ') else "Other"
 
     if category in file_handler.subcategories:
         markup = create_subcategory_menu(category)
@@ -443,7 +803,7 @@ def process_category_selection(message):
             f"📁 Выберите подкатегорию в {category}:",
             reply_markup=markup
         )
-        bot.register_next_step_handler(message, lambda m: process_subcategory_selection(m, category))
+        state_store.update(message.chat.id, step='upload_subcategory', upload_category=category)
     else:
         save_file_to_category(message, category)
 
@@ -453,13 +813,15 @@ def process_subcategory_selection(message, category):
     if message.text == '🔙 Вернуться в главное меню':
         markup = create_main_menu()
         bot.send_message(message.chat.id, "Главное меню:", reply_markup=markup)
-        # Очищаем контекст при возврате в главное меню
-        user_context.pop(message.chat.id, None)
+        # Очищаем контекст и отменяем загрузку при возврате в главное меню
+        state_store.clear(
+            message.chat.id, 'category', 'subcategory', 'step', 'uploads', 'upload_group', 'upload_category'
+        )
         return
     elif message.text == '⬅️ Назад к категориям':
-        show_categories(message)
-        # Очищаем контекст при возврате к категориям
-        user_context.pop(message.chat.id, None)
+        # Возвращаемся к выбору категории для загружаемых файлов
+        state_store.update(message.chat.id, step='upload_category', upload_category=None)
+        ask_upload_category(message.chat.id)
         return
 
     subcategory = message.text[2:].strip() if message.text.startswith('📁 ') else None
@@ -475,129 +837,120 @@ def process_subcategory_selection(message, category):
         )
 
 
-def save_file_to_category(message, category, subcategory=None):
-    """Сохранение файла в выбранную категорию"""
-    try:
-        # Получаем информацию о файле из словаря
-        file_info = uploading_files.get(message.chat.id)
-        if not file_info:
-            error_msg = "Информация о файле не найдена"
-            log_error(error_msg, message.from_user.id)
-            bot.reply_to(message, f"❌ {error_msg}")
-            return
-
-        # Проверяем, существует ли файл с таким именем
-        existing_files = file_handler.get_files_list(category, subcategory)
-        for file in existing_files:
-            if file['name'] == file_info['file_name']:
-                error_msg = f"Файл с именем {file_info['file_name']} уже существует в этой категории"
-                log_error(error_msg, message.from_user.id, f"Category: {category}, Subcategory: {subcategory}")
-                markup = create_main_menu()
-                bot.send_message(
-                    message.chat.id,
-                    f"❌ {error_msg}",
-                    reply_markup=markup
-                )
-                uploading_files.pop(message.chat.id, None)
-                return
+def iter_telegram_file(file_path, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Скачивает файл с серверов Telegram по частям, не держа его целиком в памяти"""
+    if telebot.apihelper.FILE_URL is None:
+        url = f"https://api.telegram.org/file/bot{TOKEN}/{file_path}"
+    else:
+        url = telebot.apihelper.FILE_URL.format(TOKEN, file_path)
 
-        file_data = bot.get_file(file_info['file_id'])
-        if not file_data:
-            error_msg = "Не удалось получить информацию о файле"
-            log_error(error_msg, message.from_user.id)
-            bot.reply_to(message, f"❌ {error_msg}")
-            return
+    with requests.get(url, proxies=telebot.apihelper.proxy, stream=True, timeout=60) as response:
+        if response.status_code != 200:
+            raise telebot.apihelper.ApiHTTPException('Download file', response)
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if chunk:
+                yield chunk
 
-        downloaded_file = bot.download_file(file_data.file_path)
-        if not downloaded_file:
-            error_msg = "Не удалось скачать файл"
-            log_error(error_msg, message.from_user.id)
-            bot.reply_to(message, f"❌ {error_msg}")
-            return
 
-        file_handler.save_file(
-            file_info['file_id'],
-            file_info['file_name'],
-            downloaded_file,
-            category,
-            subcategory
-        )
+def save_file_to_category(message, category, subcategory=None):
+    """Сохранение загружаемых файлов в выбранную категорию"""
+    # Получаем информацию о файлах из состояния чата; выбор категории завершен
+    uploads = state_store.get(message.chat.id).get('uploads')
+    state_store.clear(message.chat.id, 'step', 'uploads', 'upload_group', 'upload_category')
+    if not uploads:
+        error_msg = "Информация о файле не найдена"
+        log_error(error_msg, message.from_user.id)
+        bot.reply_to(message, f"❌ {error_msg}")
+        return
 
-        # Удаляем информацию о файле после успешного сохранения
-        uploading_files.pop(message.chat.id, None)
-
-        markup = create_main_menu()
-        location = f"подкатегорию {subcategory} категории {category}" if subcategory else f"категорию {category}"
-        bot.send_message(
-            message.chat.id,
-            f"✅ Файл {file_info['file_name']} успешно сохранен в {location}!",
-            reply_markup=markup
-        )
-    except Exception as e:
-        # Удаляем информацию о файле в случае ошибки
-        uploading_files.pop(message.chat.id, None)
-        error_msg = f"Произошла ошибка при сохранении файла: {str(e)}"
-        log_error(error_msg, message.from_user.id, f"Category: {category}, Subcategory: {subcategory}")
-        markup = create_main_menu()
-        bot.send_message(
-            message.chat.id,
-            f"❌ {error_msg}",
-            reply_markup=markup
-        )
+    # Файлы альбома скачиваются параллельно, но не больше UPLOAD_WORKERS одновременно
+    with ThreadPoolExecutor(max_workers=min(UPLOAD_WORKERS, len(uploads))) as executor:
+        results = list(executor.map(
+            lambda file_info: store_uploaded_file(message, file_info, category, subcategory),
+            uploads
+        ))
 
+    location = f"подкатегорию {subcategory} категории {category}" if subcategory else f"категорию {category}"
+    if len(results) == 1:
+        response = results[0][1]
+    else:
+        saved = sum(1 for ok, _ in results if ok)
+        response = f"📦 Сохранено файлов в {location}: {saved} из {len(results)}\n\n"
+        response += "\n\n".join(text for _, text in results)
 
-def show_all_files(message):
-    """Показывает все файлы из всех категорий и подкатегорий"""
-    all_files = []
+    markup = create_main_menu()
+    bot.send_message(
+        message.chat.id,
+        response,
+        reply_markup=markup
+    )
 
-    # Собираем файлы из всех категорий и подкатегорий
-    for category in file_handler.categories:
-        # Получаем файлы из основной категории
-        files = file_handler.get_files_list(category)
-        for file in files:
-            file['category'] = category
-            all_files.append(file)
 
-        # Получаем файлы из подкатегорий
-        if category in file_handler.subcategories:
-            for subcategory in file_handler.subcategories[category]:
-                files = file_handler.get_files_list(category, subcategory)
-                for file in files:
-                    file['category'] = category
-                    file['subcategory'] = subcategory
-                    all_files.append(file)
+def store_uploaded_file(message, file_info, category, subcategory=None):
+    """
+    Скачивает загруженный файл в хранилище
 
-    if not all_files:
-        bot.send_message(message.chat.id, "📭 Файлы не найдены")
-        return
+    Returns:
+        tuple: (сохранен ли файл, сообщение для пользователя)
+    """
+    location = f"подкатегорию {subcategory} категории {category}" if subcategory else f"категорию {category}"
+    try:
+        # Проверяем, существует ли файл с таким именем, чтобы не скачивать его зря;
+        # одновременную загрузку файла с тем же именем отсекает само сохранение
+        if file_handler.file_exists(file_info['file_name'], category, subcategory):
+            return duplicate_upload(message, file_info, category, subcategory)
+
+        # Если такое содержимое уже сохранялось, не скачиваем файл повторно
+        sha256 = file_handler.find_stored_content(file_info.get('file_unique_id'))
+        if sha256:
+            save_path = file_handler.save_stored_content(
+                file_info['file_name'], sha256, category, subcategory, overwrite=False
+            )
+        else:
+            file_data = bot.get_file(file_info['file_id'])
+            if not file_data:
+                error_msg = "Не удалось получить информацию о файле"
+                log_error(error_msg, message.from_user.id)
+                return False, f"❌ {file_info['file_name']}: {error_msg}"
+
+            # Скачиваем файл по частям сразу во временный файл хранилища
+            save_path, sha256 = file_handler.save_stream(
+                file_info['file_name'],
+                iter_telegram_file(file_data.file_path),
+                category,
+                subcategory,
+                file_info.get('file_unique_id'),
+                overwrite=False
+            )
 
-    # Сортируем файлы по категории, подкатегории и имени
-    all_files.sort(key=lambda x: (x['category'], x.get('subcategory', ''), x['name']))
+        # Сообщаем, если такое же содержимое уже есть под другим именем или в другой категории
+        saved_rel_path = os.path.relpath(save_path, file_handler.base_dir)
+        copies = [path for path in file_handler.find_copies(sha256) if path != saved_rel_path]
+
+        response = f"✅ Файл {file_info['file_name']} успешно сохранен в {location}!"
+        if copies:
+            response += "\n\n♻️ Такой же файл уже есть в хранилище, место на диске не занято:\n"
+            response += "\n".join(f"📂 {path}" for path in copies)
+        return True, response
+    except FileExistsError:
+        return duplicate_upload(message, file_info, category, subcategory)
+    except Exception as e:
+        error_msg = f"Произошла ошибка при сохранении файла {file_info['file_name']}: {str(e)}"
+        log_error(error_msg, message.from_user.id, f"Category: {category}, Subcategory: {subcategory}")
+        return False, f"❌ {error_msg}"
 
-    # Отправляем общее количество файлов с эмодзи и выделением
-    total_files = len(all_files)
-    counter_message = f"📊 *СТАТИСТИКА ФАЙЛОВ*\n\n📚 Всего файлов в системе: *{total_files}*"
-    bot.send_message(message.chat.id, counter_message, parse_mode='Markdown')
 
-    # Разбиваем список на части по 10 файлов
-    for i in range(0, len(all_files), 10):
-        chunk = all_files[i:i + 10]
-        response = ""
-        for file in chunk:
-            response += f"📄 {file['name']}\n"
-            response += f"📂 Путь: {file['category']}"
-            if 'subcategory' in file:
-                response += f"/{file['subcategory']}"
-            response += f"\n📊 Размер: {file['size']}\n"
-            response += f"🕒 Дата: {file['date']}\n\n"
+def duplicate_upload(message, file_info, category, subcategory=None):
+    """Возвращает результат загрузки файла, имя которого в категории уже занято"""
+    error_msg = f"Файл с именем {file_info['file_name']} уже существует в этой категории"
+    log_error(error_msg, message.from_user.id, f"Category: {category}, Subcategory: {subcategory}")
+    return False, f"❌ {error_msg}"
 
-        # Отправляем часть списка
-        if response:  # Отправляем только если есть что отправлять
-            bot.send_message(message.chat.id, response)
 
-    # Отправляем статистику еще раз в конце с эмодзи стрелочки вверх
-    final_counter_message = f"⬆️ *СТАТИСТИКА ФАЙЛОВ*\n\n📚 Всего файлов в системе: *{total_files}*"
-    bot.send_message(message.chat.id, final_counter_message, parse_mode='Markdown')
+def show_all_files(message):
+    """Показывает первую страницу списка всех файлов из всех категорий и подкатегорий"""
+    text, markup = render_all_files_page(0)
+    bot.send_message(message.chat.id, text, reply_markup=markup)
 
 
 def search_files(message):
@@ -609,60 +962,71 @@ def search_files(message):
         bot.reply_to(message, "🔍 Укажите поисковый запрос\nПример: docker")
         return
 
-    # Собираем все файлы
-    all_files = []
-    for category in file_handler.categories:
-        # Получаем файлы из основной категории
-        files = file_handler.get_files_list(category)
-        for file in files:
-            file['category'] = category
-            all_files.append(file)
-
-        # Получаем файлы из подкатегорий
-        if category in file_handler.subcategories:
-            for subcategory in file_handler.subcategories[category]:
-                files = file_handler.get_files_list(category, subcategory)
-                for file in files:
-                    file['category'] = category
-                    file['subcategory'] = subcategory
-                    all_files.append(file)
-
-    # Ищем файлы, содержащие поисковый запрос
-    found_files = []
+    # Запрос "книги" показывает всю категорию книг
     search_query = search_query.lower()
-    for file in all_files:
-        # Проверяем имя файла и категорию
-        if (search_query in file['name'].lower() or
-                (search_query == 'книги' and file['category'] == 'Книги') or
-                (search_query == '📚 книги' and file['category'] == 'Книги')):
-            found_files.append(file)
-
-    if not found_files:
-        bot.reply_to(message, f"🔍 По запросу '{search_query}' ничего не найдено")
+    if search_query in ('книги', '📚 книги'):
+        found_files = file_handler.get_files_list('Книги')
+    else:
+        # Ищем похожие имена по триграммному индексу, лучшие совпадения первыми
+        found_files = []
+        for path, similarity in name_index.search(search_query, limit=None):
+            entry = file_handler.resolve_path(path)
+            if entry:
+                found_files.append(file_handler.get_file_info(entry))
+
+    # Ищем запрос в тексте документов
+    text_results = []
+    for path, score, snippet in search_index.search(search_query, limit=10):
+        entry = file_handler.resolve_path(path)
+        if entry:
+            text_results.append((entry, snippet))
+
+    if not found_files and not text_results:
+        response = f"🔍 По запросу '{search_query}' ничего не найдено"
+        suggestions = suggest_file_names(search_query)
+        if suggestions:
+            response += "\n\n💡 Возможно, вы имели в виду:\n" + "\n".join(f"📄 {name}" for name in suggestions)
+        bot.reply_to(message, response)
         return
 
-    # Сортируем найденные файлы
-    found_files.sort(key=lambda x: (x['category'], x.get('subcategory', ''), x['name']))
-
     # Отправляем статистику поиска
     total_found = len(found_files)
     counter_message = f"🔍 *РЕЗУЛЬТАТЫ ПОИСКА*\n\n📚 Найдено файлов: *{total_found}*\n🔎 Поисковый запрос: *{search_query}*"
+    if total_found > SEARCH_RESULTS_LIMIT:
+        counter_message += f"\n📋 Показаны первые {SEARCH_RESULTS_LIMIT}, уточните запрос"
     bot.send_message(message.chat.id, counter_message, parse_mode='Markdown')
 
-    # Отправляем найденные файлы
-    for i in range(0, len(found_files), 10):
-        chunk = found_files[i:i + 10]
-        response = ""
-        for file in chunk:
-            response += f"📄 {file['name']}\n"
-            response += f"📂 Путь: {file['category']}"
-            if 'subcategory' in file:
-                response += f"/{file['subcategory']}"
-            response += f"\n📊 Размер: {file['size']}\n"
-            response += f"🕒 Дата: {file['date']}\n\n"
-
-        if response:
-            bot.send_message(message.chat.id, response)
+    # Отправляем найденные файлы: описания склеиваются в сообщения до 4096 символов
+    for file in found_files[:SEARCH_RESULTS_LIMIT]:
+        response = f"📄 {file['name']}\n"
+        response += f"📂 Путь: {file['category']}"
+        if 'subcategory' in file:
+            response += f"/{file['subcategory']}"
+        response += f"\n📊 Размер: {file['size']}\n"
+        response += f"🕒 Дата: {file['date']}\n"
+        outbound.send_text(message.chat.id, response)
+
+    # Отправляем совпадения в тексте документов, начиная с самых релевантных
+    if text_results:
+        response = "📝 Найдено в тексте документов:\n\n"
+        for entry, snippet in text_results:
+            response += f"📄 {entry['name']}\n"
+            response += f"📂 Путь: {os.path.dirname(entry['path'])}\n"
+            response += f"💬 {snippet}\n\n"
+        pending = extraction_pipeline.pending_count()
+        if pending:
+            response += f"⏳ Еще индексируется документов: {pending}"
+        outbound.send_text(message.chat.id, response)
+
+
+def suggest_file_names(query, limit=3):
+    """Подбирает имена файлов, похожие на запрос с опечаткой"""
+    suggestions = []
+    for path, similarity in name_index.search(query, limit=limit, min_similarity=0.2):
+        name = os.path.basename(path)
+        if name not in suggestions:
+            suggestions.append(name)
+    return suggestions
 
 
 @bot.message_handler(commands=['search'])
@@ -679,12 +1043,83 @@ def handle_search(message):
     search_files(message)
 
 
-# Словарь для отслеживания режима чата пользователей
-user_chat_mode = {}
+@bot.message_handler(commands=['archive'])
+def archive_command(message):
+    """Обработчик команды /archive"""
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        create_archive(message)
+        return
+
+    location = parts[1].strip().strip('/').split('/')
+    category = location[0]
+    subcategory = location[1] if len(location) > 1 else None
+    if category not in file_handler.categories or (
+            subcategory and subcategory not in file_handler.subcategories.get(category, [])):
+        bot.reply_to(
+            message,
+            "❌ Категория не найдена.\nПример: /archive DevOps/Docker\n\n"
+            "📂 Категории: " + ", ".join(file_handler.categories)
+        )
+        return
+    create_archive(message, category, subcategory)
+
+
+# Запросы к AI выполняются в отдельной очереди, не занимая обработчики бота
+ai_scheduler = InferenceScheduler(
+    lambda text: get_ai_response(text),
+    max_queue=int(os.getenv('AI_QUEUE_SIZE', '20')),
+    max_per_user=int(os.getenv('AI_MAX_PER_USER', '2'))
+)
+
+# Чаты в режиме AI: {id чата: время последнего действия}. Модель выгружается,
+# только когда в режиме не осталось чатов, активных за последние AI_CHAT_IDLE_TIMEOUT секунд
+AI_CHAT_IDLE_TIMEOUT = int(os.getenv('AI_CHAT_IDLE_TIMEOUT', '1800'))
+ai_chats = {}
+ai_chats_lock = threading.Lock()
+
+
+def touch_ai_chat(chat_id):
+    """Отмечает активность чата в режиме AI"""
+    with ai_chats_lock:
+        ai_chats[chat_id] = time.time()
+
+
+def leave_ai_chat(chat_id):
+    """Выводит чат из режима AI и выгружает модель, если режим больше никто не использует"""
+    with ai_chats_lock:
+        ai_chats.pop(chat_id, None)
+    ai_scheduler.run_when_idle(unload_model_if_unused)
+
+
+def unload_model_if_unused():
+    """Выгружает модель, если нет недавно активных чатов в режиме AI; выполняется в очереди AI"""
+    with ai_chats_lock:
+        now = time.time()
+        for chat_id in [c for c, last_seen in ai_chats.items() if now - last_seen > AI_CHAT_IDLE_TIMEOUT]:
+            del ai_chats[chat_id]
+        if ai_chats:
+            return
+    if model_loaded:
+        unload_model()
 
 
 @bot.message_handler(func=lambda message: True)
 def handle_messages(message):
+    # Продолжаем начатый диалог: выбор категории для загрузки или ввод поискового запроса
+    state = state_store.get(message.chat.id)
+    step = state.get('step')
+    if step == 'upload_category':
+        process_category_selection(message)
+        return
+    if step == 'upload_subcategory':
+        process_subcategory_selection(message, state['upload_category'])
+        return
+    if step == 'search':
+        state_store.clear(message.chat.id, 'step')
+        search_files(message)
+        return
+
     if message.text == '📥 Скачать файлы':
         show_categories(message)
     elif message.text == '📋 Список файлов':
@@ -699,7 +1134,7 @@ def handle_messages(message):
             message.chat.id,
             "🔍 Введите поисковый запрос\nПример: docker"
         )
-        bot.register_next_step_handler(message, search_files)
+        state_store.update(message.chat.id, step='search')
     elif message.text == '❓ Помощь':
         help_command(message)
     elif message.text == '⚙️ Дополнительно':
@@ -715,10 +1150,18 @@ def handle_messages(message):
         show_brief_stats(message)
     elif message.text == '👤 Мои скачивания':
         show_user_downloads(message)
+    elif message.text == '⏱ За 24 часа':
+        show_period_stats(message, "за последние 24 часа", hours=24)
+    elif message.text == '🗓 За 7 дней':
+        show_period_stats(message, "за последние 7 дней", days=7)
+    elif message.text == '📅 За месяц':
+        # С начала текущего месяца
+        show_period_stats(message, "за текущий месяц", days=date.today().day)
     elif message.text == '📦 Скачать архив со всеми файлами':
         create_archive(message)
     elif message.text == '🤖 Чат с AI':
-        user_chat_mode[message.chat.id] = True
+        state_store.update(message.chat.id, ai=True)
+        touch_ai_chat(message.chat.id)
         bot.send_message(
             message.chat.id,
             "🤖 Режим чата с AI активирован. Задайте свой вопрос.\n"
@@ -732,19 +1175,18 @@ def handle_messages(message):
             reply_markup=markup
         )
         # Очищаем контекст и режим чата при возврате в главное меню
-        user_context.pop(message.chat.id, None)
-        user_chat_mode.pop(message.chat.id, None)
-        # Выгружаем модель при выходе из режима чата
-        if model_loaded:
-            unload_model()
+        state_store.clear(message.chat.id)
+        # Выгружаем модель при выходе из режима чата, когда очередь запросов опустеет
+        # и в режиме чата не останется других пользователей
+        if state.get('ai'):
+            leave_ai_chat(message.chat.id)
     elif message.text == '⬅️ Назад к категориям':
         show_categories(message)
         # Очищаем контекст при возврате к категориям
-        user_context.pop(message.chat.id, None)
+        state_store.clear(message.chat.id, 'category', 'subcategory')
     elif message.text == '⬅️ Назад к подкатегориям':
         # Получаем текущий контекст пользователя
-        context = user_context.get(message.chat.id, {})
-        category = context.get('category')
+        category = state.get('category')
 
         if category and category in file_handler.subcategories:
             show_subcategories(message, category)
@@ -762,8 +1204,7 @@ def handle_messages(message):
     elif message.text.startswith('📁 '):
         subcategory = message.text[2:].strip()
         # Получаем текущий контекст пользователя
-        context = user_context.get(message.chat.id, {})
-        category = context.get('category')
+        category = state.get('category')
 
         if category and subcategory in file_handler.subcategories.get(category, []):
             list_files(message, category, subcategory)
@@ -776,45 +1217,19 @@ def handle_messages(message):
     elif message.text.startswith('📥 '):
         file_name = message.text[2:].strip()
         try:
-            found = False
-            for category in file_handler.categories:
-                file_data = file_handler.get_file(file_name, category)
-                if file_data is not None:
-                    bot.send_document(
-                        message.chat.id,
-                        file_data,
-                        visible_file_name=file_name
-                    )
-                    # Обновляем статистику скачиваний
-                    if file_name not in download_stats:
-                        download_stats[file_name] = {}
-                    user_id = str(message.from_user.id)
-                    download_stats[file_name][user_id] = download_stats[file_name].get(user_id, 0) + 1
-                    save_stats()  # Сохраняем статистику после каждого скачивания
-                    found = True
-                    break
-
-                if category in file_handler.subcategories:
-                    for subcategory in file_handler.subcategories[category]:
-                        file_data = file_handler.get_file(file_name, category, subcategory)
-                        if file_data is not None:
-                            bot.send_document(
-                                message.chat.id,
-                                file_data,
-                                visible_file_name=file_name
-                            )
-                            # Обновляем статистику скачиваний
-                            if file_name not in download_stats:
-                                download_stats[file_name] = {}
-                            user_id = str(message.from_user.id)
-                            download_stats[file_name][user_id] = download_stats[file_name].get(user_id, 0) + 1
-                            save_stats()  # Сохраняем статистику после каждого скачивания
-                            found = True
-                            break
-                    if found:
-                        break
-
-            if not found:
+            matches = file_handler.resolve(file_name)
+            if matches:
+                # Кнопка файла относится к категории, которую пользователь сейчас просматривает
+                entry = next(
+                    (entry for entry in matches
+                     if entry['category'] == state.get('category')
+                     and entry['subcategory'] == state.get('subcategory')),
+                    matches[0]
+                )
+                send_stored_file(message.chat.id, entry)
+                # Обновляем статистику скачиваний
+                stats_store.record(file_name, message.from_user.id)
+            else:
                 bot.reply_to(message, f"❌ Файл {file_name} не найден.")
         except Exception as e:
             error_msg = f"Произошла ошибка при получении файла: {str(e)}"
@@ -822,29 +1237,8 @@ def handle_messages(message):
             bot.reply_to(message, f"❌ {error_msg}")
     else:
         # Проверяем, находится ли пользователь в режиме чата с AI
-        if user_chat_mode.get(message.chat.id):
-            try:
-                # Отправляем сообщение о загрузке модели
-                loading_msg = bot.send_message(
-                    message.chat.id,
-                    "⏳ Загружаю модель для ответа на ваш вопрос..."
-                )
-
-                # Генерируем ответ
-                response = get_ai_response(message.text)
-
-                # Удаляем сообщение о загрузке
-                bot.delete_message(message.chat.id, loading_msg.message_id)
-
-                # Отправляем ответ
-                bot.reply_to(message, response)
-
-            except Exception as e:
-                logger.error(f"Ошибка при обработке сообщения в режиме чата: {e}", exc_info=True)
-                bot.reply_to(
-                    message,
-                    "❌ Произошла ошибка при обработке сообщения. Пожалуйста, попробуйте еще раз."
-                )
+        if state.get('ai'):
+            submit_ai_request(message)
         else:
             # Если сообщение не является командой и пользователь не в режиме чата,
             # используем его как поисковый запрос
@@ -858,142 +1252,232 @@ def handle_messages(message):
                 )
 
 
+def submit_ai_request(message):
+    """Ставит вопрос пользователя в очередь AI и сообщает его место в очереди"""
+    # Режим чата мог быть включен до перезапуска бота
+    touch_ai_chat(message.chat.id)
+    status_msg = bot.send_message(message.chat.id, "⏳ Ставлю ваш вопрос в очередь...")
+    # Генерация может начаться, пока показывается место в очереди: тогда
+    # сообщение о начале генерации восстанавливается после показа места
+    status_lock = threading.Lock()
+    status = {'started': False}
+
+    def show_generating():
+        bot.edit_message_text(
+            "⏳ Генерирую ответ на ваш вопрос...",
+            message.chat.id,
+            status_msg.message_id
+        )
+
+    def on_start():
+        with status_lock:
+            status['started'] = True
+        show_generating()
+
+    def on_done(response):
+        # Удаляем сообщение о статусе и отправляем ответ
+        bot.delete_message(message.chat.id, status_msg.message_id)
+        bot.reply_to(message, response)
+
+    try:
+        position = ai_scheduler.submit(message.from_user.id, message.text, on_start, on_done)
+    except QueueFullError:
+        bot.edit_message_text(
+            "⚠️ Сейчас слишком много запросов к AI. Пожалуйста, попробуйте позже.",
+            message.chat.id,
+            status_msg.message_id
+        )
+        return
+
+    if not position:
+        return
+    try:
+        bot.edit_message_text(
+            f"🕒 Ваш вопрос в очереди, позиция: {position}",
+            message.chat.id,
+            status_msg.message_id
+        )
+        with status_lock:
+            started = status['started']
+        if started:
+            show_generating()
+    except telebot.apihelper.ApiTelegramException as e:
+        # Сообщение уже изменено или удалено обработчиками генерации
+        logger.warning(f"Не удалось обновить статус запроса к AI: {e}")
+
+
 def show_download_stats(message):
-    """Показывает статистику скачиваний файлов"""
-    if not download_stats:
+    """Показывает первую страницу подробной статистики скачиваний"""
+    if not stats_store.file_count():
         bot.send_message(
             message.chat.id,
             "📊 Статистика скачиваний пуста.\nФайлы еще не скачивались."
         )
         return
 
-    # Сортируем файлы по количеству скачиваний
-    sorted_stats = sorted(
-        download_stats.items(),
-        key=lambda x: sum(x[1].values()),
-        reverse=True
+    text, markup = get_stats_page(message.chat.id, 0)
+    bot.send_message(message.chat.id, text, parse_mode='Markdown', reply_markup=markup)
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('stats:'))
+def stats_page_callback(call):
+    """Переключает страницу статистики, редактируя то же сообщение"""
+    page = int(call.data.split(':', 1)[1])
+    text, markup = get_stats_page(call.message.chat.id, page)
+    edit_inline_message(call, text, markup, parse_mode='Markdown')
+    bot.answer_callback_query(call.id)
+
+
+def escape_markdown(text):
+    """Экранирует служебные символы Markdown в именах файлов и пользователей вне выделения"""
+    for char in ('_', '*', '`', '['):
+        text = text.replace(char, '\\' + char)
+    return text
+
+
+def get_stats_page(chat_id, page):
+    """
+    Возвращает текст и клавиатуру страницы статистики
+
+    Страницы строятся при первом запросе и кэшируются до следующего
+    изменения статистики.
+    """
+    archive_rank = stats_store.rank_of(ARCHIVE_STATS_NAME)
+    file_count = stats_store.file_count() - (archive_rank is not None)
+    pages_count = max(1, (file_count + STATS_PAGE_SIZE - 1) // STATS_PAGE_SIZE)
+    page = min(max(page, 0), pages_count - 1)
+
+    version = stats_store.version()
+    with stats_pages_lock:
+        if stats_pages['version'] != version:
+            stats_pages['version'] = version
+            stats_pages['pages'] = {}
+        text = stats_pages['pages'].get(page)
+    if text is None:
+        text = render_stats_page(chat_id, page, archive_rank)
+        with stats_pages_lock:
+            if stats_pages['version'] == version:
+                stats_pages['pages'][page] = text
+
+    markup = None
+    if pages_count > 1:
+        markup = types.InlineKeyboardMarkup(row_width=3)
+        markup.add(*page_buttons("stats:", page, pages_count))
+    return text, markup
+
+
+def render_stats_page(chat_id, page, archive_rank):
+    """Строит текст страницы статистики по агрегатам хранилища"""
+    # Архив показывается отдельно, поэтому пропускаем его позицию в рейтинге
+    start = page * STATS_PAGE_SIZE
+    if archive_rank is not None and archive_rank <= start:
+        start += 1
+    ranked_files = [
+        (file_name, total_downloads)
+        for file_name, total_downloads, _ in stats_store.top_files(STATS_PAGE_SIZE + 1, start)
+        if file_name != ARCHIVE_STATS_NAME
+    ][:STATS_PAGE_SIZE]
+
+    titles = []
+    if page == 0:
+        # На первой странице сначала показываем статистику архива, если он есть
+        titles.append((ARCHIVE_STATS_NAME, "📦 *Архив с документацией*"))
+    # Имена файлов не выделяем жирным: внутри выделения их нельзя экранировать
+    titles += [(file_name, f"📄 {escape_markdown(file_name)}") for file_name, _ in ranked_files]
+
+    blocks = []
+    for file_name, title in titles:
+        total_downloads, users = stats_store.file_stats(file_name)
+        if total_downloads:
+            top_users = sorted(users.items(), key=lambda x: x[1], reverse=True)[:STATS_USERS_PER_FILE]
+            blocks.append((title, total_downloads, top_users, len(users)))
+
+    # Запрашиваем имена всех скачавших на странице один раз
+    user_names = resolve_user_names(
+        chat_id,
+        [user_id for _, _, top_users, _ in blocks for user_id, _ in top_users]
     )
 
     response = "📊 *СТАТИСТИКА СКАЧИВАНИЙ*\n\n"
-
-    # Сначала показываем статистику архива, если он есть
-    archive_stats = next((item for item in sorted_stats if item[0] == "📦 programming-documentation.zip"), None)
-    if archive_stats:
-        file_name, users = archive_stats
-        total_downloads = sum(users.values())
-        response += f"📦 *Архив с документацией*\n"
-        response += f"📥 Всего скачиваний: *{total_downloads}*\n"
-        # Показываем всех пользователей
-        if users:
-            response += "👥 *Список скачавших:*\n"
-            sorted_users = sorted(users.items(), key=lambda x: x[1], reverse=True)
-            for user_id, count in sorted_users:
-                try:
-                    # Пробуем получить информацию о пользователе
-                    user = bot.get_chat_member(message.chat.id, int(user_id))
-                    if user and user.user:
-                        user_name = user.user.first_name
-                        if user.user.last_name:
-                            user_name += f" {user.user.last_name}"
-                        username = f" (@{user.user.username})" if user.user.username else ""
-                    else:
-                        user_name = f"Пользователь {user_id}"
-                        username = ""
-                except Exception as e:
-                    user_name = f"Пользователь {user_id}"
-                    username = ""
-                response += f"• {user_name}{username}: {count} раз\n"
-        response += "\n"
-
-    # Затем показываем статистику остальных файлов
-    for file_name, users in sorted_stats:
-        if file_name == "📦 programming-documentation.zip":  # Пропускаем архив, так как уже показали
-            continue
-        total_downloads = sum(users.values())
-        response += f"📄 *{file_name}*\n"
+    for title, total_downloads, top_users, users_count in blocks:
+        response += f"{title}\n"
         response += f"📥 Всего скачиваний: *{total_downloads}*\n"
-
-        # Показываем всех пользователей
-        if users:
+        if top_users:
             response += "👥 *Список скачавших:*\n"
-            sorted_users = sorted(users.items(), key=lambda x: x[1], reverse=True)
-            for user_id, count in sorted_users:
-                try:
-                    # Пробуем получить информацию о пользователе
-                    user = bot.get_chat_member(message.chat.id, int(user_id))
-                    if user and user.user:
-                        user_name = user.user.first_name
-                        if user.user.last_name:
-                            user_name += f" {user.user.last_name}"
-                        username = f" (@{user.user.username})" if user.user.username else ""
-                    else:
-                        user_name = f"Пользователь {user_id}"
-                        username = ""
-                except Exception as e:
-                    user_name = f"Пользователь {user_id}"
-                    username = ""
-                response += f"• {user_name}{username}: {count} раз\n"
+            for user_id, count in top_users:
+                response += f"• {escape_markdown(user_names[user_id])}: {count} раз\n"
+            if users_count > len(top_users):
+                response += f"• ...и еще {users_count - len(top_users)}\n"
         response += "\n"
 
-    # Разбиваем сообщение на части, если оно слишком длинное
     if len(response) > 4000:
-        parts = [response[i:i + 4000] for i in range(0, len(response), 4000)]
-        for part in parts:
-            bot.send_message(message.chat.id, part, parse_mode='Markdown')
-    else:
-        bot.send_message(message.chat.id, response, parse_mode='Markdown')
+        # Обрезаем по границе строки, чтобы не разорвать разметку
+        response = response[:response.rfind("\n", 0, 4000)] + "\n..."
+    return response
 
 
 def show_brief_stats(message):
     """Показывает краткую статистику скачиваний файлов"""
-    if not download_stats:
+    if not stats_store.file_count():
         bot.send_message(
             message.chat.id,
             "📊 Статистика скачиваний пуста.\nФайлы еще не скачивались."
         )
         return
 
-    # Сортируем файлы по количеству скачиваний
-    sorted_stats = sorted(
-        download_stats.items(),
-        key=lambda x: sum(x[1].values()),
-        reverse=True
-    )
+    # Файлы уже упорядочены по количеству скачиваний
+    ranked_files = stats_store.top_files()
 
     response = "📈 *КРАТКАЯ СТАТИСТИКА СКАЧИВАНИЙ*\n\n"
 
     # Сначала показываем статистику архива, если он есть
-    archive_stats = next((item for item in sorted_stats if item[0] == "📦 programming-documentation.zip"), None)
-    if archive_stats:
-        file_name, users = archive_stats
-        total_downloads = sum(users.values())
+    total_downloads, users = stats_store.file_stats("📦 programming-documentation.zip")
+    if total_downloads:
         unique_users = len(users)
         response += f"📦 *Архив с документацией*\n"
         response += f"📥 Всего скачиваний: *{total_downloads}*\n"
         response += f"👥 Уникальных скачавших: *{unique_users}*\n\n"
 
     # Затем показываем статистику остальных файлов
-    for file_name, users in sorted_stats:
+    for file_name, total_downloads, unique_users in ranked_files:
         if file_name == "📦 programming-documentation.zip":  # Пропускаем архив, так как уже показали
             continue
-        total_downloads = sum(users.values())
-        unique_users = len(users)
         response += f"📄 *{file_name}*\n"
         response += f"📥 Всего скачиваний: *{total_downloads}*\n"
         response += f"👥 Уникальных скачавших: *{unique_users}*\n\n"
 
+    # Длинный список разбивается на сообщения по строкам
+    outbound.send_text(message.chat.id, response, parse_mode='Markdown')
+
+
+def show_period_stats(message, period_title, days=None, hours=None):
+    """Показывает самые популярные файлы за период по сводкам статистики"""
+    ranked_files, total_downloads, unique_users = stats_store.period_stats(days=days, hours=hours)
+
+    if not total_downloads:
+        bot.send_message(
+            message.chat.id,
+            f"📊 Скачиваний {period_title} не было."
+        )
+        return
+
+    response = f"🗓 *СТАТИСТИКА СКАЧИВАНИЙ {period_title.upper()}*\n\n"
+    response += f"📥 Всего скачиваний: *{total_downloads}*\n"
+    response += f"👥 Уникальных скачавших: *{unique_users}*\n\n"
+    response += "🏆 *Популярные файлы:*\n\n"
+
+    for i, (file_name, count) in enumerate(ranked_files[:10], 1):
+        response += f"{i}. {escape_markdown(file_name)}: {count} раз\n"
+
     bot.send_message(message.chat.id, response, parse_mode='Markdown')
 
 
 def show_user_downloads(message):
     """Показывает статистику скачиваний конкретного пользователя"""
     user_id = str(message.from_user.id)
-    user_files = {}
 
-    # Собираем все файлы, которые скачивал пользователь
-    for file_name, users in download_stats.items():
-        if user_id in users:
-            user_files[file_name] = users[user_id]
+    # Берем файлы пользователя из обратного индекса статистики
+    user_files = stats_store.user_downloads(user_id)
 
     if not user_files:
         bot.send_message(
@@ -1009,23 +1493,11 @@ def show_user_downloads(message):
         reverse=True
     )
 
-    # Получаем информацию о пользователе
-    try:
-        user = bot.get_chat_member(message.chat.id, int(user_id))
-        if user and user.user:
-            user_name = user.user.first_name
-            if user.user.last_name:
-                user_name += f" {user.user.last_name}"
-            username = f" (@{user.user.username})" if user.user.username else ""
-        else:
-            user_name = f"Пользователь {user_id}"
-            username = ""
-    except Exception as e:
-        user_name = f"Пользователь {user_id}"
-        username = ""
+    # Имя пользователя уже есть во входящем сообщении
+    user_name = format_user_name(message.from_user)
 
     response = f"👤 *СТАТИСТИКА СКАЧИВАНИЙ*\n\n"
-    response += f"Пользователь: *{user_name}{username}*\n\n"
+    response += f"Пользователь: *{user_name}*\n\n"
 
     total_downloads = sum(user_files.values())
     unique_files = len(user_files)
@@ -1046,45 +1518,46 @@ def show_user_downloads(message):
             continue
         response += f"• *{file_name}*: {count} раз\n"
 
-    bot.send_message(message.chat.id, response, parse_mode='Markdown')
+    # Длинный список разбивается на сообщения по строкам
+    outbound.send_text(message.chat.id, response, parse_mode='Markdown')
 
 
-def create_archive(message):
-    """Создает архив со всеми файлами"""
+def create_archive(message, category=None, subcategory=None):
+    """Отправляет архив со всеми файлами или с файлами одной категории"""
     try:
-        # Создаем архив в памяти
-        archive = io.BytesIO()
-        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Проходим по всем категориям
-            for category in file_handler.categories:
-                category_path = os.path.join(file_handler.base_dir, category)
-                if os.path.exists(category_path):
-                    # Добавляем файлы из основной категории
-                    for root, dirs, files in os.walk(category_path):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            # Получаем относительный путь для архива
-                            arcname = os.path.relpath(file_path, file_handler.base_dir)
-                            zipf.write(file_path, arcname)
-
-        # Перемещаем указатель в начало архива
-        archive.seek(0)
-
-        # Обновляем статистику скачиваний архива
-        archive_name = "📦 programming-documentation.zip"
-        if archive_name not in download_stats:
-            download_stats[archive_name] = {}
-        user_id = str(message.from_user.id)
-        download_stats[archive_name][user_id] = download_stats[archive_name].get(user_id, 0) + 1
-        save_stats()
-
-        # Отправляем архив
-        bot.send_document(
-            message.chat.id,
-            archive,
-            visible_file_name='programming-documentation.zip',
-            caption="📦 Архив с документацией по программированию"
-        )
+        scope_name = archive_manager.scope_name(category, subcategory)
+        if category:
+            location = f"{category}/{subcategory}" if subcategory else category
+            caption = f"📦 Архив с документацией: {location}"
+        else:
+            caption = "📦 Архив с документацией по программированию"
+
+        # Берем готовые тома с диска, они пересобираются только при изменении файлов.
+        # Пока тома отправляются, ни этот, ни другие процессы бота их не пересоберут
+        with archive_manager.open_archive(category, subcategory) as (volumes, _):
+            # Обновляем статистику скачиваний архива
+            stats_store.record(f"📦 {scope_name}.zip", message.from_user.id)
+
+            # Отправляем тома, повторно используя file_id, пока том не менялся. Версия тома -
+            # его собственные размер и mtime: при дописывании новых файлов меняется только
+            # последний том, и остальные не загружаются заново
+            for number, volume_path in enumerate(volumes, start=1):
+                if len(volumes) > 1:
+                    visible_file_name = os.path.basename(volume_path)
+                    volume_caption = f"{caption} (том {number} из {len(volumes)})"
+                else:
+                    visible_file_name = f"{scope_name}.zip"
+                    volume_caption = caption
+                volume_stat = os.stat(volume_path)
+                send_cached_document(
+                    message.chat.id,
+                    volume_path,
+                    visible_file_name,
+                    f"archive:{os.path.basename(volume_path)}",
+                    volume_stat.st_size,
+                    volume_stat.st_mtime_ns,
+                    caption=volume_caption
+                )
     except Exception as e:
         error_msg = f"Ошибка при создании архива: {str(e)}"
         log_error(error_msg, message.from_user.id)
@@ -1282,15 +1755,90 @@ def signal_handler(signum, frame):
     """Обработчик сигналов для корректного завершения работы"""
     logger.info("Received stop signal, unloading model...")
     unload_model()
+    # Сохраняем накопленную статистику скачиваний
+    stats_store.close()
+    search_index.save_if_dirty()
     logger.info("Bot stopped")
     sys.exit(0)
 
 
+def route_update(update):
+    """Выбирает пул потоков для обновления в режиме async_intake"""
+    message = update.message
+    if message and message.text:
+        if message.text == '📦 Скачать архив со всеми файлами' or message.text.startswith('/archive'):
+            return 'archive'
+    return 'io'
+
+
+def run_async_intake():
+    """Запускает бота с асинхронным приемом обновлений и обработкой в пулах потоков"""
+    intake = AsyncIntake(
+        TOKEN,
+        lambda update: bot.process_new_updates([update]),
+        route=route_update,
+        pool_sizes={
+            'io': int(os.getenv('IO_WORKERS', '32')),
+            'archive': int(os.getenv('ARCHIVE_WORKERS', '2'))
+        }
+    )
+    logger.info("Бот запущен с асинхронным приемом обновлений...")
+    bot.remove_webhook()
+    intake.run()
+
+
+def run_webhook():
+    """Запускает бота в режиме вебхука"""
+    secret_token = os.getenv('WEBHOOK_SECRET')
+    if not secret_token:
+        raise RuntimeError("Для режима webhook нужно задать WEBHOOK_SECRET")
+
+    server = WebhookServer(
+        lambda update: bot.process_new_updates([update]),
+        secret_token,
+        host=os.getenv('WEBHOOK_HOST', '0.0.0.0'),
+        port=int(os.getenv('WEBHOOK_PORT', '8443')),
+        path=os.getenv('WEBHOOK_PATH', '/webhook'),
+        queue_size=int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000')),
+        workers=int(os.getenv('IO_WORKERS', '32'))
+    )
+    # Адрес задается внешним, если бот стоит за балансировщиком
+    webhook_url = os.getenv('WEBHOOK_URL')
+    if webhook_url:
+        bot.set_webhook(url=webhook_url, secret_token=secret_token)
+    logger.info(f"Бот запущен в режиме вебхука на порту {server.port}...")
+    server.serve_forever()
+
+
+def cluster_worker(update_queue):
+    """Процесс-обработчик кластерного режима"""
+    worker_loop(update_queue, lambda update: bot.process_new_updates([update]))
+
+
+def run_cluster_mode():
+    """Запускает бота в кластерном режиме"""
+    # Файл аренды должен быть общим для всех экземпляров
+    lease = IntakeLease(
+        os.getenv('CLUSTER_LEASE_DB', 'cluster.db'),
+        ttl=int(os.getenv('CLUSTER_LEASE_TTL', '10'))
+    )
+    logger.info(f"Бот запущен в кластерном режиме ({lease.owner})...")
+    bot.remove_webhook()
+    run_cluster(
+        lambda offset, timeout: bot.get_updates(offset=offset, timeout=timeout, long_polling_timeout=timeout),
+        cluster_worker,
+        lease,
+        workers=int(os.getenv('CLUSTER_WORKERS', '0')) or None
+    )
+
+
 # Регистрируем обработчики сигналов
 signal.signal(signal.SIGINT, signal_handler)
 signal.signal(signal.SIGTERM, signal_handler)
 
-if __name__ == "__main__":
+
+def run_polling():
+    """Запускает бота в режиме long polling с повторными попытками при конфликте"""
     max_retries = 5
     retry_delay = 5  # секунды
     retry_count = 0
@@ -1323,3 +1871,26 @@ if __name__ == "__main__":
             # Выгружаем модель при ошибке, если она была загружена
             if model_loaded:
                 unload_model()
+
+
+def main():
+    """Запускает бота в режиме BOT_MODE"""
+    start_main_process()
+
+    # Шлюз запускается только в основном процессе: обработчики кластера лишь выдают ссылки
+    if download_gateway:
+        download_gateway.start()
+        logger.info(f"Шлюз скачивания запущен на порту {download_gateway.port}")
+
+    if BOT_MODE == 'async_intake':
+        run_async_intake()
+    elif BOT_MODE == 'webhook':
+        run_webhook()
+    elif BOT_MODE == 'cluster':
+        run_cluster_mode()
+    else:
+        run_polling()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import multiprocessing
+import os
+import socket
+import sqlite3
+import time
+
+from async_intake import update_chat_id
+from error_logger import log_error
+
+
+class IntakeLease:
+    """
+    Аренда права получать обновления, хранящаяся в SQLite
+
+    Получать обновления через getUpdates может только один процесс, иначе
+    Telegram отвечает Conflict. Процесс, который держит аренду, продлевает ее
+    каждые несколько секунд; если он упал, аренда истекает через ttl секунд и
+    ее забирает другой экземпляр. Вместе с арендой хранится смещение
+    последнего переданного в обработку обновления, чтобы новый лидер
+    продолжил с него.
+    """
+
+    def __init__(self, path, name='intake', ttl=10):
+        self.path = path
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._conn = sqlite3.connect(path, timeout=ttl, isolation_level=None)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS lease ("
+            "name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL, update_offset INTEGER)"
+        )
+
+    def acquire(self):
+        """Захватывает или продлевает аренду; возвращает True, если процесс - лидер"""
+        now = time.time()
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT owner, expires FROM lease WHERE name = ?", (self.name,)).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO lease (name, owner, expires) VALUES (?, ?, ?)",
+                    (self.name, self.owner, now + self.ttl)
+                )
+            elif row[0] == self.owner or row[1] <= now:
+                conn.execute(
+                    "UPDATE lease SET owner = ?, expires = ? WHERE name = ?",
+                    (self.owner, now + self.ttl, self.name)
+                )
+            else:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def release(self):
+        """Отдает аренду, чтобы другой экземпляр забрал ее без ожидания"""
+        self._conn.execute(
+            "UPDATE lease SET expires = 0 WHERE name = ? AND owner = ?", (self.name, self.owner)
+        )
+
+    def load_offset(self):
+        """Возвращает смещение, с которого нужно продолжить получение обновлений"""
+        row = self._conn.execute("SELECT update_offset FROM lease WHERE name = ?", (self.name,)).fetchone()
+        return row[0] if row else None
+
+    def save_offset(self, offset):
+        """Запоминает смещение, если процесс все еще держит аренду"""
+        self._conn.execute(
+            "UPDATE lease SET update_offset = ? WHERE name = ? AND owner = ?",
+            (offset, self.name, self.owner)
+        )
+
+
+def run_cluster(get_updates, worker_target, lease, workers=None, poll_timeout=3, queue_size=1000):
+    """
+    Запускает кластерный режим: лидер получает обновления, процессы-обработчики их выполняют
+
+    Args:
+        get_updates: функция get_updates(offset, timeout), возвращающая обновления
+        worker_target: функция процесса-обработчика, принимающая очередь обновлений
+        lease: аренда получения обновлений
+        workers: число процессов-обработчиков (по умолчанию - число ядер)
+        poll_timeout: таймаут long polling; должен быть заметно меньше срока аренды
+    """
+    workers = workers or os.cpu_count() or 1
+    # spawn: обработчики заново импортируют модуль бота и запускают свои фоновые потоки.
+    # Обработчики не демоны: демонам нельзя запускать дочерние процессы, а они нужны
+    # пулу извлечения текста; поэтому при остановке процессы завершаются явно
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue(maxsize=queue_size) for _ in range(workers)]
+    processes = [None] * workers
+
+    def ensure_workers():
+        for i, process in enumerate(processes):
+            if process is None or not process.is_alive():
+                if process is not None:
+                    log_error(f"Процесс-обработчик {i} завершился, перезапускаем", "system", "cluster")
+                processes[i] = context.Process(target=worker_target, args=(queues[i],))
+                processes[i].start()
+
+    leader = False
+    offset = None
+    try:
+        while True:
+            ensure_workers()
+            try:
+                if not lease.acquire():
+                    leader = False
+                    time.sleep(1)
+                    continue
+                if not leader:
+                    leader = True
+                    offset = lease.load_offset()
+
+                updates = get_updates(offset, poll_timeout)
+                for update in updates:
+                    # Обновления одного чата всегда обрабатывает один процесс, по порядку
+                    chat_id = update_chat_id(update)
+                    queues[hash(chat_id) % workers].put(update)
+                    offset = update.update_id + 1
+                if updates:
+                    lease.save_offset(offset)
+            except Exception as e:
+                log_error(f"Ошибка получения обновлений: {str(e)}", "system", "cluster")
+                time.sleep(1)
+    finally:
+        if leader:
+            lease.release()
+        stop_workers(processes)
+
+
+def stop_workers(processes, timeout=10):
+    """Завершает процессы-обработчики: SIGTERM, а если они не завершились за timeout - SIGKILL"""
+    alive = [process for process in processes if process is not None and process.is_alive()]
+    for process in alive:
+        process.terminate()
+    deadline = time.time() + timeout
+    for process in alive:
+        process.join(max(0, deadline - time.time()))
+        if process.is_alive():
+            log_error(f"Процесс-обработчик {process.pid} не завершился, останавливаем принудительно",
+                      "system", "cluster")
+            process.kill()
+            process.join()
+
+
+def worker_loop(update_queue, process_update):
+    """Цикл процесса-обработчика: выполняет обновления из своей очереди"""
+    while True:
+        try:
+            update = update_queue.get()
+        except (EOFError, OSError):
+            # Родительский процесс завершился
+            return
+        try:
+            process_update(update)
+        except Exception as e:
+            log_error(f"Ошибка обработки обновления: {str(e)}", update_chat_id(update), "cluster")
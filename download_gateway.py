@@ -0,0 +1,197 @@
+import hashlib
+import hmac
+import mimetypes
+import os
+import re
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+from error_logger import log_error
+
+# Префикс пути файлов в ссылках
+FILES_PREFIX = '/files/'
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def sign_path(secret, rel_path, expires):
+    """Подписывает путь к файлу и срок действия ссылки"""
+    message = f"{rel_path}\n{expires}".encode('utf-8')
+    return hmac.new(secret.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+
+def parse_range(header, size):
+    """
+    Разбирает заголовок Range с одним диапазоном
+
+    Returns:
+        tuple: (начало, конец включительно); None, если диапазон не выполним
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        # bytes=-N: последние N байт
+        length = int(end)
+        if length == 0:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = size - 1 if end == '' else min(int(end), size - 1)
+    if start >= size or start > end:
+        return None
+    return start, end
+
+
+class DownloadGateway:
+    """
+    HTTP-шлюз для скачивания больших файлов каталога напрямую с сервера
+
+    Бот выдает вместо документа ссылку с HMAC-подписью пути и сроком действия,
+    поэтому шлюз отдает только файлы каталога и только по свежим ссылкам.
+    Файлы отправляются через sendfile, поддерживаются докачка (Range) и
+    проверка актуальности (ETag).
+    """
+
+    def __init__(self, file_handler, secret, base_url, host='0.0.0.0', port=8080, link_ttl=3600):
+        self.file_handler = file_handler
+        self.secret = secret
+        self.base_url = base_url.rstrip('/')
+        self.address = (host, port)
+        self.link_ttl = link_ttl
+        self.httpd = None
+
+    def make_link(self, entry):
+        """Возвращает подписанную ссылку на файл, действующую link_ttl секунд"""
+        rel_path = entry['path'].replace(os.sep, '/')
+        expires = int(time.time()) + self.link_ttl
+        signature = sign_path(self.secret, rel_path, expires)
+        return f"{self.base_url}{FILES_PREFIX}{quote(rel_path)}?expires={expires}&sig={signature}"
+
+    def start(self):
+        """Запускает сервер в фоновом потоке"""
+        self.httpd = ThreadingHTTPServer(self.address, self._make_handler())
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True, name='download-gateway').start()
+
+    @property
+    def port(self):
+        """Порт, на котором слушает сервер (полезно при port=0)"""
+        return self.httpd.server_address[1]
+
+    def shutdown(self):
+        """Останавливает сервер"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _authorize(self, path):
+        """
+        Проверяет подпись и срок ссылки
+
+        Returns:
+            dict: запись каталога или None, если ссылка недействительна
+        """
+        parts = urlsplit(path)
+        if not parts.path.startswith(FILES_PREFIX):
+            return None
+        rel_path = unquote(parts.path[len(FILES_PREFIX):])
+        query = parse_qs(parts.query)
+        try:
+            expires = int(query['expires'][0])
+            signature = query['sig'][0]
+        except (KeyError, ValueError):
+            return None
+        if expires < time.time():
+            return None
+        expected = sign_path(self.secret, rel_path, expires)
+        if not hmac.compare_digest(signature.encode('utf-8'), expected.encode('utf-8')):
+            return None
+        # Файл ищем через каталог, поэтому выйти за пределы хранилища нельзя
+        return self.file_handler.resolve_path(rel_path)
+
+    def _make_handler(self):
+        gateway = self
+
+        class GatewayHandler(BaseHTTPRequestHandler):
+            def do_HEAD(self):
+                self._serve(send_body=False)
+
+            def do_GET(self):
+                self._serve(send_body=True)
+
+            def _serve(self, send_body):
+                entry = gateway._authorize(self.path)
+                if entry is None:
+                    self._reply_empty(403)
+                    return
+
+                file_path = gateway.file_handler.get_file_path(entry)
+                try:
+                    f = open(file_path, 'rb')
+                except OSError:
+                    self._reply_empty(404)
+                    return
+                with f:
+                    stat = os.fstat(f.fileno())
+                    size = stat.st_size
+                    etag = f'"{size:x}-{stat.st_mtime_ns:x}"'
+
+                    if self.headers.get('If-None-Match') == etag:
+                        self._reply_empty(304, etag)
+                        return
+
+                    start, end = 0, size - 1
+                    status = 200
+                    range_header = self.headers.get('Range')
+                    if_range = self.headers.get('If-Range')
+                    # If-Range с другим ETag - файл изменился, отдаем целиком
+                    if range_header and (if_range is None or if_range == etag):
+                        byte_range = parse_range(range_header, size)
+                        if byte_range is None:
+                            self.send_response(416)
+                            self.send_header('Content-Range', f"bytes */{size}")
+                            self.send_header('Content-Length', '0')
+                            self.end_headers()
+                            return
+                        start, end = byte_range
+                        status = 206
+
+                    length = end - start + 1 if size else 0
+                    self.send_response(status)
+                    content_type = mimetypes.guess_type(entry['name'])[0] or 'application/octet-stream'
+                    self.send_header('Content-Type', content_type)
+                    self.send_header('Content-Length', str(length))
+                    self.send_header('Accept-Ranges', 'bytes')
+                    self.send_header('ETag', etag)
+                    self.send_header('Last-Modified', formatdate(stat.st_mtime, usegmt=True))
+                    self.send_header(
+                        'Content-Disposition', f"attachment; filename*=UTF-8''{quote(entry['name'])}"
+                    )
+                    if status == 206:
+                        self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+                    self.end_headers()
+
+                    if send_body and length:
+                        try:
+                            # socket.sendfile использует os.sendfile: данные идут с диска в сокет без копирования
+                            self.connection.sendfile(f, start, length)
+                        except (ConnectionError, OSError) as e:
+                            # Клиент прервал скачивание
+                            log_error(f"Скачивание {entry['path']} прервано: {str(e)}", "system", "download_gateway")
+
+            def _reply_empty(self, status, etag=None):
+                self.send_response(status)
+                if etag:
+                    self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                # Не пишем в консоль строку на каждый запрос
+                pass
+
+        return GatewayHandler
@@ -0,0 +1,60 @@
+import hashlib
+import os
+
+# Модуль выполняется в рабочих процессах пула извлечения текста. Процессы
+# запускаются через forkserver, а не копированием процесса бота, поэтому
+# модуль импортирует только то, что нужно для разбора документов.
+
+
+def extract_docx_text(file_path):
+    """Извлекает текст из .docx: абзацы и ячейки таблиц"""
+    import docx
+
+    document = docx.Document(file_path)
+    parts = [paragraph.text for paragraph in document.paragraphs if paragraph.text]
+    for table in document.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                if cell.text:
+                    parts.append(cell.text)
+    return "\n".join(parts)
+
+
+def cache_path(cache_dir, sha256):
+    """Возвращает путь к кэшу текста для содержимого с указанным хешем"""
+    return os.path.join(cache_dir, sha256[:2], f"{sha256}.txt")
+
+
+def hash_file(file_path):
+    """Считает SHA-256 файла, читая его по частям"""
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def extract_text(file_path, sha256, cache_dir):
+    """
+    Извлекает текст документа в рабочем процессе
+
+    Результат кэшируется на диске по хешу содержимого, поэтому одинаковые
+    документы и повторная индексация не разбираются заново.
+
+    Returns:
+        tuple: хеш содержимого и текст
+    """
+    if sha256 is None:
+        sha256 = hash_file(file_path)
+    text_path = cache_path(cache_dir, sha256)
+    if os.path.exists(text_path):
+        with open(text_path, 'r', encoding='utf-8') as f:
+            return sha256, f.read()
+
+    text = extract_docx_text(file_path)
+    os.makedirs(os.path.dirname(text_path), exist_ok=True)
+    tmp_path = f"{text_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, text_path)
+    return sha256, text
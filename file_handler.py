@@ -1,14 +1,41 @@
+import hashlib
 import os
+import tempfile
+import threading
+import time
 from datetime import datetime
 
+from blob_store import BlobStore, link_new
+from error_logger import log_error
+
+# Суффикс временных файлов, в которые пишутся загрузки до атомарного переименования
+TEMP_SUFFIX = '.part'
+
+
 class FileHandler:
-    def __init__(self):
+    def __init__(self, storage_mode="plain"):
         self.base_dir = "uploads"
         self.categories = ["Java", "Книги", "AI", "DevOps", "Other"]
         self.subcategories = {
             "DevOps": ["Docker", "Kubernetes", "Other"]
         }
+        # В режиме "cas" содержимое хранится один раз, а файлы категорий - ссылки на него
+        self.blob_store = BlobStore(os.path.join(self.base_dir, ".blobs")) if storage_mode == "cas" else None
+        # Индекс каталога: {(категория, подкатегория): {имя файла: запись}}
+        self._index = {}
+        # Обратный индекс: {имя файла: множество директорий, где оно встречается}
+        self._by_name = {}
+        # mtime директорий на момент последнего сканирования
+        self._dir_mtimes = {}
+        # Порядок директорий, в котором отдаются совпадения при поиске по имени
+        self._location_order = {location: i for i, location in enumerate(self._iter_locations())}
+        self._index_lock = threading.RLock()
+        # Подписчики на изменения каталога: callback(event, entry)
+        self._listeners = []
+        if self.blob_store:
+            self.add_listener(self._drop_blob_ref)
         self._create_directories()
+        self._build_index()
 
     def _create_directories(self):
         """Создает необходимые директории для хранения файлов"""
@@ -28,92 +55,352 @@ class FileHandler:
 
     def save_file(self, file_id, file_name, file_data, category="Other", subcategory=None):
         """Сохраняет файл в указанную категорию"""
-        # Определяем путь для сохранения файла
-        if subcategory and category in self.subcategories and subcategory in self.subcategories[category]:
-            save_path = os.path.join(self.base_dir, category, subcategory, file_name)
-        else:
-            save_path = os.path.join(self.base_dir, category, file_name)
-        
-        # Сохраняем файл
-        with open(save_path, 'wb') as f:
-            f.write(file_data)
-        
+        save_path, _ = self.save_stream(file_name, [file_data], category, subcategory)
         return save_path
 
-    def get_file(self, file_name, category=None, subcategory=None):
-        """Получает файл по имени"""
-        # Если указана категория и подкатегория, ищем в конкретной подпапке
-        if category and subcategory and category in self.subcategories and subcategory in self.subcategories[category]:
-            file_path = os.path.join(self.base_dir, category, subcategory, file_name)
-            if os.path.exists(file_path):
-                with open(file_path, 'rb') as f:
-                    return f.read()
-        
-        # Если указана только категория, ищем в папке категории
-        if category:
-            file_path = os.path.join(self.base_dir, category, file_name)
-            if os.path.exists(file_path):
-                with open(file_path, 'rb') as f:
-                    return f.read()
-        
-        # Если категория не указана, ищем во всех папках
-        for category in self.categories:
-            # Проверяем в основной папке категории
-            file_path = os.path.join(self.base_dir, category, file_name)
-            if os.path.exists(file_path):
-                with open(file_path, 'rb') as f:
-                    return f.read()
-            
-            # Проверяем в подпапках категории
-            if category in self.subcategories:
-                for subcategory in self.subcategories[category]:
-                    file_path = os.path.join(self.base_dir, category, subcategory, file_name)
-                    if os.path.exists(file_path):
-                        with open(file_path, 'rb') as f:
-                            return f.read()
-        
-        return None
+    def save_stream(self, file_name, chunks, category="Other", subcategory=None, file_unique_id=None,
+                    overwrite=True):
+        """
+        Потоково сохраняет файл в указанную категорию
+
+        Части пишутся во временный файл и одновременно хешируются; после
+        успешной записи файл атомарно переименовывается, поэтому читатели
+        никогда не видят недописанный файл. В режиме "cas" содержимое
+        сохраняется в хранилище блобов, а в категории создается ссылка на него.
+
+        Returns:
+            tuple: путь к сохраненному файлу и его SHA-256
+
+        Raises:
+            FileExistsError: файл с таким именем уже есть, а overwrite=False
+        """
+        save_dir = self._location_path(category, self._valid_subcategory(category, subcategory))
+        save_path = os.path.join(save_dir, file_name)
+
+        sha256 = hashlib.sha256()
+        tmp_dir = self.blob_store.tmp_dir if self.blob_store else save_dir
+        fd, tmp_path = tempfile.mkstemp(prefix='.', suffix=TEMP_SUFFIX, dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    sha256.update(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp создает файл с правами 0600, выставляем обычные права
+            os.chmod(tmp_path, 0o644)
+            if self.blob_store:
+                # Если такое содержимое уже есть, временный файл просто удаляется
+                self.blob_store.put(tmp_path, sha256.hexdigest())
+                self.blob_store.link(sha256.hexdigest(), save_path, overwrite)
+            elif overwrite:
+                os.replace(tmp_path, save_path)
+            else:
+                # Проверка имени и публикация - одна операция, поэтому одновременные
+                # загрузки с одинаковым именем не перезапишут друг друга
+                link_new(tmp_path, save_path)
+        except BaseException:
+            # Не оставляем недописанный файл в каталоге
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        # Обновляем индекс каталога без пересканирования директории
+        self._add_to_index(save_path, category, subcategory, sha256.hexdigest(), file_unique_id)
+
+        return save_path, sha256.hexdigest()
+
+    def find_stored_content(self, file_unique_id):
+        """Возвращает хеш содержимого, если файл с таким file_unique_id уже сохранялся"""
+        if not self.blob_store or not file_unique_id:
+            return None
+        return self.blob_store.sha_for_unique_id(file_unique_id)
+
+    def find_copies(self, sha256):
+        """Возвращает пути файлов каталога с указанным содержимым"""
+        if not self.blob_store:
+            return []
+        # Манифест может отставать от диска, если файл удалили в обход бота
+        return [path for path in self.blob_store.find_refs(sha256)
+                if os.path.exists(os.path.join(self.base_dir, path))]
+
+    def _drop_blob_ref(self, event, entry):
+        """Удаляет из манифеста ссылки файлов, исчезнувших из каталога"""
+        if event == "removed":
+            self.blob_store.remove_ref(entry['path'])
+
+    def save_stored_content(self, file_name, sha256, category="Other", subcategory=None, overwrite=True):
+        """Сохраняет в категорию ссылку на уже имеющееся содержимое, не скачивая файл"""
+        save_path = os.path.join(self._location_path(category, self._valid_subcategory(category, subcategory)), file_name)
+        self.blob_store.link(sha256, save_path, overwrite)
+        self._add_to_index(save_path, category, subcategory, sha256)
+        return save_path
+
+    def is_temp_file(self, file_name):
+        """Проверяет, является ли файл незавершенной загрузкой"""
+        return file_name.startswith('.') and file_name.endswith(TEMP_SUFFIX)
+
+    def open_file(self, file_name, category=None, subcategory=None):
+        """
+        Открывает файл по имени для чтения
+
+        Файл не читается в память целиком: вызывающий код читает его частями
+        или передает открытый файл дальше и сам закрывает его.
+
+        Returns:
+            file: открытый в двоичном режиме файл или None, если файл не найден
+        """
+        # Если указана категория, ищем в конкретной папке
+        entry = self.get_file_entry(file_name, category, subcategory) if category else None
+
+        # Иначе берем первое совпадение по имени во всем каталоге
+        if entry is None:
+            matches = self.resolve(file_name)
+            entry = matches[0] if matches else None
+
+        if entry is None:
+            return None
+        return open(self.get_file_path(entry), 'rb')
+
+    def resolve(self, file_name):
+        """
+        Находит файлы каталога по отображаемому имени
+
+        Returns:
+            list: записи индекса всех файлов с таким именем в порядке категорий;
+            больше одной записи, если имя неоднозначно
+        """
+        self._revalidate_index()
+        with self._index_lock:
+            locations = sorted(self._by_name.get(file_name, ()), key=self._location_order.get)
+            entries = [self._index[location][file_name] for location in locations]
+        return [entry for entry in map(self._refresh_entry, entries) if entry is not None]
+
+    def resolve_path(self, rel_path):
+        """Находит файл по относительному пути вида Категория/[Подкатегория/]имя"""
+        parts = rel_path.strip('/').split('/')
+        if len(parts) == 2:
+            category, subcategory, file_name = parts[0], None, parts[1]
+        elif len(parts) == 3 and self._valid_subcategory(parts[0], parts[1]):
+            category, subcategory, file_name = parts
+        else:
+            return None
+        return self.get_file_entry(file_name, category, subcategory)
+
+    def get_file_path(self, entry):
+        """Возвращает путь к файлу на диске по записи индекса"""
+        return os.path.join(self.base_dir, entry['path'])
+
+    def get_file_entry(self, file_name, category, subcategory=None):
+        """Возвращает запись индекса для файла в конкретной директории"""
+        self._revalidate_index()
+        subcategory = self._valid_subcategory(category, subcategory)
+        with self._index_lock:
+            entry = self._index.get((category, subcategory), {}).get(file_name)
+        if entry is None:
+            return None
+        return self._refresh_entry(entry)
+
+    def _refresh_entry(self, entry):
+        """Сверяет запись индекса с файлом на диске и возвращает ее копию"""
+        # Файл могли перезаписать на месте, не меняя mtime директории
+        try:
+            stat = os.stat(self.get_file_path(entry))
+        except OSError:
+            return None
+        if stat.st_size != entry['size'] or stat.st_mtime != entry['mtime']:
+            entry = self._make_entry(entry['name'], stat, entry['category'], entry['subcategory'])
+            with self._index_lock:
+                self._index.setdefault((entry['category'], entry['subcategory']), {})[entry['name']] = entry
+            self._notify("added", entry)
+        return dict(entry)
+
+    def add_listener(self, callback):
+        """
+        Подписывает callback(event, entry) на изменения каталога
+
+        event - "added" для нового или измененного файла, "removed" для удаленного.
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, event, entry):
+        """Сообщает подписчикам об изменении файла каталога"""
+        for callback in self._listeners:
+            try:
+                callback(event, dict(entry))
+            except Exception as e:
+                # Ошибка подписчика не должна ломать сохранение и просмотр файлов
+                log_error(f"Ошибка обработчика изменений каталога: {str(e)}", "system", entry['path'])
+
+    def iter_entries(self):
+        """Возвращает записи индекса всех файлов каталога"""
+        self._revalidate_index()
+        with self._index_lock:
+            return [dict(entry) for location in self._iter_locations()
+                    for entry in self._index.get(location, {}).values()]
 
     def get_files_list(self, category=None, subcategory=None):
         """Получает список файлов в указанной категории"""
-        files = []
-        
+        self._revalidate_index()
+
         if category and subcategory and category in self.subcategories and subcategory in self.subcategories[category]:
             # Получаем файлы из конкретной подпапки
-            category_path = os.path.join(self.base_dir, category, subcategory)
-            if os.path.exists(category_path):
-                files.extend(self._get_category_files(category_path, category, subcategory))
+            locations = [(category, subcategory)]
         elif category:
             # Получаем файлы из папки категории
-            category_path = os.path.join(self.base_dir, category)
-            if os.path.exists(category_path):
-                files.extend(self._get_category_files(category_path, category))
+            locations = [(category, None)]
         else:
             # Получаем файлы из всех категорий
-            for category in self.categories:
-                category_path = os.path.join(self.base_dir, category)
-                if os.path.exists(category_path):
-                    files.extend(self._get_category_files(category_path, category))
-        
-        return files
+            locations = [(category, None) for category in self.categories]
 
-    def _get_category_files(self, category_path, category, subcategory=None):
-        """Получает информацию о файлах в указанной категории"""
+        return self._collect_files(locations)
+
+    def get_all_files(self):
+        """Получает список файлов из всех категорий и подкатегорий"""
+        self._revalidate_index()
+        return self._collect_files(self._iter_locations())
+
+    def file_exists(self, file_name, category, subcategory=None):
+        """Проверяет по индексу, есть ли файл с таким именем в категории"""
+        self._revalidate_index()
+        subcategory = self._valid_subcategory(category, subcategory)
+        with self._index_lock:
+            return file_name in self._index.get((category, subcategory), {})
+
+    def _collect_files(self, locations):
+        """Собирает информацию о файлах из индекса для указанных директорий"""
         files = []
-        for file_name in os.listdir(category_path):
-            file_path = os.path.join(category_path, file_name)
-            if os.path.isfile(file_path):
-                file_info = {
-                    'name': file_name,
-                    'size': self._format_size(os.path.getsize(file_path)),
-                    'date': datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d %H:%M:%S'),
-                    'category': category
-                }
-                if subcategory:
-                    file_info['subcategory'] = subcategory
-                files.append(file_info)
+        with self._index_lock:
+            for location in locations:
+                for entry in self._index.get(location, {}).values():
+                    files.append(self.get_file_info(entry))
         return files
 
+    def get_file_info(self, entry):
+        """Формирует описание файла для вывода пользователю"""
+        file_info = {
+            'name': entry['name'],
+            'size': self._format_size(entry['size']),
+            'date': datetime.fromtimestamp(entry['mtime']).strftime('%Y-%m-%d %H:%M:%S'),
+            'category': entry['category']
+        }
+        if entry['subcategory']:
+            file_info['subcategory'] = entry['subcategory']
+        return file_info
+
+    def _iter_locations(self):
+        """Перечисляет все директории каталога: категории и их подкатегории"""
+        for category in self.categories:
+            yield category, None
+            for subcategory in self.subcategories.get(category, []):
+                yield category, subcategory
+
+    def _location_path(self, category, subcategory=None):
+        """Возвращает путь к директории категории или подкатегории"""
+        if subcategory:
+            return os.path.join(self.base_dir, category, subcategory)
+        return os.path.join(self.base_dir, category)
+
+    def _make_entry(self, file_name, stat, category, subcategory=None):
+        """Создает запись индекса из результата stat"""
+        rel_path = os.path.join(category, subcategory, file_name) if subcategory else os.path.join(category, file_name)
+        return {
+            'name': file_name,
+            'path': rel_path,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'category': category,
+            'subcategory': subcategory,
+            # Хеш содержимого известен только в режиме "cas"
+            'sha256': self.blob_store.sha_for_path(rel_path, stat.st_size, stat.st_mtime) if self.blob_store else None
+        }
+
+    def _dir_mtime(self, path):
+        """Возвращает mtime директории или None, если ее нет"""
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _scan_location(self, category, subcategory=None):
+        """Сканирует одну директорию через os.scandir и обновляет индекс"""
+        path = self._location_path(category, subcategory)
+        dir_mtime = self._dir_mtime(path)
+        entries = {}
+        if dir_mtime is not None:
+            with os.scandir(path) as it:
+                for dir_entry in it:
+                    try:
+                        if dir_entry.is_file() and not self.is_temp_file(dir_entry.name):
+                            entries[dir_entry.name] = self._make_entry(
+                                dir_entry.name, dir_entry.stat(), category, subcategory
+                            )
+                    except OSError:
+                        # Файл удалили во время сканирования
+                        continue
+
+        # Если директория менялась только что, ее mtime может не отразить
+        # следующее изменение в том же тике часов - пересканируем ее в следующий раз
+        if dir_mtime is not None and time.time_ns() - dir_mtime < 2 * 10 ** 9:
+            dir_mtime = None
+
+        with self._index_lock:
+            location = (category, subcategory)
+            old_entries = self._index.get(location, {})
+            for file_name in old_entries:
+                if file_name not in entries:
+                    self._by_name[file_name].discard(location)
+                    if not self._by_name[file_name]:
+                        del self._by_name[file_name]
+            for file_name in entries:
+                self._by_name.setdefault(file_name, set()).add(location)
+            self._index[location] = entries
+            self._dir_mtimes[location] = dir_mtime
+
+        # Сообщаем об изменениях, сделанных в обход save_file
+        for file_name, entry in entries.items():
+            old_entry = old_entries.get(file_name)
+            if old_entry is None or old_entry['size'] != entry['size'] or old_entry['mtime'] != entry['mtime']:
+                self._notify("added", entry)
+        for file_name, entry in old_entries.items():
+            if file_name not in entries:
+                self._notify("removed", entry)
+
+    def _build_index(self):
+        """Строит индекс каталога при запуске"""
+        for category, subcategory in self._iter_locations():
+            self._scan_location(category, subcategory)
+
+    def _revalidate_index(self):
+        """Пересканирует только те директории, mtime которых изменился"""
+        for category, subcategory in self._iter_locations():
+            path = self._location_path(category, subcategory)
+            cached_mtime = self._dir_mtimes.get((category, subcategory))
+            if cached_mtime is None or self._dir_mtime(path) != cached_mtime:
+                self._scan_location(category, subcategory)
+
+    def _add_to_index(self, file_path, category, subcategory=None, sha256=None, file_unique_id=None):
+        """Добавляет сохраненный файл в индекс"""
+        subcategory = self._valid_subcategory(category, subcategory)
+        file_name = os.path.basename(file_path)
+        stat = os.stat(file_path)
+        if self.blob_store and sha256:
+            rel_path = os.path.relpath(file_path, self.base_dir)
+            self.blob_store.add_ref(rel_path, sha256, stat.st_size, stat.st_mtime, file_unique_id)
+        entry = self._make_entry(file_name, stat, category, subcategory)
+        with self._index_lock:
+            self._index.setdefault((category, subcategory), {})[file_name] = entry
+            self._by_name.setdefault(file_name, set()).add((category, subcategory))
+        self._notify("added", entry)
+
+    def _valid_subcategory(self, category, subcategory):
+        """Возвращает подкатегорию, если она существует у категории, иначе None"""
+        if subcategory and category in self.subcategories and subcategory in self.subcategories[category]:
+            return subcategory
+        return None
+
     def _format_size(self, size):
         """Форматирует размер файла в читаемый вид"""
         for unit in ['B', 'KB', 'MB', 'GB']:
@@ -0,0 +1,74 @@
+import json
+import os
+import threading
+
+from shared_files import file_lock, file_version, write_atomic
+
+
+class FileIdCache:
+    """
+    Хранит file_id, которые Telegram вернул после первой отправки файла
+
+    Файл кэша могут менять несколько процессов бота: запись идет под
+    файловой блокировкой и начинается с перечитывания файла, а чтение
+    подхватывает изменения других процессов по mtime файла.
+    """
+
+    def __init__(self, cache_file='file_id_cache.json'):
+        self.cache_file = cache_file
+        self._lock = threading.Lock()
+        self._cache = {}
+        # Версия файла, из которой загружен кэш в памяти
+        self._loaded_version = None
+        with self._lock:
+            self._refresh()
+
+    def _load(self):
+        """Загружает кэш из файла"""
+        if os.path.exists(self.cache_file):
+            try:
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                # Поврежденный кэш не критичен - файлы просто будут загружены заново
+                return {}
+        return {}
+
+    def _refresh(self):
+        """Перечитывает кэш, если файл изменился; вызывается под _lock"""
+        version = file_version(self.cache_file)
+        if version != self._loaded_version:
+            self._cache = self._load()
+            self._loaded_version = version
+
+    def _update(self, change):
+        """Применяет изменение к свежей версии кэша и сохраняет ее; вызывается под _lock"""
+        with file_lock(self.cache_file):
+            self._refresh()
+            if not change(self._cache):
+                return
+            write_atomic(self.cache_file, json.dumps(self._cache, ensure_ascii=False))
+            self._loaded_version = file_version(self.cache_file)
+
+    def get(self, key, size, mtime):
+        """Возвращает file_id, если файл не менялся с момента отправки"""
+        with self._lock:
+            self._refresh()
+            record = self._cache.get(key)
+        if record and record['size'] == size and record['mtime'] == mtime:
+            return record['file_id']
+        return None
+
+    def put(self, key, size, mtime, file_id):
+        """Запоминает file_id для версии файла"""
+        def change(cache):
+            cache[key] = {'size': size, 'mtime': mtime, 'file_id': file_id}
+            return True
+
+        with self._lock:
+            self._update(change)
+
+    def invalidate(self, key):
+        """Удаляет file_id, который Telegram больше не принимает"""
+        with self._lock:
+            self._update(lambda cache: cache.pop(key, None) is not None)
@@ -0,0 +1,199 @@
+import heapq
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+# Транслитерация кириллицы, чтобы "докер" и "docker" давали общие триграммы
+TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'c', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya'
+}
+
+# Разделители в именах файлов, которые считаются пробелами
+SEPARATORS_RE = re.compile(r'[\s+_\-.,()\[\]{}/\\]+')
+
+# Минимальная доля общих триграмм, при которой имя считается похожим
+MIN_SIMILARITY = 0.3
+
+# Расширения документов, которые не участвуют в сравнении имен
+DOCUMENT_EXTENSIONS = {
+    '.pdf', '.doc', '.docx', '.txt', '.rtf', '.odt', '.md', '.epub', '.fb2', '.djvu', '.mobi',
+    '.chm', '.html', '.htm', '.ppt', '.pptx', '.xls', '.xlsx', '.csv', '.zip', '.rar', '.7z'
+}
+
+
+def normalize_name(name, strip_extension=False):
+    """
+    Приводит имя файла или запрос к виду для нечеткого сравнения
+
+    Расширение отрезается только у имен файлов и только известное: точка в
+    запросе ("node.js", "v1.28") - часть слова.
+    """
+    if strip_extension:
+        base, extension = os.path.splitext(name)
+        if extension.lower() in DOCUMENT_EXTENSIONS:
+            name = base
+    name = name.lower()
+    # Латинские c и k звучат одинаково, как и в транслитерации "к"
+    name = "".join(TRANSLIT.get(char, char) for char in name).replace('ck', 'k').replace('c', 'k')
+    return " ".join(SEPARATORS_RE.sub(" ", name).split())
+
+
+def trigrams(text):
+    """Возвращает множество триграмм слов текста с учетом границ слов"""
+    result = set()
+    for word in text.split():
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            result.add(padded[i:i + 3])
+    return result
+
+
+def inner_trigrams(text):
+    """Возвращает триграммы внутри слов: они есть у любого имени, содержащего текст"""
+    result = set()
+    for word in text.split():
+        for i in range(len(word) - 2):
+            result.add(word[i:i + 3])
+    return result
+
+
+class TrigramIndex:
+    """Триграммный индекс имен файлов для нечеткого поиска и подсказок"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Внутренние числовые идентификаторы имен: {путь: id} и обратно
+        self._ids = {}
+        self._keys = {}
+        self._next_id = 0
+        # {id: количество триграмм имени}
+        self._sizes = {}
+        # {id: множество триграмм имени}
+        self._grams = {}
+        # {id: нормализованное имя} для поиска по вхождению
+        self._texts = {}
+        # {триграмма: множество id}
+        self._postings = {}
+
+    def add(self, key, name):
+        """Добавляет или обновляет имя файла"""
+        text = normalize_name(name, strip_extension=True)
+        grams = trigrams(text)
+        with self._lock:
+            self._remove_locked(key)
+            name_id = self._next_id
+            self._next_id += 1
+            self._ids[key] = name_id
+            self._keys[name_id] = key
+            self._sizes[name_id] = len(grams)
+            self._grams[name_id] = grams
+            self._texts[name_id] = text
+            for gram in grams:
+                self._postings.setdefault(gram, set()).add(name_id)
+
+    def remove(self, key):
+        """Удаляет имя файла из индекса"""
+        with self._lock:
+            self._remove_locked(key)
+
+    def _remove_locked(self, key):
+        name_id = self._ids.pop(key, None)
+        if name_id is None:
+            return
+        del self._keys[name_id]
+        del self._sizes[name_id]
+        del self._texts[name_id]
+        for gram in self._grams.pop(name_id):
+            postings = self._postings.get(gram)
+            if postings is not None:
+                postings.discard(name_id)
+                if not postings:
+                    del self._postings[gram]
+
+    def search(self, query, limit=10, min_similarity=MIN_SIMILARITY):
+        """
+        Ищет имена, похожие на запрос или содержащие его
+
+        Сходство считается точно для всех имен, у которых достаточно общих
+        триграмм с запросом; имена, содержащие запрос целиком, находятся всегда.
+
+        Args:
+            limit: сколько лучших совпадений вернуть; None - все совпадения
+
+        Returns:
+            list: пары (путь, сходство), отсортированные по убыванию сходства
+        """
+        query_text = normalize_name(query)
+        query_grams = trigrams(query_text)
+        if not query_grams:
+            return []
+        query_size = len(query_grams)
+
+        # Имя без хотя бы одной из rare_count самых редких триграмм запроса не
+        # наберет min_count общих триграмм, поэтому кандидаты ищутся только по ним
+        min_count = min_similarity * query_size
+        rare_count = query_size - math.ceil(min_count) + 1
+
+        with self._lock:
+            postings_lists = sorted(
+                (postings for postings in map(self._postings.get, query_grams) if postings), key=len
+            )
+            # Counter.update считает элементы на уровне C
+            shared = Counter()
+            for postings in postings_lists[:rare_count]:
+                shared.update(postings)
+            # Остальные триграммы досчитываем только для найденных кандидатов
+            for postings in postings_lists[rare_count:]:
+                shared.update(postings & shared.keys())
+
+            contained = self._containing(query_text)
+            for name_id in contained - shared.keys():
+                shared[name_id] = len(query_grams & self._grams[name_id])
+
+            results = []
+            for name_id, count in shared.items():
+                if name_id in contained:
+                    coverage = 1
+                elif count >= min_count:
+                    coverage = count / query_size
+                else:
+                    continue
+                # Доля триграмм запроса, найденных в имени, с небольшим штрафом за длину имени
+                similarity = coverage * (2 * count / (query_size + self._sizes[name_id])) ** 0.25
+                if similarity >= min_similarity or name_id in contained:
+                    results.append((similarity, name_id))
+
+            if limit is None:
+                best = sorted(results, reverse=True)
+            else:
+                best = heapq.nlargest(limit, results)
+            return [(self._keys[name_id], similarity) for similarity, name_id in best]
+
+    def _containing(self, query_text):
+        """Возвращает id имен, содержащих нормализованный запрос; вызывается под _lock"""
+        grams = inner_trigrams(query_text)
+        if grams:
+            # Пересекаем списки, начиная с самого короткого
+            postings_lists = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+            candidates = set(postings_lists[0])
+            for postings in postings_lists[1:]:
+                if not candidates:
+                    break
+                candidates &= postings
+        else:
+            # В запросе только слова короче трех букв - проверяем все имена
+            candidates = self._texts.keys()
+        return {name_id for name_id in candidates if query_text in self._texts[name_id]}
+
+
+def build_name_index(file_handler):
+    """Строит триграммный индекс по всем файлам каталога"""
+    index = TrigramIndex()
+    for entry in file_handler.iter_entries():
+        index.add(entry['path'], entry['name'])
+    return index
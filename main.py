@@ -0,0 +1,9 @@
+# Точка входа бота. Процессы пула извлечения текста и обработчики кластерного
+# режима при запуске заново импортируют главный модуль программы; модуль бота
+# импортируется здесь только в основном процессе, поэтому процессы пула не
+# поднимают собственную копию бота. Обработчики кластера импортируют модуль
+# бота сами, когда получают функцию, которую нужно выполнить.
+if __name__ == "__main__":
+    import bot_with_files
+
+    bot_with_files.main()
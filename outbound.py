@@ -0,0 +1,321 @@
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+import requests
+
+from error_logger import log_error
+
+# Классы приоритета исходящих запросов: ответы на действия пользователя
+# отправляются раньше массовых списков
+INTERACTIVE = 0
+BULK = 1
+
+# Максимальная длина текстового сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+# Размер части файла, читаемой за раз при отправке
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Методы API, отправляющие что-то в чат и подпадающие под ограничения Telegram
+LIMITED_METHODS = {
+    'sendMessage', 'sendDocument', 'sendPhoto', 'sendMediaGroup', 'sendChatAction',
+    'editMessageText', 'editMessageReplyMarkup', 'copyMessage', 'forwardMessage'
+}
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity про запас"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # Пауза после ответа 429 с retry_after
+        self.blocked_until = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Сколько секунд ждать до появления токена"""
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_idle(self, now):
+        """Корзина полна - ее можно забыть без потери ограничений"""
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+class MultipartStream:
+    """
+    Тело запроса multipart/form-data, читающее файлы частями во время отправки
+
+    requests собирает multipart-тело в памяти целиком, поэтому каждая
+    отправка документа стоила бы памяти размером с файл. Здесь в памяти
+    держится только одна часть файла; длина тела известна заранее, поэтому
+    запрос уходит с Content-Length, а не частями (chunked).
+    """
+
+    def __init__(self, files, chunk_size=STREAM_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        # Части тела: байты или (файл, сколько байт из него отправить)
+        self._parts = []
+        for field, value in files.items():
+            if isinstance(value, tuple):
+                file_name, file_obj = value
+            else:
+                file_name, file_obj = os.path.basename(getattr(value, 'name', None) or 'file'), value
+            # Кавычки и переводы строк в имени файла ломают заголовок
+            file_name = file_name.replace('"', '%22').replace('\r', ' ').replace('\n', ' ')
+            header = (
+                f"--{boundary}\r\n"
+                f"Content-Disposition: form-data; name=\"{field}\"; filename=\"{file_name}\"\r\n"
+                "Content-Type: application/octet-stream\r\n\r\n"
+            ).encode('utf-8')
+            size = os.fstat(file_obj.fileno()).st_size - file_obj.tell()
+            self._parts += [header, (file_obj, size), b"\r\n"]
+        self._parts.append(f"--{boundary}--\r\n".encode())
+
+    @staticmethod
+    def supports(files):
+        """Можно ли отправить файлы потоком: нужны настоящие файлы с fileno"""
+        def is_file(value):
+            file_obj = value[1] if isinstance(value, tuple) else value
+            try:
+                file_obj.fileno()
+                return True
+            except (AttributeError, OSError, ValueError):
+                return False
+        return bool(files) and all(map(is_file, files.values()))
+
+    def __len__(self):
+        return sum(len(part) if isinstance(part, bytes) else part[1] for part in self._parts)
+
+    def __iter__(self):
+        for part in self._parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            file_obj, remaining = part
+            while remaining > 0:
+                chunk = file_obj.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    raise IOError("Файл стал короче во время отправки")
+                remaining -= len(chunk)
+                yield chunk
+
+
+class OutboundDispatcher:
+    """
+    Ограничитель исходящих запросов к Telegram API
+
+    Устанавливается как apihelper.CUSTOM_REQUEST_SENDER, поэтому действует на
+    все вызовы бота. Отправка в чат ждет токена общей корзины (лимит на бота)
+    и корзины чата (лимит на чат, для групп строже). Среди ожидающих первыми
+    идут запросы с более высоким приоритетом. На ответ 429 запрос повторяется
+    после паузы retry_after, которая распространяется на весь чат или на бота.
+
+    Кроме того, send_text собирает подряд идущие тексты в один чат в
+    сообщения до 4096 символов и отправляет их в фоне с приоритетом BULK.
+    """
+
+    def __init__(self, send, global_rate=30, chat_rate=1.0, group_rate=20 / 60,
+                 chat_burst=3, max_retries=5):
+        """
+        Args:
+            send: функция отправки текста send(chat_id, text, parse_mode)
+        """
+        self.send = send
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._cond = threading.Condition()
+        # Ожидающие токена запросы: {(приоритет, порядковый номер): id чата}
+        self._waiters = {}
+        self._seq = itertools.count()
+        self._local = threading.local()
+
+        # Очереди текстов для склейки: {id чата: deque[(текст, parse_mode)]}
+        self._outbox = {}
+        self._outbox_chats = deque()
+        self._outbox_cond = threading.Condition()
+        threading.Thread(target=self._outbox_loop, daemon=True, name='outbound-texts').start()
+
+    @contextmanager
+    def priority(self, priority):
+        """Задает приоритет запросов текущего потока"""
+        previous = getattr(self._local, 'priority', INTERACTIVE)
+        self._local.priority = priority
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                # Забываем чаты, которые давно ничего не получали
+                now = time.monotonic()
+                for idle_chat in [c for c, b in self._chats.items() if b.is_idle(now)]:
+                    del self._chats[idle_chat]
+            # У групп и каналов отрицательные id и более строгий лимит
+            rate = self.group_rate if str(chat_id).startswith('-') else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    def _acquire(self, chat_id):
+        """Ждет разрешения на отправку в чат с учетом приоритета"""
+        ticket = (getattr(self._local, 'priority', INTERACTIVE), next(self._seq))
+        with self._cond:
+            self._waiters[ticket] = chat_id
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._chat_bucket(chat_id).wait_time(now)
+                    if wait <= 0:
+                        wait = self._global.wait_time(now)
+                    if wait <= 0:
+                        # Чату уже можно отправлять; пропускаем вперед тех, кто
+                        # важнее и тоже готов
+                        ahead = any(
+                            other < ticket and self._chat_bucket(other_chat).wait_time(now) <= 0
+                            for other, other_chat in self._waiters.items()
+                        )
+                        if not ahead:
+                            self._global.take(now)
+                            self._chat_bucket(chat_id).take(now)
+                            return
+                        wait = None
+                    self._cond.wait(wait)
+            finally:
+                del self._waiters[ticket]
+                self._cond.notify_all()
+
+    def _pause(self, chat_id, retry_after):
+        """Приостанавливает отправку после ответа 429"""
+        with self._cond:
+            bucket = self._global if chat_id is None else self._chat_bucket(chat_id)
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + retry_after)
+            self._cond.notify_all()
+
+    def request_sender(self, method, url, params=None, files=None, **kwargs):
+        """Выполняет запрос к API, соблюдая лимиты и повторяя его после 429"""
+        method_name = url.rsplit('/', 1)[-1]
+        chat_id = None
+        if method_name in LIMITED_METHODS and params:
+            chat_id = params.get('chat_id')
+
+        for attempt in range(self.max_retries):
+            if chat_id is not None:
+                self._acquire(chat_id)
+            if MultipartStream.supports(files):
+                # Документы из хранилища отправляются потоком, без чтения в память
+                body = MultipartStream(files)
+                response = self._session().request(
+                    method, url, params=params, data=body,
+                    headers={'Content-Type': body.content_type}, **kwargs
+                )
+            else:
+                response = self._session().request(method, url, params=params, files=files, **kwargs)
+            if response.status_code != 429:
+                return response
+
+            try:
+                retry_after = response.json().get('parameters', {}).get('retry_after', 1)
+            except ValueError:
+                retry_after = 1
+            log_error(f"Превышен лимит Telegram для {method_name}, повтор через {retry_after} с",
+                      chat_id or "system", "outbound")
+            # Без чата лимит относится ко всему боту
+            self._pause(chat_id, retry_after)
+            if chat_id is None:
+                time.sleep(retry_after)
+            # Файлы отправляются заново с начала
+            for value in (files or {}).values():
+                file_obj = value[1] if isinstance(value, tuple) else value
+                if hasattr(file_obj, 'seek'):
+                    file_obj.seek(0)
+        return response
+
+    def send_text(self, chat_id, text, parse_mode=None):
+        """
+        Ставит текст в очередь фоновой отправки в чат
+
+        Подряд идущие тексты с одинаковой разметкой склеиваются в сообщения до
+        4096 символов; длинный текст разбивается по строкам.
+        """
+        with self._outbox_cond:
+            chat_outbox = self._outbox.get(chat_id)
+            if chat_outbox is None:
+                chat_outbox = self._outbox[chat_id] = deque()
+                self._outbox_chats.append(chat_id)
+            chat_outbox.append((text, parse_mode))
+            self._outbox_cond.notify()
+
+    def _outbox_loop(self):
+        """Фоновая отправка текстов: по одному сообщению на чат по кругу"""
+        with self.priority(BULK):
+            while True:
+                with self._outbox_cond:
+                    while not self._outbox_chats:
+                        self._outbox_cond.wait()
+                    chat_id = self._outbox_chats.popleft()
+                    chat_outbox = self._outbox[chat_id]
+                    text, parse_mode = self._take_message(chat_outbox)
+                    if chat_outbox:
+                        self._outbox_chats.append(chat_id)
+                    else:
+                        del self._outbox[chat_id]
+                try:
+                    self.send(chat_id, text, parse_mode)
+                except Exception as e:
+                    log_error(f"Ошибка при отправке сообщения: {str(e)}", chat_id, "outbound")
+
+    def _take_message(self, chat_outbox):
+        """Склеивает начало очереди чата в одно сообщение; вызывается под блокировкой"""
+        text, parse_mode = chat_outbox.popleft()
+        if len(text) > MESSAGE_LIMIT:
+            # Режем по последнему переводу строки, чтобы не разорвать разметку
+            cut = text.rfind("\n", 0, MESSAGE_LIMIT)
+            if cut <= 0:
+                cut = MESSAGE_LIMIT
+            rest = text[cut:].lstrip("\n")
+            if rest:
+                chat_outbox.appendleft((rest, parse_mode))
+            return text[:cut], parse_mode
+
+        while chat_outbox:
+            next_text, next_parse_mode = chat_outbox[0]
+            if next_parse_mode != parse_mode or len(text) + 1 + len(next_text) > MESSAGE_LIMIT:
+                break
+            chat_outbox.popleft()
+            text += "\n" + next_text
+        return text, parse_mode
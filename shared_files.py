@@ -0,0 +1,50 @@
+import fcntl
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Блокирует файл между процессами на время изменения
+
+    Блокировка берется на отдельный файл <путь>.lock, потому что сам файл
+    заменяется переименованием. flock действует и между потоками одного
+    процесса, так как каждый вызов открывает файл заново.
+    """
+    with open(f"{path}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def file_version(path):
+    """Возвращает (mtime в наносекундах, размер) файла или None, если файла нет"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def write_atomic(path, data):
+    """Записывает текст через временный файл с уникальным именем и переименование"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp создает файл с правами 0600, выставляем обычные права
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,249 @@
+import json
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+# Сколько хранится состояние чата без обновлений
+DEFAULT_TTL = 7 * 24 * 3600
+
+
+class MemoryBackend:
+    """Хранение в памяти процесса: LRU с ограничением числа записей и сроком жизни"""
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # {ключ: (данные, истекает)} в порядке последнего обращения
+        self._items = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[1] <= time.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def set(self, key, data, ttl):
+        with self._lock:
+            self._items[key] = (data, time.time() + ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+
+class SQLiteBackend:
+    """
+    Хранение в SQLite: переживает перезапуск и доступно нескольким процессам
+
+    Записи с истекшим сроком и самые давно обновленные записи сверх
+    max_entries удаляются периодически при записи.
+    """
+
+    def __init__(self, path, max_entries=1000000, cleanup_every=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self.cleanup_every = cleanup_every
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "key TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS state_updated ON state (updated)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            "SELECT data FROM state WHERE key = ? AND expires > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, data, ttl):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO state (key, data, expires, updated) VALUES (?, ?, ?, ?)",
+                (key, data, now + ttl, now)
+            )
+        self._writes += 1
+        if self._writes % self.cleanup_every == 0:
+            self._cleanup()
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM state WHERE key = ?", (key,))
+
+    def _cleanup(self):
+        """Удаляет истекшие записи и самые старые записи сверх лимита"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM state WHERE expires <= ?", (time.time(),))
+            excess = conn.execute("SELECT COUNT(*) FROM state").fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM state WHERE key IN (SELECT key FROM state ORDER BY updated LIMIT ?)",
+                    (excess,)
+                )
+
+
+class RedisBackend:
+    """
+    Хранение в Redis или совместимом сервере по протоколу RESP
+
+    Срок жизни задается командой SET ... EX, ограничение по памяти - политикой
+    вытеснения сервера (maxmemory-policy allkeys-lru).
+    """
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None, prefix='bot:state:', timeout=5):
+        self.address = (host, port)
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+            conn = self._local.conn = (sock, sock.makefile('rb'))
+            if self.password:
+                self._call(conn, 'AUTH', self.password)
+            if self.db:
+                self._call(conn, 'SELECT', str(self.db))
+        return conn
+
+    def _command(self, *args):
+        """Выполняет команду, переподключаясь один раз при обрыве соединения"""
+        for attempt in range(2):
+            try:
+                return self._call(self._connection(), *args)
+            except OSError:
+                conn = getattr(self._local, 'conn', None)
+                if conn is not None:
+                    conn[0].close()
+                self._local.conn = None
+                if attempt:
+                    raise
+
+    def _call(self, conn, *args):
+        sock, reader = conn
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg.encode('utf-8') if isinstance(arg, str) else arg
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        sock.sendall(b"".join(parts))
+        return self._read_reply(reader)
+
+    def _read_reply(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Соединение с Redis закрыто")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            raise RuntimeError(f"Ошибка Redis: {payload.decode()}")
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2].decode('utf-8')
+        if kind == b'*':
+            return [self._read_reply(reader) for _ in range(int(payload))]
+        raise RuntimeError(f"Неизвестный ответ Redis: {line!r}")
+
+    def get(self, key):
+        return self._command('GET', self.prefix + key)
+
+    def set(self, key, data, ttl):
+        self._command('SET', self.prefix + key, data, 'EX', str(int(ttl)))
+
+    def delete(self, key):
+        self._command('DEL', self.prefix + key)
+
+
+class StateStore:
+    """
+    Состояние диалогов по чатам: текущий шаг, выбранная категория, загружаемый файл
+
+    Запись чата - небольшой словарь, который хранится в компактном JSON в
+    выбранном хранилище. Каждое обновление продлевает срок жизни записи.
+    """
+
+    def __init__(self, backend, ttl=DEFAULT_TTL):
+        self.backend = backend
+        self.ttl = ttl
+
+    def get(self, chat_id):
+        """Возвращает состояние чата (пустой словарь, если его нет)"""
+        data = self.backend.get(str(chat_id))
+        return json.loads(data) if data else {}
+
+    def update(self, chat_id, **fields):
+        """Меняет поля состояния чата; поле со значением None удаляется"""
+        state = self.get(chat_id)
+        for name, value in fields.items():
+            if value is None:
+                state.pop(name, None)
+            else:
+                state[name] = value
+        if state:
+            data = json.dumps(state, ensure_ascii=False, separators=(',', ':'))
+            self.backend.set(str(chat_id), data, self.ttl)
+        else:
+            self.backend.delete(str(chat_id))
+        return state
+
+    def clear(self, chat_id, *fields):
+        """Удаляет указанные поля состояния или все состояние чата"""
+        if fields:
+            self.update(chat_id, **{name: None for name in fields})
+        else:
+            self.backend.delete(str(chat_id))
+
+
+def create_state_store(url, ttl=DEFAULT_TTL):
+    """
+    Создает хранилище состояний по адресу
+
+    memory, sqlite:///файл.db (или sqlite:файл.db), redis://[:пароль@]хост:порт/номер_бд
+    """
+    parsed = urlparse(url)
+    if parsed.scheme in ('', 'memory'):
+        backend = MemoryBackend()
+    elif parsed.scheme == 'sqlite':
+        # Как в SQLAlchemy: sqlite:///state.db - относительный путь, sqlite:////data/state.db - абсолютный
+        path = url.split(':', 1)[1]
+        backend = SQLiteBackend(path[3:] if path.startswith('///') else path)
+    elif parsed.scheme == 'redis':
+        backend = RedisBackend(
+            host=parsed.hostname or 'localhost',
+            port=parsed.port or 6379,
+            db=int(parsed.path.lstrip('/') or 0),
+            password=parsed.password
+        )
+    else:
+        raise ValueError(f"Неизвестное хранилище состояний: {url}")
+    return StateStore(backend, ttl)
@@ -0,0 +1,413 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from error_logger import log_error
+from shared_files import file_lock, write_atomic
+
+# Версия формата снапшота статистики
+SNAPSHOT_VERSION = 3
+
+# Сколько хранить почасовые и посуточные сводки
+HOURLY_RETENTION = 48
+DAILY_RETENTION = 400
+
+
+class StatsStore:
+    """
+    Хранилище статистики скачиваний: снапшот и журнал событий
+
+    Каждое скачивание меняет счетчики в памяти и добавляет событие в очередь,
+    которую фоновый поток дописывает в журнал одной записью с одним fsync
+    (групповая запись). Когда журнал разрастается, счетчики сохраняются в
+    снапшот и журнал начинается заново. Снапшот и журнал помечаются номером
+    поколения, поэтому сбой между их записью не приводит к двойному учету:
+    журнал чужого поколения при загрузке заменяется новым.
+
+    Кроме общих счетчиков, события с отметкой времени раскладываются по
+    почасовым и посуточным сводкам, поэтому статистика за период считается
+    по нескольким сводкам, а не по всей истории. Устаревшие сводки удаляются.
+
+    В общем режиме (shared=True) одни и те же файлы ведут несколько процессов:
+    запись в журнал и компактизация защищены файловой блокировкой, события
+    помечаются pid процесса, а фоновый поток дочитывает из журнала события
+    других процессов. После компактизации другим процессом снапшот и журнал
+    перечитываются заново.
+    """
+
+    def __init__(self, stats_file, flush_interval=1.0, flush_batch=100, compact_every=10000, shared=False):
+        self.stats_file = stats_file
+        self.log_file = f"{stats_file}.log"
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.compact_every = compact_every
+        self.shared = shared
+        self._writer = os.getpid()
+        self._lock = threading.Lock()
+        self._flush_needed = threading.Condition(self._lock)
+        # Сериализует запись в журнал и компактизацию
+        self._io_lock = threading.Lock()
+        # {имя файла: {id пользователя: количество скачиваний}}
+        self._downloads = {}
+        # Агрегаты, обновляемые при каждом скачивании
+        # {имя файла: всего скачиваний}
+        self._totals = {}
+        # Обратный индекс {id пользователя: {имя файла: количество скачиваний}}
+        self._by_user = {}
+        # Файлы по убыванию числа скачиваний, позиции файлов в этом списке
+        # и начало блока файлов с одинаковым числом скачиваний
+        self._rank = []
+        self._positions = {}
+        self._block_start = {}
+        # Сводки за периоды: {начало часа: сводка} и {дата: сводка},
+        # где сводка - {'files': {имя файла: n}, 'users': {id пользователя: n}}
+        self._hourly = {}
+        self._daily = {}
+        self._pending = []
+        # Номер изменения статистики - по нему сбрасываются кэши отчетов
+        self._version = 0
+        self._generation = 0
+        self._log_events = 0
+        # Сколько байт журнала уже применено к счетчикам
+        self._log_offset = 0
+        # Журнал не начат заново после записи снапшота
+        self._log_stale = False
+        with self._file_lock():
+            self._load()
+        threading.Thread(target=self._flush_loop, daemon=True, name='stats-flusher').start()
+
+    def _load(self):
+        """Загружает снапшот и применяет события журнала текущего поколения"""
+        if os.path.exists(self.stats_file):
+            with open(self.stats_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data.get('version'), int):
+                self._generation = data['generation']
+                self._load_snapshot(data)
+            else:
+                # Старый формат: словарь {имя файла: {id пользователя: количество}}
+                self._load_snapshot({'downloads': data})
+
+        self._log_offset = 0
+        if not self._read_log(skip_own=False):
+            # Сбой между записью снапшота и журнала: события старого журнала уже
+            # в снапшоте, а новые должны попасть в журнал поколения снапшота
+            self._start_log(self._generation)
+
+    def _read_log(self, skip_own):
+        """
+        Применяет события, дописанные в журнал после предыдущего чтения
+
+        Returns:
+            bool: False, если журнал принадлежит другому поколению
+        """
+        if not os.path.exists(self.log_file):
+            return True
+        with open(self.log_file, 'rb') as f:
+            header = f.readline()
+            if not header.endswith(b"\n"):
+                return True
+            if json.loads(header).get('generation') != self._generation:
+                # Журнал прошлого поколения уже учтен в снапшоте
+                return False
+            f.seek(max(self._log_offset, len(header)))
+            data = f.read()
+
+        # Берем только полные строки: последнюю, возможно, еще дописывают
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                event = json.loads(line)
+            except ValueError:
+                # Строка, недописанная при сбое
+                continue
+            if skip_own and event.get('w') == self._writer:
+                continue
+            self._apply(event)
+            self._log_events += 1
+        self._log_offset = max(self._log_offset, len(header)) + end
+        return True
+
+    def _catch_up(self):
+        """Применяет события других процессов; вызывается под _io_lock и файловой блокировкой"""
+        with self._lock:
+            if self._read_log(skip_own=True):
+                return
+            # Другой процесс сжал журнал - перечитываем снапшот и новый журнал,
+            # а еще не записанные свои события применяем заново
+            pending = self._pending
+            self._reset()
+            self._load()
+            for event in pending:
+                self._apply(event)
+
+    def _reset(self):
+        """Очищает счетчики и агрегаты перед повторной загрузкой"""
+        self._downloads = {}
+        self._totals = {}
+        self._by_user = {}
+        self._rank = []
+        self._positions = {}
+        self._block_start = {}
+        self._hourly = {}
+        self._daily = {}
+        self._log_events = 0
+        self._version += 1
+
+    @contextmanager
+    def _file_lock(self):
+        """Блокировка журнала между процессами в общем режиме"""
+        if not self.shared:
+            yield
+            return
+        with file_lock(self.log_file):
+            yield
+
+    def _load_snapshot(self, data):
+        """Восстанавливает счетчики из снапшота и строит агрегаты"""
+        self._downloads = data['downloads']
+        # Ключи JSON всегда строки, начало часа храним числом
+        self._hourly = {int(hour): bucket for hour, bucket in data.get('hourly', {}).items()}
+        self._daily = data.get('daily', {})
+        self._by_user = {}
+        for file_name, users in self._downloads.items():
+            self._totals[file_name] = sum(users.values())
+            for user_id, count in users.items():
+                self._by_user.setdefault(user_id, {})[file_name] = count
+
+        self._rank = sorted(self._totals, key=self._totals.get, reverse=True)
+        self._positions = {file_name: i for i, file_name in enumerate(self._rank)}
+        self._block_start = {}
+        for i, file_name in enumerate(self._rank):
+            self._block_start.setdefault(self._totals[file_name], i)
+
+    def _snapshot_data(self, generation):
+        """Возвращает данные для снапшота указанного поколения"""
+        return {
+            'version': SNAPSHOT_VERSION,
+            'generation': generation,
+            'downloads': self._downloads,
+            'hourly': self._hourly,
+            'daily': self._daily
+        }
+
+    def _apply(self, event):
+        """Применяет событие скачивания к счетчикам и агрегатам в памяти"""
+        file_name, user_id = event['file'], event['user']
+        users = self._downloads.setdefault(file_name, {})
+        users[user_id] = users.get(user_id, 0) + 1
+        user_files = self._by_user.setdefault(user_id, {})
+        user_files[file_name] = user_files.get(file_name, 0) + 1
+        self._increment_rank(file_name)
+        self._version += 1
+        if 'ts' in event:
+            # События из журнала старого формата не имеют отметки времени
+            self._add_to_rollups(event['ts'], file_name, user_id)
+
+    def _add_to_rollups(self, ts, file_name, user_id):
+        """Добавляет скачивание в почасовую и посуточную сводки"""
+        hour = ts - ts % 3600
+        day = datetime.fromtimestamp(ts).date()
+        for buckets, key, cutoff in (
+            (self._hourly, hour, hour - HOURLY_RETENTION * 3600),
+            (self._daily, day.isoformat(), (day - timedelta(days=DAILY_RETENTION)).isoformat())
+        ):
+            bucket = buckets.get(key)
+            if bucket is None:
+                # Новая сводка появляется раз в час или сутки - тогда же удаляем устаревшие
+                for old_key in [k for k in buckets if k <= cutoff]:
+                    del buckets[old_key]
+                bucket = buckets[key] = {'files': {}, 'users': {}}
+            bucket['files'][file_name] = bucket['files'].get(file_name, 0) + 1
+            bucket['users'][user_id] = bucket['users'].get(user_id, 0) + 1
+
+    def _increment_rank(self, file_name):
+        """
+        Увеличивает счетчик файла, сохраняя порядок рейтинга, за O(1)
+
+        Файл меняется местами с первым файлом своего блока (файлов с тем же
+        числом скачиваний), после чего граница блоков сдвигается на одну позицию.
+        """
+        if file_name not in self._totals:
+            self._totals[file_name] = 0
+            self._positions[file_name] = len(self._rank)
+            self._rank.append(file_name)
+            self._block_start.setdefault(0, len(self._rank) - 1)
+
+        count = self._totals[file_name]
+        position = self._positions[file_name]
+        first = self._block_start[count]
+        if first != position:
+            other = self._rank[first]
+            self._rank[first], self._rank[position] = file_name, other
+            self._positions[file_name], self._positions[other] = first, position
+
+        # Файл переходит из блока count в блок count + 1
+        if first + 1 < len(self._rank) and self._totals[self._rank[first + 1]] == count:
+            self._block_start[count] = first + 1
+        else:
+            del self._block_start[count]
+        self._block_start.setdefault(count + 1, first)
+        self._totals[file_name] = count + 1
+
+    def record(self, file_name, user_id):
+        """Учитывает скачивание файла пользователем"""
+        event = {'file': file_name, 'user': str(user_id), 'ts': int(time.time())}
+        if self.shared:
+            event['w'] = self._writer
+        with self._lock:
+            self._apply(event)
+            self._pending.append(event)
+            if len(self._pending) >= self.flush_batch:
+                self._flush_needed.notify()
+
+    def top_files(self, limit=None, offset=0):
+        """
+        Возвращает файлы по убыванию числа скачиваний без полного перебора
+
+        Returns:
+            list: кортежи (имя файла, всего скачиваний, уникальных пользователей)
+        """
+        with self._lock:
+            end = len(self._rank) if limit is None else offset + limit
+            return [(file_name, self._totals[file_name], len(self._downloads[file_name]))
+                    for file_name in self._rank[offset:end]]
+
+    def period_stats(self, days=None, hours=None):
+        """
+        Возвращает статистику за последние дни (включая сегодня) или часы
+
+        Считается по сводкам периода, поэтому время не зависит от объема истории.
+
+        Returns:
+            tuple: (список (имя файла, скачиваний) по убыванию, всего скачиваний,
+                    уникальных пользователей)
+        """
+        if hours is not None:
+            now = int(time.time())
+            current = now - now % 3600
+            keys = [current - i * 3600 for i in range(min(hours, HOURLY_RETENTION))]
+            buckets = self._hourly
+        else:
+            today = date.today()
+            keys = [(today - timedelta(days=i)).isoformat() for i in range(min(days, DAILY_RETENTION))]
+            buckets = self._daily
+
+        files = {}
+        users = set()
+        with self._lock:
+            for key in keys:
+                bucket = buckets.get(key)
+                if bucket is None:
+                    continue
+                for file_name, count in bucket['files'].items():
+                    files[file_name] = files.get(file_name, 0) + count
+                users.update(bucket['users'])
+
+        ranked = sorted(files.items(), key=lambda item: item[1], reverse=True)
+        return ranked, sum(files.values()), len(users)
+
+    def rank_of(self, file_name):
+        """Возвращает позицию файла в рейтинге или None, если его не скачивали"""
+        with self._lock:
+            return self._positions.get(file_name)
+
+    def version(self):
+        """Возвращает номер последнего изменения статистики"""
+        with self._lock:
+            return self._version
+
+    def file_stats(self, file_name):
+        """Возвращает всего скачиваний файла и копию счетчиков по пользователям"""
+        with self._lock:
+            return self._totals.get(file_name, 0), dict(self._downloads.get(file_name, {}))
+
+    def user_downloads(self, user_id):
+        """Возвращает скачивания пользователя по обратному индексу: {имя файла: количество}"""
+        with self._lock:
+            return dict(self._by_user.get(str(user_id), {}))
+
+    def file_count(self):
+        """Возвращает количество файлов, которые хотя бы раз скачивали"""
+        with self._lock:
+            return len(self._rank)
+
+    def snapshot(self):
+        """Возвращает копию статистики: {имя файла: {id пользователя: количество}}"""
+        with self._lock:
+            return {file_name: dict(users) for file_name, users in self._downloads.items()}
+
+    def _flush_loop(self):
+        """Периодически дописывает накопленные события в журнал"""
+        while True:
+            with self._lock:
+                self._flush_needed.wait(self.flush_interval)
+            try:
+                self.flush()
+                if self.shared:
+                    with self._io_lock, self._file_lock():
+                        self._catch_up()
+                if self._log_events >= self.compact_every:
+                    self.compact()
+            except Exception as e:
+                log_error(f"Ошибка при сохранении статистики: {str(e)}", "system", "stats_store")
+
+    def flush(self):
+        """Записывает накопленные события в журнал одной записью"""
+        with self._io_lock, self._file_lock():
+            with self._lock:
+                events, self._pending = self._pending, []
+                generation = self._generation
+            if not events:
+                return
+
+            if self._log_stale:
+                self._start_log(generation)
+            new_log = not os.path.exists(self.log_file)
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                if new_log:
+                    f.write(json.dumps({'generation': generation}) + "\n")
+                f.write("".join(json.dumps(event, ensure_ascii=False) + "\n" for event in events))
+                f.flush()
+                os.fsync(f.fileno())
+            self._log_events += len(events)
+
+    def compact(self):
+        """Сохраняет счетчики в снапшот и начинает журнал нового поколения"""
+        with self._io_lock, self._file_lock():
+            if self.shared:
+                # Снапшот должен включать события всех процессов
+                self._catch_up()
+            with self._lock:
+                # Неуспевшие попасть в журнал события входят в снапшот
+                pending, self._pending = self._pending, []
+                generation = self._generation + 1
+                data = json.dumps(self._snapshot_data(generation), ensure_ascii=False)
+
+            try:
+                write_atomic(self.stats_file, data)
+            except BaseException:
+                # Снапшот не записан - события остаются в очереди журнала
+                with self._lock:
+                    self._pending = pending + self._pending
+                raise
+            with self._lock:
+                self._generation = generation
+            self._log_events = 0
+            self._start_log(generation)
+
+    def _start_log(self, generation):
+        """Начинает пустой журнал поколения; вызывается под файловой блокировкой"""
+        header = json.dumps({'generation': generation}) + "\n"
+        # Если запись не удастся, журнал начнется заново при следующей записи событий
+        self._log_stale = True
+        write_atomic(self.log_file, header)
+        self._log_stale = False
+        self._log_offset = len(header)
+
+    def close(self):
+        """Сохраняет все события перед остановкой бота"""
+        self.compact()
@@ -0,0 +1,100 @@
+import threading
+
+import pytest
+
+from ai_scheduler import InferenceScheduler, QueueFullError
+
+
+def wait_all(events, timeout=5):
+    for event in events:
+        assert event.wait(timeout)
+
+
+def test_failing_start_callback_does_not_cancel_generation():
+    done = threading.Event()
+    answers = []
+
+    def on_start():
+        raise RuntimeError("message to edit not found")
+
+    def on_done(response):
+        answers.append(response)
+        done.set()
+
+    scheduler = InferenceScheduler(lambda text: text.upper())
+    scheduler.submit(1, 'hello', on_start, on_done)
+
+    wait_all([done])
+    assert answers == ['HELLO']
+
+
+def test_failed_generation_does_not_stop_worker():
+    done = threading.Event()
+
+    def generate(text):
+        if text == 'bad':
+            raise RuntimeError("generation failed")
+        return text
+
+    scheduler = InferenceScheduler(generate)
+    scheduler.submit(1, 'bad')
+    scheduler.submit(1, 'good', on_done=lambda response: done.set())
+
+    wait_all([done])
+
+
+def test_users_are_served_round_robin():
+    started = threading.Event()
+    release = threading.Event()
+    order = []
+    finished = threading.Event()
+
+    def generate(text):
+        started.set()
+        release.wait(5)
+        order.append(text)
+        if len(order) == 4:
+            finished.set()
+        return text
+
+    scheduler = InferenceScheduler(generate, max_per_user=3)
+    assert scheduler.submit(1, 'blocker') == 0
+    wait_all([started])
+    scheduler.submit(1, 'a1')
+    scheduler.submit(1, 'a2')
+    assert scheduler.submit(2, 'b1') == 2
+    release.set()
+
+    wait_all([finished])
+    assert order == ['blocker', 'a1', 'b1', 'a2']
+
+
+def test_queue_limits_reject_requests():
+    started = threading.Event()
+    release = threading.Event()
+
+    def generate(text):
+        started.set()
+        release.wait(5)
+
+    scheduler = InferenceScheduler(generate, max_queue=2, max_per_user=1)
+    scheduler.submit(1, 'running')
+    wait_all([started])
+    scheduler.submit(2, 'queued')
+    with pytest.raises(QueueFullError):
+        scheduler.submit(2, 'second from same user')
+    scheduler.submit(3, 'queued')
+    with pytest.raises(QueueFullError):
+        scheduler.submit(4, 'over the limit')
+    release.set()
+
+
+def test_idle_callback_runs_after_queue_drains():
+    release = threading.Event()
+    idle = threading.Event()
+    scheduler = InferenceScheduler(lambda text: release.wait(5))
+    scheduler.submit(1, 'running')
+    scheduler.run_when_idle(idle.set)
+    assert not idle.wait(0.2)
+    release.set()
+    wait_all([idle])
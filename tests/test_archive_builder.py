@@ -0,0 +1,110 @@
+import os
+import zipfile
+
+import pytest
+
+from archive_builder import ArchiveManager
+from file_handler import FileHandler
+
+
+@pytest.fixture
+def handler(tmp_path, monkeypatch):
+    """Создает каталог в пустой рабочей директории"""
+    monkeypatch.chdir(tmp_path)
+    return FileHandler()
+
+
+def archive_names(volumes):
+    names = []
+    for volume in volumes:
+        with zipfile.ZipFile(volume) as archive:
+            names.extend(archive.namelist())
+    return sorted(names)
+
+
+def test_archive_is_reused_until_catalog_changes(handler):
+    handler.save_stream('a.txt', [b'a' * 100], 'Java')
+    manager = ArchiveManager(handler)
+
+    with manager.open_archive() as (volumes, signature):
+        first_volumes = list(volumes)
+        built_at = os.stat(volumes[0]).st_mtime_ns
+    with manager.open_archive() as (volumes, same_signature):
+        assert volumes == first_volumes
+        assert same_signature == signature
+        assert os.stat(volumes[0]).st_mtime_ns == built_at
+
+    handler.save_stream('b.txt', [b'b' * 100], 'AI')
+    with manager.open_archive() as (volumes, new_signature):
+        assert new_signature != signature
+        assert archive_names(volumes) == ['AI/b.txt', 'Java/a.txt']
+
+
+def test_archive_is_split_into_volumes(handler):
+    for name in ('a.txt', 'b.txt', 'c.txt'):
+        handler.save_stream(name, [os.urandom(3000)], 'Java')
+    manager = ArchiveManager(handler, volume_size=5000)
+
+    with manager.open_archive() as (volumes, _):
+        assert len(volumes) == 3
+        assert all(volume.endswith(f'.part{i}.zip') for i, volume in enumerate(volumes, 1))
+        assert all(os.path.getsize(volume) <= 5000 for volume in volumes)
+        assert archive_names(volumes) == ['Java/a.txt', 'Java/b.txt', 'Java/c.txt']
+
+
+def test_added_files_are_appended_without_rewriting_full_volumes(handler):
+    handler.save_stream('a.txt', [os.urandom(3000)], 'Java')
+    handler.save_stream('b.txt', [os.urandom(3000)], 'Java')
+    manager = ArchiveManager(handler, volume_size=5000)
+    with manager.open_archive() as (volumes, _):
+        first_volume_mtime = os.stat(volumes[0]).st_mtime_ns
+
+    handler.save_stream('c.txt', [b'small'], 'Java')
+    with manager.open_archive() as (volumes, _):
+        assert len(volumes) == 2
+        assert os.stat(volumes[0]).st_mtime_ns == first_volume_mtime
+        assert archive_names(volumes) == ['Java/a.txt', 'Java/b.txt', 'Java/c.txt']
+
+
+def test_changed_file_rebuilds_archive(handler):
+    handler.save_stream('a.txt', [b'old'], 'Java')
+    manager = ArchiveManager(handler)
+    with manager.open_archive():
+        pass
+
+    handler.save_stream('a.txt', [b'new content'], 'Java')
+    with manager.open_archive() as (volumes, _):
+        with zipfile.ZipFile(volumes[0]) as archive:
+            assert archive.read('Java/a.txt') == b'new content'
+
+
+def test_scoped_archive_contains_only_its_files(handler):
+    handler.save_stream('compose.yml', [b'services: {}'], 'DevOps', 'Docker')
+    handler.save_stream('pod.yml', [b'kind: Pod'], 'DevOps', 'Kubernetes')
+    handler.save_stream('spring.txt', [b'spring'], 'Java')
+    manager = ArchiveManager(handler)
+
+    assert manager.scope_name('DevOps', 'Docker') == 'programming-documentation-DevOps-Docker'
+    with manager.open_archive('DevOps', 'Docker') as (volumes, _):
+        assert archive_names(volumes) == ['DevOps/Docker/compose.yml']
+    with manager.open_archive('DevOps') as (volumes, _):
+        assert archive_names(volumes) == ['DevOps/Docker/compose.yml', 'DevOps/Kubernetes/pod.yml']
+
+
+def test_empty_catalog_gives_one_empty_volume(handler):
+    manager = ArchiveManager(handler)
+
+    with manager.open_archive() as (volumes, _):
+        assert len(volumes) == 1
+        assert archive_names(volumes) == []
+
+
+def test_compressed_formats_are_stored(handler):
+    handler.save_stream('book.pdf', [b'%PDF' * 100], 'Книги')
+    handler.save_stream('notes.txt', [b'text' * 100], 'Книги')
+    manager = ArchiveManager(handler)
+
+    with manager.open_archive() as (volumes, _):
+        with zipfile.ZipFile(volumes[0]) as archive:
+            assert archive.getinfo('Книги/book.pdf').compress_type == zipfile.ZIP_STORED
+            assert archive.getinfo('Книги/notes.txt').compress_type == zipfile.ZIP_DEFLATED
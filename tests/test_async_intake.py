@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from telebot import types
+
+pytest.importorskip('aiohttp')
+
+from async_intake import AsyncIntake, update_chat_id
+
+
+def message_update(update_id, chat_id):
+    return types.Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Test'},
+            'text': 'hi',
+        },
+    })
+
+
+def callback_update(update_id, user_id):
+    return types.Update.de_json({
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': '1',
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test'},
+            'data': 'browse:c',
+        },
+    })
+
+
+def run_updates(intake, updates):
+    """Планирует обновления так же, как цикл получения, и ждет их обработки"""
+    async def schedule_all():
+        intake._in_flight = asyncio.Semaphore(intake.max_in_flight)
+        for update in updates:
+            await intake._in_flight.acquire()
+            intake._schedule(update)
+        await asyncio.gather(*intake._chat_tails.values())
+
+    try:
+        asyncio.run(schedule_all())
+    finally:
+        for pool in intake.pools.values():
+            pool.shutdown()
+
+
+def test_update_chat_id():
+    assert update_chat_id(message_update(1, 42)) == 42
+    assert update_chat_id(callback_update(2, 7)) == 7
+
+
+def test_updates_of_one_chat_run_in_order():
+    processed = []
+
+    def process_update(update):
+        # Первое обновление чата обрабатывается дольше остальных
+        if update.update_id == 1:
+            time.sleep(0.2)
+        processed.append(update.update_id)
+
+    intake = AsyncIntake('123456:TEST', process_update, pool_sizes={'io': 4})
+    run_updates(intake, [message_update(i, 10) for i in range(1, 5)])
+
+    assert processed == [1, 2, 3, 4]
+    assert intake._chat_tails == {}
+
+
+def test_different_chats_run_in_parallel():
+    barrier = threading.Barrier(2, timeout=5)
+
+    def process_update(update):
+        # Оба обновления должны выполняться одновременно
+        barrier.wait()
+
+    intake = AsyncIntake('123456:TEST', process_update, pool_sizes={'io': 2})
+    run_updates(intake, [message_update(1, 10), message_update(2, 20)])
+
+
+def test_updates_are_routed_to_pools_and_errors_are_contained():
+    threads = {}
+
+    def process_update(update):
+        threads[update.update_id] = threading.current_thread().name
+        if update.update_id == 1:
+            raise RuntimeError('handler failed')
+
+    intake = AsyncIntake(
+        '123456:TEST', process_update,
+        route=lambda update: 'archive' if update.update_id == 2 else 'io',
+        pool_sizes={'io': 1, 'archive': 1}
+    )
+    run_updates(intake, [message_update(1, 10), message_update(2, 10), message_update(3, 20)])
+
+    assert threads[1].startswith('bot-io')
+    assert threads[2].startswith('bot-archive')
+    assert threads[3].startswith('bot-io')
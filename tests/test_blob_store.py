@@ -0,0 +1,84 @@
+import hashlib
+import os
+
+import pytest
+
+from blob_store import BlobStore
+from file_handler import FileHandler
+
+
+@pytest.fixture
+def cas_handler(tmp_path, monkeypatch):
+    """Создает каталог в режиме "cas" в пустой рабочей директории"""
+    monkeypatch.chdir(tmp_path)
+    return FileHandler(storage_mode="cas")
+
+
+def write_tmp(store, data):
+    path = os.path.join(store.tmp_dir, 'upload.part')
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def test_put_stores_content_once(tmp_path):
+    store = BlobStore(str(tmp_path / 'blobs'))
+    sha256 = hashlib.sha256(b'data').hexdigest()
+
+    assert store.put(write_tmp(store, b'data'), sha256) is True
+    assert store.put(write_tmp(store, b'data'), sha256) is False
+
+    assert store.has(sha256)
+    assert store.blob_path(sha256).endswith(os.path.join(sha256[:2], sha256[2:4], sha256))
+    assert os.listdir(store.tmp_dir) == []
+
+
+def test_manifest_is_shared_between_instances(tmp_path):
+    root = str(tmp_path / 'blobs')
+    first = BlobStore(root)
+    second = BlobStore(root)
+    sha256 = hashlib.sha256(b'data').hexdigest()
+    first.put(write_tmp(first, b'data'), sha256)
+
+    first.add_ref('Java/a.txt', sha256, 4, 1.0, 'UNIQUE')
+
+    assert second.sha_for_unique_id('UNIQUE') == sha256
+    assert second.sha_for_path('Java/a.txt', 4, 1.0) == sha256
+    assert second.sha_for_path('Java/a.txt', 5, 1.0) is None
+    assert second.find_refs(sha256) == ['Java/a.txt']
+
+
+def test_identical_uploads_share_one_blob(cas_handler):
+    first_path, sha256 = cas_handler.save_stream('a.txt', [b'same'], 'Java', file_unique_id='U1')
+    second_path, second_sha = cas_handler.save_stream('b.txt', [b'same'], 'AI')
+
+    assert sha256 == second_sha
+    assert os.path.samefile(first_path, second_path)
+    assert os.path.samefile(first_path, cas_handler.blob_store.blob_path(sha256))
+    assert cas_handler.find_stored_content('U1') == sha256
+    assert sorted(cas_handler.find_copies(sha256)) == [os.path.join('AI', 'b.txt'), os.path.join('Java', 'a.txt')]
+    assert cas_handler.get_file_entry('b.txt', 'AI')['sha256'] == sha256
+
+
+def test_save_stored_content_links_without_upload(cas_handler):
+    _, sha256 = cas_handler.save_stream('a.txt', [b'content'], 'Java', file_unique_id='U1')
+
+    cas_handler.save_stored_content('copy.txt', sha256, 'DevOps', 'Docker')
+
+    with cas_handler.open_file('copy.txt') as f:
+        assert f.read() == b'content'
+
+
+def test_blob_is_removed_with_last_reference(cas_handler):
+    first_path, sha256 = cas_handler.save_stream('a.txt', [b'content'], 'Java', file_unique_id='U1')
+    second_path, _ = cas_handler.save_stream('b.txt', [b'content'], 'AI')
+    blob_path = cas_handler.blob_store.blob_path(sha256)
+
+    os.remove(first_path)
+    assert cas_handler.resolve('a.txt') == []
+    assert os.path.exists(blob_path)
+
+    os.remove(second_path)
+    assert cas_handler.resolve('b.txt') == []
+    assert not os.path.exists(blob_path)
+    assert cas_handler.find_stored_content('U1') is None
@@ -0,0 +1,150 @@
+import importlib
+import os
+import sys
+import threading
+import zipfile
+
+import pytest
+from telebot import types
+
+# Модуль бота при импорте загружает библиотеки модели
+pytest.importorskip('torch')
+pytest.importorskip('transformers')
+pytest.importorskip('tqdm')
+
+
+@pytest.fixture(scope='module')
+def bot_module(tmp_path_factory):
+    """Импортирует модуль бота в пустой рабочей директории"""
+    workdir = tmp_path_factory.mktemp('bot')
+    docker_dir = workdir / 'uploads' / 'DevOps' / 'Docker'
+    docker_dir.mkdir(parents=True)
+    (docker_dir / 'compose.txt').write_text('services: {}')
+    java_dir = workdir / 'uploads' / 'Java'
+    java_dir.mkdir(parents=True)
+    (java_dir / 'spring.txt').write_text('spring')
+
+    saved_env = dict(os.environ)
+    saved_cwd = os.getcwd()
+    os.environ.update({
+        'TOKEN': '123456:TEST',
+        # Обработчики выполняются сразу в вызывающем потоке
+        'BOT_MODE': 'webhook',
+        'STATE_STORE': 'memory',
+        # Фоновая запись статистики продолжается и после возврата в прежнюю директорию
+        'STATS_DIR': str(workdir / 'stats'),
+    })
+    os.chdir(workdir)
+    try:
+        sys.modules.pop('bot_with_files', None)
+        yield importlib.import_module('bot_with_files')
+    finally:
+        sys.modules.pop('bot_with_files', None)
+        os.chdir(saved_cwd)
+        os.environ.clear()
+        os.environ.update(saved_env)
+
+
+def command_update(text, update_id=1):
+    """Собирает обновление с командой от пользователя"""
+    command_length = len(text.split()[0])
+    return types.Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': 42, 'type': 'private'},
+            'from': {'id': 7, 'is_bot': False, 'first_name': 'Test'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': command_length}],
+        },
+    })
+
+
+def test_archive_command_sends_scoped_archive(bot_module, monkeypatch):
+    sent = []
+    replies = []
+    monkeypatch.setattr(
+        bot_module, 'send_cached_document',
+        lambda chat_id, path, visible_name, *args, **kwargs: sent.append((path, visible_name))
+    )
+    monkeypatch.setattr(bot_module.bot, 'reply_to', lambda message, text, **kwargs: replies.append(text))
+
+    bot_module.bot.process_new_updates([command_update('/archive DevOps/Docker')])
+
+    assert replies == []
+    assert len(sent) == 1
+    volume_path, visible_name = sent[0]
+    assert visible_name == 'programming-documentation-DevOps-Docker.zip'
+    with zipfile.ZipFile(volume_path) as archive:
+        assert archive.namelist() == ['DevOps/Docker/compose.txt']
+
+
+def test_archive_command_rejects_unknown_category(bot_module, monkeypatch):
+    sent = []
+    replies = []
+    monkeypatch.setattr(bot_module, 'send_cached_document', lambda *args, **kwargs: sent.append(args))
+    monkeypatch.setattr(bot_module.bot, 'reply_to', lambda message, text, **kwargs: replies.append(text))
+
+    bot_module.bot.process_new_updates([command_update('/archive Missing/Sub', update_id=2)])
+
+    assert sent == []
+    assert len(replies) == 1
+    assert replies[0].startswith('❌ Категория не найдена')
+
+
+def test_browser_file_button_resolves_without_lookup_table(bot_module):
+    callback_data = bot_module.browser_file_data('DevOps', 'Docker', 'compose.txt')
+
+    assert len(callback_data.encode('utf-8')) <= 64
+    assert not hasattr(bot_module, 'browser_entries')
+    entry = bot_module.find_browser_entry(*callback_data.split(':')[2:])
+    assert entry['name'] == 'compose.txt'
+    assert entry['subcategory'] == 'Docker'
+
+    java_data = bot_module.browser_file_data('Java', None, 'spring.txt')
+    assert bot_module.find_browser_entry(*java_data.split(':')[2:])['name'] == 'spring.txt'
+
+
+def test_browser_file_button_rejects_stale_data(bot_module):
+    entry_id = bot_module.browser_entry_id('Java', None, 'missing.txt')
+
+    assert bot_module.find_browser_entry('0', '', entry_id) is None
+    assert bot_module.find_browser_entry('99', '', entry_id) is None
+
+
+def document_update(update_id, file_name, media_group_id=None):
+    """Собирает обновление с документом, возможно из альбома"""
+    message = {
+        'message_id': update_id,
+        'date': 0,
+        'chat': {'id': 43, 'type': 'private'},
+        'from': {'id': 8, 'is_bot': False, 'first_name': 'Test'},
+        'document': {'file_id': f'FILE_{update_id}', 'file_unique_id': f'U_{update_id}', 'file_name': file_name},
+    }
+    if media_group_id:
+        message['media_group_id'] = media_group_id
+    return types.Update.de_json({'update_id': update_id, 'message': message})
+
+
+def test_album_documents_are_collected_into_one_upload(bot_module, monkeypatch):
+    prompts = []
+    asked = threading.Event()
+
+    def send_message(chat_id, text, **kwargs):
+        prompts.append(text)
+        asked.set()
+
+    monkeypatch.setattr(bot_module, 'MEDIA_GROUP_WINDOW', 0.2)
+    monkeypatch.setattr(bot_module.bot, 'send_message', send_message)
+
+    bot_module.bot.process_new_updates([
+        document_update(10 + i, f'part{i}.pdf', media_group_id='album-1') for i in range(3)
+    ])
+
+    assert asked.wait(5)
+    assert prompts == ['📂 Выберите категорию для 3 файлов:']
+    state = bot_module.state_store.get(43)
+    assert state['step'] == 'upload_category'
+    assert [upload['file_name'] for upload in state['uploads']] == ['part0.pdf', 'part1.pdf', 'part2.pdf']
+    assert bot_module.media_group_timers == {}
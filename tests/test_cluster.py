@@ -0,0 +1,126 @@
+import multiprocessing
+import signal
+import time
+
+import pytest
+from telebot import types
+
+import cluster as cluster_module
+from cluster import IntakeLease, stop_workers, worker_loop
+
+
+@pytest.fixture
+def lease_path(tmp_path):
+    return str(tmp_path / 'lease.db')
+
+
+def make_lease(path, owner, ttl=10):
+    lease = IntakeLease(path, ttl=ttl)
+    lease.owner = owner
+    return lease
+
+
+def message_update(update_id, chat_id):
+    return types.Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Test'},
+            'text': 'hi',
+        },
+    })
+
+
+def test_only_one_instance_holds_lease(lease_path):
+    first = make_lease(lease_path, 'host:1')
+    second = make_lease(lease_path, 'host:2')
+
+    assert first.acquire()
+    assert not second.acquire()
+    # Лидер продлевает свою аренду
+    assert first.acquire()
+
+
+def test_expired_lease_is_taken_over(lease_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cluster_module.time, 'time', lambda: now[0])
+    first = make_lease(lease_path, 'host:1')
+    second = make_lease(lease_path, 'host:2')
+    assert first.acquire()
+
+    now[0] += 11
+    assert second.acquire()
+    assert not first.acquire()
+
+
+def test_released_lease_is_taken_immediately(lease_path):
+    first = make_lease(lease_path, 'host:1')
+    second = make_lease(lease_path, 'host:2')
+    assert first.acquire()
+
+    first.release()
+
+    assert second.acquire()
+
+
+def test_offset_is_saved_only_by_leader(lease_path):
+    first = make_lease(lease_path, 'host:1')
+    second = make_lease(lease_path, 'host:2')
+    assert first.acquire()
+
+    first.save_offset(101)
+    second.save_offset(500)
+
+    assert second.load_offset() == 101
+
+
+class ClosingQueue:
+    """Очередь, которая после заданных обновлений ведет себя как закрытая"""
+
+    def __init__(self, updates):
+        self.updates = list(updates)
+
+    def get(self):
+        if not self.updates:
+            raise EOFError
+        return self.updates.pop(0)
+
+
+def test_worker_loop_survives_handler_errors():
+    processed = []
+
+    def process_update(update):
+        if update.update_id == 1:
+            raise RuntimeError('handler failed')
+        processed.append(update.update_id)
+
+    worker_loop(ClosingQueue([message_update(1, 10), message_update(2, 10)]), process_update)
+
+    assert processed == [2]
+
+
+def sleep_with_sigterm_handler(handler):
+    # Дочерний процесс наследует обработчики сигналов, установленные модулем бота в других тестах
+    signal.signal(signal.SIGTERM, handler)
+    time.sleep(60)
+
+
+def test_stop_workers_kills_processes_ignoring_sigterm():
+    context = multiprocessing.get_context('fork')
+    stubborn = context.Process(target=sleep_with_sigterm_handler, args=(signal.SIG_IGN,))
+    obedient = context.Process(target=sleep_with_sigterm_handler, args=(signal.SIG_DFL,))
+    stubborn.start()
+    obedient.start()
+    # Даем процессу установить обработчик сигнала
+    time.sleep(0.5)
+
+    started = time.time()
+    stop_workers([stubborn, None, obedient], timeout=1)
+
+    assert not stubborn.is_alive()
+    assert not obedient.is_alive()
+    assert stubborn.exitcode == -signal.SIGKILL
+    assert obedient.exitcode == -signal.SIGTERM
+    assert time.time() - started < 10
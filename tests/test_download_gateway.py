@@ -0,0 +1,124 @@
+import http.client
+import time
+from urllib.parse import urlsplit
+
+import pytest
+
+from download_gateway import DownloadGateway, parse_range, sign_path
+from file_handler import FileHandler
+
+SECRET = 'gateway-secret'
+CONTENT = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def gateway(tmp_path, monkeypatch):
+    """Запускает шлюз над каталогом с одним файлом"""
+    monkeypatch.chdir(tmp_path)
+    handler = FileHandler()
+    handler.save_stream('Руководство.pdf', [CONTENT], 'DevOps', 'Docker')
+    gateway = DownloadGateway(handler, SECRET, 'http://files.example/', host='127.0.0.1', port=0)
+    gateway.start()
+    yield gateway
+    gateway.shutdown()
+
+
+def link_target(gateway):
+    """Возвращает путь с параметрами из подписанной ссылки"""
+    entry = gateway.file_handler.resolve('Руководство.pdf')[0]
+    parts = urlsplit(gateway.make_link(entry))
+    return f"{parts.path}?{parts.query}"
+
+
+def request(gateway, target, method='GET', headers=None):
+    conn = http.client.HTTPConnection('127.0.0.1', gateway.port, timeout=5)
+    try:
+        conn.request(method, target, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        conn.close()
+
+
+def test_parse_range():
+    assert parse_range('bytes=0-99', 1000) == (0, 99)
+    assert parse_range('bytes=900-', 1000) == (900, 999)
+    assert parse_range('bytes=-100', 1000) == (900, 999)
+    assert parse_range('bytes=990-2000', 1000) == (990, 999)
+    assert parse_range('bytes=-5000', 1000) == (0, 999)
+    assert parse_range('bytes=1000-', 1000) is None
+    assert parse_range('bytes=5-1', 1000) is None
+    assert parse_range('bytes=-0', 1000) is None
+    assert parse_range('bytes=-', 1000) is None
+    assert parse_range('bytes=0-1,5-6', 1000) is None
+
+
+def test_signature_covers_path_and_expiry():
+    signature = sign_path(SECRET, 'Java/a.txt', 100)
+
+    assert signature == sign_path(SECRET, 'Java/a.txt', 100)
+    assert signature != sign_path(SECRET, 'Java/b.txt', 100)
+    assert signature != sign_path(SECRET, 'Java/a.txt', 101)
+    assert signature != sign_path('other', 'Java/a.txt', 100)
+
+
+def test_full_download(gateway):
+    status, headers, body = request(gateway, link_target(gateway))
+
+    assert status == 200
+    assert body == CONTENT
+    assert headers['Content-Length'] == str(len(CONTENT))
+    assert headers['Accept-Ranges'] == 'bytes'
+    assert headers['Content-Type'] == 'application/pdf'
+    assert "filename*=UTF-8''%D0%A0" in headers['Content-Disposition']
+
+
+def test_range_download(gateway):
+    target = link_target(gateway)
+    _, headers, _ = request(gateway, target, method='HEAD')
+
+    status, range_headers, body = request(
+        gateway, target, headers={'Range': 'bytes=10-19', 'If-Range': headers['ETag']}
+    )
+
+    assert status == 206
+    assert body == CONTENT[10:20]
+    assert range_headers['Content-Range'] == f"bytes 10-19/{len(CONTENT)}"
+
+
+def test_range_with_stale_etag_returns_whole_file(gateway):
+    status, _, body = request(
+        gateway, link_target(gateway), headers={'Range': 'bytes=10-19', 'If-Range': '"stale"'}
+    )
+
+    assert status == 200
+    assert body == CONTENT
+
+
+def test_unsatisfiable_range(gateway):
+    status, headers, _ = request(gateway, link_target(gateway), headers={'Range': f'bytes={len(CONTENT)}-'})
+
+    assert status == 416
+    assert headers['Content-Range'] == f"bytes */{len(CONTENT)}"
+
+
+def test_matching_etag_returns_not_modified(gateway):
+    target = link_target(gateway)
+    _, headers, _ = request(gateway, target, method='HEAD')
+
+    status, _, body = request(gateway, target, headers={'If-None-Match': headers['ETag']})
+
+    assert status == 304
+    assert body == b''
+
+
+def test_invalid_links_are_forbidden(gateway):
+    target = link_target(gateway)
+    path, query = target.split('?')
+    expires = int(time.time()) - 10
+    expired = f"{path}?expires={expires}&sig={sign_path(SECRET, 'DevOps/Docker/Руководство.pdf', expires)}"
+
+    assert request(gateway, expired)[0] == 403
+    assert request(gateway, target[:-1] + ('0' if target[-1] != '0' else '1'))[0] == 403
+    assert request(gateway, path)[0] == 403
+    assert request(gateway, f"/files/..%2F..%2Fetc%2Fpasswd?{query}")[0] == 403
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+from file_handler import FileHandler
+
+
+@pytest.fixture
+def handler(tmp_path, monkeypatch):
+    """Создает каталог в пустой рабочей директории"""
+    monkeypatch.chdir(tmp_path)
+    return FileHandler()
+
+
+def test_save_stream_indexes_file_and_returns_hash(handler):
+    save_path, sha256 = handler.save_stream('notes.txt', [b'hello ', b'world'], 'Java')
+
+    assert save_path == os.path.join('uploads', 'Java', 'notes.txt')
+    assert sha256 == 'b94d27b9934d3e08a52e52d7da7dabfac484efe37a5380ee9088f7ace2efcde9'
+    with open(save_path, 'rb') as f:
+        assert f.read() == b'hello world'
+    files = handler.get_files_list('Java')
+    assert [file['name'] for file in files] == ['notes.txt']
+    assert files[0]['size'] == '11.00 B'
+
+
+def test_save_stream_leaves_no_partial_file_on_error(handler):
+    def chunks():
+        yield b'partial'
+        raise IOError('connection lost')
+
+    with pytest.raises(IOError):
+        handler.save_stream('broken.txt', chunks(), 'Java')
+
+    assert os.listdir(os.path.join('uploads', 'Java')) == []
+    assert handler.get_files_list('Java') == []
+
+
+def test_save_stream_without_overwrite_keeps_existing_file(handler):
+    handler.save_stream('book.pdf', [b'first'], 'Книги')
+
+    with pytest.raises(FileExistsError):
+        handler.save_stream('book.pdf', [b'second'], 'Книги', overwrite=False)
+
+    with open(os.path.join('uploads', 'Книги', 'book.pdf'), 'rb') as f:
+        assert f.read() == b'first'
+    assert len(os.listdir(os.path.join('uploads', 'Книги'))) == 1
+
+
+def test_unknown_subcategory_saves_into_category(handler):
+    handler.save_stream('guide.txt', [b'x'], 'Java', 'Missing')
+
+    entry = handler.get_file_entry('guide.txt', 'Java')
+    assert entry['subcategory'] is None
+    assert entry['path'] == os.path.join('Java', 'guide.txt')
+
+
+def test_resolve_returns_every_location_in_catalog_order(handler):
+    handler.save_stream('readme.md', [b'docker'], 'DevOps', 'Docker')
+    handler.save_stream('readme.md', [b'java'], 'Java')
+
+    entries = handler.resolve('readme.md')
+
+    assert [(entry['category'], entry['subcategory']) for entry in entries] == [
+        ('Java', None), ('DevOps', 'Docker')
+    ]
+    assert handler.resolve_path('DevOps/Docker/readme.md')['size'] == 6
+    assert handler.resolve_path('DevOps/Missing/readme.md') is None
+    with handler.open_file('readme.md') as f:
+        assert f.read() == b'java'
+
+
+def test_index_picks_up_changes_made_outside_the_bot(handler):
+    events = []
+    handler.add_listener(lambda event, entry: events.append((event, entry['name'])))
+    path = os.path.join('uploads', 'AI', 'manual.txt')
+    with open(path, 'wb') as f:
+        f.write(b'added by hand')
+
+    assert [entry['name'] for entry in handler.resolve('manual.txt')] == ['manual.txt']
+    assert ('added', 'manual.txt') in events
+
+    os.remove(path)
+    assert handler.resolve('manual.txt') == []
+    assert handler.get_file_entry('manual.txt', 'AI') is None
+    assert ('removed', 'manual.txt') in events
+
+
+def test_temp_files_are_not_listed(handler):
+    with open(os.path.join('uploads', 'Other', '.upload.part'), 'wb') as f:
+        f.write(b'in progress')
+
+    assert handler.get_files_list('Other') == []
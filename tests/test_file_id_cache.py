@@ -0,0 +1,47 @@
+import json
+
+from file_id_cache import FileIdCache
+
+
+def test_get_returns_file_id_only_for_unchanged_file(tmp_path):
+    cache = FileIdCache(str(tmp_path / 'cache.json'))
+    cache.put('Java/a.txt', 10, 1.5, 'FILE_ID')
+
+    assert cache.get('Java/a.txt', 10, 1.5) == 'FILE_ID'
+    assert cache.get('Java/a.txt', 11, 1.5) is None
+    assert cache.get('Java/a.txt', 10, 2.0) is None
+    assert cache.get('Java/b.txt', 10, 1.5) is None
+
+
+def test_invalidate_removes_entry_from_file(tmp_path):
+    cache_file = tmp_path / 'cache.json'
+    cache = FileIdCache(str(cache_file))
+    cache.put('a', 1, 1.0, 'ID_A')
+    cache.put('b', 1, 1.0, 'ID_B')
+
+    cache.invalidate('a')
+
+    assert cache.get('a', 1, 1.0) is None
+    assert set(json.loads(cache_file.read_text(encoding='utf-8'))) == {'b'}
+
+
+def test_instances_see_each_others_changes(tmp_path):
+    cache_file = str(tmp_path / 'cache.json')
+    first = FileIdCache(cache_file)
+    second = FileIdCache(cache_file)
+
+    first.put('a', 1, 1.0, 'ID_A')
+    second.put('b', 2, 2.0, 'ID_B')
+
+    assert first.get('b', 2, 2.0) == 'ID_B'
+    assert second.get('a', 1, 1.0) == 'ID_A'
+
+
+def test_corrupted_cache_file_is_ignored(tmp_path):
+    cache_file = tmp_path / 'cache.json'
+    cache_file.write_text('{not json', encoding='utf-8')
+
+    cache = FileIdCache(str(cache_file))
+    assert cache.get('a', 1, 1.0) is None
+    cache.put('a', 1, 1.0, 'ID_A')
+    assert FileIdCache(str(cache_file)).get('a', 1, 1.0) == 'ID_A'
@@ -0,0 +1,47 @@
+from fuzzy_search import TrigramIndex, normalize_name
+
+
+def build_index(names):
+    index = TrigramIndex()
+    for path in names:
+        index.add(path, path.rsplit('/', 1)[-1])
+    return index
+
+
+def test_normalize_name_keeps_dots_in_queries():
+    assert normalize_name('node.js') == 'node js'
+    assert normalize_name('Docker.docx', strip_extension=True) == 'doker'
+
+
+def test_transliterated_query_matches_latin_name():
+    index = build_index(['DevOps/Docker/Docker compose.docx', 'Java/Spring.docx'])
+    results = index.search('докер')
+    assert results and results[0][0] == 'DevOps/Docker/Docker compose.docx'
+
+
+def test_typo_matches_similar_name():
+    index = build_index(['DevOps/kubernetes/minikube.docx', 'Java/Spring.docx'])
+    assert index.search('minikub')[0][0] == 'DevOps/kubernetes/minikube.docx'
+
+
+def test_exact_match_found_among_many_common_names():
+    names = [f'DevOps/Other/docker note {i}.docx' for i in range(1500)]
+    names.append('DevOps/Docker.docx')
+    index = build_index(names)
+
+    results = index.search('docker', limit=None)
+
+    assert len(results) == len(names)
+    assert results[0][0] == 'DevOps/Docker.docx'
+    assert index.search('docker', limit=1)[0][0] == 'DevOps/Docker.docx'
+
+
+def test_name_containing_short_query_is_found():
+    index = build_index(['AI/maintain.docx', 'Java/Spring.docx'])
+    assert [path for path, _ in index.search('ai', limit=None)] == ['AI/maintain.docx']
+
+
+def test_removed_name_is_not_found():
+    index = build_index(['Java/Spring.docx'])
+    index.remove('Java/Spring.docx')
+    assert index.search('spring') == []
@@ -0,0 +1,134 @@
+import io
+import threading
+from collections import deque
+
+import pytest
+
+import outbound
+from outbound import BULK, MESSAGE_LIMIT, MultipartStream, OutboundDispatcher, TokenBucket
+
+API_URL = 'https://api.telegram.org/botTOKEN/'
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self._payload = payload or {}
+
+    def json(self):
+        return self._payload
+
+
+class FakeSession:
+    """Отдает заранее заданные ответы и запоминает запросы"""
+
+    def __init__(self, responses):
+        self.responses = deque(responses)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        return self.responses.popleft()
+
+
+@pytest.fixture
+def dispatcher():
+    return OutboundDispatcher(lambda chat_id, text, parse_mode: None)
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2, capacity=2)
+    now = bucket.updated
+    bucket.take(now)
+    bucket.take(now)
+
+    assert bucket.wait_time(now) == pytest.approx(0.5)
+    assert bucket.wait_time(now + 0.5) == 0
+    assert not bucket.is_idle(now + 0.5)
+    assert bucket.is_idle(now + 1)
+
+    bucket.blocked_until = now + 10
+    assert bucket.wait_time(now + 1) == pytest.approx(9)
+
+
+def test_group_chats_get_stricter_limit(dispatcher):
+    assert dispatcher._chat_bucket(42).rate == dispatcher.chat_rate
+    assert dispatcher._chat_bucket(-100123).rate == dispatcher.group_rate
+
+
+def test_take_message_coalesces_texts_with_same_markup(dispatcher):
+    chat_outbox = deque([('a', None), ('b', None), ('c', 'HTML'), ('d', 'HTML')])
+
+    assert dispatcher._take_message(chat_outbox) == ('a\nb', None)
+    assert dispatcher._take_message(chat_outbox) == ('c\nd', 'HTML')
+    assert not chat_outbox
+
+
+def test_take_message_splits_long_text_on_line_break(dispatcher):
+    line = 'x' * 1000
+    chat_outbox = deque([("\n".join([line] * 5), None)])
+
+    first, _ = dispatcher._take_message(chat_outbox)
+    second, _ = dispatcher._take_message(chat_outbox)
+
+    assert first == "\n".join([line] * 4)
+    assert second == line
+    assert len(first) <= MESSAGE_LIMIT
+
+
+def test_send_text_delivers_coalesced_messages_in_background():
+    sent = []
+    done = threading.Event()
+
+    def send(chat_id, text, parse_mode):
+        sent.append((chat_id, text))
+        if 'last' in text:
+            done.set()
+
+    dispatcher = OutboundDispatcher(send)
+    with dispatcher._outbox_cond:
+        # Очередь заполняется целиком до того, как фоновый поток ее разберет
+        for text in ('first', 'second', 'last'):
+            dispatcher.send_text(7, text)
+
+    assert done.wait(5)
+    assert sent == [(7, 'first\nsecond\nlast')]
+
+
+def test_request_sender_retries_after_429(dispatcher, monkeypatch):
+    session = FakeSession([
+        FakeResponse(429, {'parameters': {'retry_after': 0}}),
+        FakeResponse(200),
+    ])
+    monkeypatch.setattr(dispatcher, '_session', lambda: session)
+    paused = []
+    monkeypatch.setattr(dispatcher, '_pause', lambda chat_id, retry_after: paused.append((chat_id, retry_after)))
+
+    response = dispatcher.request_sender('post', API_URL + 'sendMessage', params={'chat_id': 5, 'text': 'hi'})
+
+    assert response.status_code == 200
+    assert len(session.requests) == 2
+    assert paused == [(5, 0)]
+
+
+def test_priority_is_scoped_to_block(dispatcher):
+    with dispatcher.priority(BULK):
+        assert dispatcher._local.priority == BULK
+    assert dispatcher._local.priority == outbound.INTERACTIVE
+
+
+def test_multipart_stream_reads_file_in_chunks(tmp_path):
+    path = tmp_path / 'doc.bin'
+    path.write_bytes(b'0123456789' * 10)
+
+    with open(path, 'rb') as f:
+        files = {'document': ('na"me.bin', f)}
+        assert MultipartStream.supports(files)
+        body = MultipartStream(files, chunk_size=16)
+        data = b''.join(body)
+
+    assert len(data) == len(body)
+    assert b'filename="na%22me.bin"' in data
+    assert b'0123456789' * 10 in data
+    assert body.content_type.startswith('multipart/form-data; boundary=')
+    assert not MultipartStream.supports({'document': io.BytesIO(b'data')})
@@ -0,0 +1,67 @@
+import os
+import threading
+
+import pytest
+
+import shared_files
+from shared_files import file_lock, file_version, write_atomic
+
+
+def test_write_atomic_replaces_file(tmp_path):
+    path = str(tmp_path / 'data.json')
+
+    write_atomic(path, '{"a": 1}')
+    write_atomic(path, '{"b": 2}')
+
+    with open(path, encoding='utf-8') as f:
+        assert f.read() == '{"b": 2}'
+    assert os.stat(path).st_mode & 0o777 == 0o644
+    assert os.listdir(tmp_path) == ['data.json']
+
+
+def test_write_atomic_keeps_old_file_on_error(tmp_path, monkeypatch):
+    path = str(tmp_path / 'data.json')
+    write_atomic(path, 'old')
+
+    def fail_replace(src, dst):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(shared_files.os, 'replace', fail_replace)
+    with pytest.raises(OSError):
+        write_atomic(path, 'new')
+
+    with open(path, encoding='utf-8') as f:
+        assert f.read() == 'old'
+    assert os.listdir(tmp_path) == ['data.json']
+
+
+def test_file_version_changes_with_content(tmp_path):
+    path = str(tmp_path / 'data.json')
+    assert file_version(path) is None
+
+    write_atomic(path, 'one')
+    first = file_version(path)
+    write_atomic(path, 'three')
+
+    assert file_version(path) != first
+
+
+def test_file_lock_excludes_other_threads(tmp_path):
+    path = str(tmp_path / 'data.json')
+    inside = threading.Event()
+    order = []
+
+    def other_writer():
+        inside.wait(5)
+        with file_lock(path):
+            order.append('other')
+
+    thread = threading.Thread(target=other_writer)
+    thread.start()
+    with file_lock(path):
+        inside.set()
+        thread.join(0.3)
+        order.append('first')
+    thread.join(5)
+
+    assert order == ['first', 'other']
@@ -0,0 +1,100 @@
+import io
+import sqlite3
+
+import pytest
+
+import state_store as state_store_module
+from state_store import MemoryBackend, RedisBackend, SQLiteBackend, StateStore, create_state_store
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return StateStore(MemoryBackend())
+    return StateStore(SQLiteBackend(str(tmp_path / 'state.db')))
+
+
+def test_update_merges_and_removes_fields(store):
+    store.update(1, step='category', category='Java')
+    store.update(1, step='upload', category=None)
+
+    assert store.get(1) == {'step': 'upload'}
+    assert store.get(2) == {}
+
+
+def test_clear_removes_fields_or_whole_state(store):
+    store.update(1, step='upload', category='Java', file_name='a.txt')
+
+    store.clear(1, 'file_name')
+    assert store.get(1) == {'step': 'upload', 'category': 'Java'}
+    store.clear(1)
+    assert store.get(1) == {}
+
+
+def test_state_expires(store, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(state_store_module.time, 'time', lambda: now[0])
+    store.ttl = 60
+    store.update(1, step='upload')
+
+    now[0] += 59
+    assert store.get(1) == {'step': 'upload'}
+    now[0] += 2
+    assert store.get(1) == {}
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_entries=2)
+    backend.set('a', '1', 60)
+    backend.set('b', '2', 60)
+    backend.get('a')
+
+    backend.set('c', '3', 60)
+
+    assert backend.get('a') == '1'
+    assert backend.get('b') is None
+    assert backend.get('c') == '3'
+
+
+def test_sqlite_backend_is_shared_and_cleaned_up(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(state_store_module.time, 'time', lambda: now[0])
+    path = str(tmp_path / 'state.db')
+    backend = SQLiteBackend(path, max_entries=2, cleanup_every=3)
+    other = SQLiteBackend(path)
+
+    for key in ('a', 'b', 'c'):
+        backend.set(key, key, 60)
+        now[0] += 1
+
+    assert other.get('c') == 'c'
+    with sqlite3.connect(path) as conn:
+        keys = [row[0] for row in conn.execute("SELECT key FROM state ORDER BY key")]
+    assert keys == ['b', 'c']
+
+
+def test_redis_reply_parsing():
+    backend = RedisBackend()
+    reader = io.BytesIO(b"+OK\r\n:3\r\n$5\r\nhello\r\n$-1\r\n*2\r\n$1\r\na\r\n:1\r\n")
+
+    assert backend._read_reply(reader) == 'OK'
+    assert backend._read_reply(reader) == 3
+    assert backend._read_reply(reader) == 'hello'
+    assert backend._read_reply(reader) is None
+    assert backend._read_reply(reader) == ['a', 1]
+    with pytest.raises(RuntimeError):
+        backend._read_reply(io.BytesIO(b"-ERR wrong\r\n"))
+
+
+def test_create_state_store_parses_urls(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    assert isinstance(create_state_store('memory').backend, MemoryBackend)
+    sqlite_store = create_state_store('sqlite:///state.db')
+    assert sqlite_store.backend.path == 'state.db'
+    redis_store = create_state_store('redis://:secret@cache:6380/2')
+    assert redis_store.backend.address == ('cache', 6380)
+    assert redis_store.backend.db == 2
+    assert redis_store.backend.password == 'secret'
+    with pytest.raises(ValueError):
+        create_state_store('mongodb://localhost')
@@ -0,0 +1,136 @@
+import json
+
+import pytest
+
+import stats_store as stats_store_module
+from stats_store import StatsStore
+
+
+@pytest.fixture
+def stats_file(tmp_path):
+    return str(tmp_path / 'download_stats.json')
+
+
+def test_counts_survive_restart(stats_file):
+    store = StatsStore(stats_file)
+    store.record('a.docx', 1)
+    store.record('a.docx', 2)
+    store.record('b.docx', 1)
+    store.flush()
+
+    reloaded = StatsStore(stats_file)
+    assert reloaded.top_files() == [('a.docx', 2, 2), ('b.docx', 1, 1)]
+    assert reloaded.user_downloads(1) == {'a.docx': 1, 'b.docx': 1}
+
+
+def test_compaction_keeps_counts_and_starts_new_log(stats_file):
+    store = StatsStore(stats_file)
+    store.record('a.docx', 1)
+    store.flush()
+    store.compact()
+    store.record('a.docx', 2)
+    store.flush()
+
+    with open(f"{stats_file}.log", encoding='utf-8') as f:
+        assert json.loads(f.readline()) == {'generation': 1}
+    assert StatsStore(stats_file).file_stats('a.docx') == (2, {'1': 1, '2': 1})
+
+
+def test_crash_between_snapshot_and_log_keeps_new_events(stats_file, monkeypatch):
+    store = StatsStore(stats_file)
+    store.record('a.docx', 1)
+    store.flush()
+
+    original_write = stats_store_module.write_atomic
+
+    def fail_on_log(path, data):
+        if path.endswith('.log'):
+            raise OSError("disk full")
+        original_write(path, data)
+
+    monkeypatch.setattr(stats_store_module, 'write_atomic', fail_on_log)
+    with pytest.raises(OSError):
+        store.compact()
+    monkeypatch.setattr(stats_store_module, 'write_atomic', original_write)
+
+    # Процесс перезапущен: снапшот нового поколения, журнал - старого
+    restarted = StatsStore(stats_file)
+    assert restarted.file_stats('a.docx')[0] == 1
+    restarted.record('a.docx', 2)
+    restarted.flush()
+
+    assert StatsStore(stats_file).file_stats('a.docx')[0] == 2
+
+
+def test_failed_log_restart_is_retried_on_next_flush(stats_file, monkeypatch):
+    store = StatsStore(stats_file)
+    store.record('a.docx', 1)
+    original_write = stats_store_module.write_atomic
+
+    def fail_on_log(path, data):
+        if path.endswith('.log'):
+            raise OSError("disk full")
+        original_write(path, data)
+
+    monkeypatch.setattr(stats_store_module, 'write_atomic', fail_on_log)
+    with pytest.raises(OSError):
+        store.compact()
+    monkeypatch.setattr(stats_store_module, 'write_atomic', original_write)
+
+    store.record('a.docx', 2)
+    store.flush()
+    assert StatsStore(stats_file).file_stats('a.docx')[0] == 2
+
+
+def test_shared_stores_see_each_other(stats_file):
+    first = StatsStore(stats_file, shared=True)
+    second = StatsStore(stats_file, shared=True)
+    # В одном процессе pid совпадает, различаем писателей вручную
+    second._writer = first._writer + 1
+
+    first.record('a.docx', 1)
+    first.flush()
+    second.record('a.docx', 2)
+    second.flush()
+    second.compact()
+    first.record('b.docx', 1)
+    first.flush()
+    with first._io_lock, first._file_lock():
+        first._catch_up()
+
+    assert first.file_stats('a.docx')[0] == 2
+    assert first.file_stats('b.docx')[0] == 1
+    assert StatsStore(stats_file).file_stats('a.docx')[0] == 2
+
+
+def test_period_stats_count_recent_downloads(stats_file):
+    store = StatsStore(stats_file)
+    store.record('a.docx', 1)
+    store.record('a.docx', 2)
+    store.record('b.docx', 1)
+
+    ranked, total, users = store.period_stats(days=1)
+    assert ranked == [('a.docx', 2), ('b.docx', 1)]
+    assert (total, users) == (3, 2)
+    assert store.period_stats(hours=1)[1] == 3
+
+
+def test_ranking_is_updated_incrementally(stats_file):
+    store = StatsStore(stats_file)
+    store.record('a.docx', 1)
+    store.record('b.docx', 1)
+    store.record('b.docx', 2)
+    version = store.version()
+
+    assert store.top_files() == [('b.docx', 2, 2), ('a.docx', 1, 1)]
+    assert store.rank_of('b.docx') == 0
+    store.record('a.docx', 2)
+    store.record('a.docx', 3)
+
+    assert store.version() > version
+    assert store.rank_of('a.docx') == 0
+    assert store.rank_of('b.docx') == 1
+    assert store.rank_of('c.docx') is None
+    assert store.top_files(limit=1, offset=1) == [('b.docx', 2, 2)]
+    assert store.file_count() == 2
+    assert store.user_downloads(2) == {'a.docx': 1, 'b.docx': 1}
@@ -0,0 +1,74 @@
+import io
+import time
+
+import docx
+import pytest
+
+from file_handler import FileHandler
+from text_extraction import STATUS_DONE, ExtractionPipeline
+
+
+def docx_bytes(*paragraphs):
+    document = docx.Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def file_handler(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return FileHandler()
+
+
+def extract_all(pipeline, entries, results):
+    for entry in entries:
+        pipeline.submit(entry)
+    deadline = time.monotonic() + 60
+    while pipeline.pending_count() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert pipeline.pending_count() == 0
+    return results
+
+
+def test_pipeline_extracts_docx_text_in_worker_processes(file_handler, tmp_path):
+    file_handler.save_file(None, 'guide.docx', docx_bytes('Docker compose guide'), 'DevOps', 'Docker')
+    file_handler.save_file(None, 'notes.txt', b'plain text', 'Other')
+    results = {}
+    pipeline = ExtractionPipeline(
+        file_handler, cache_dir=str(tmp_path / 'cache'), max_workers=2,
+        on_result=lambda entry, text: results.__setitem__(entry['path'], text)
+    )
+
+    extract_all(pipeline, file_handler.iter_entries(), results)
+
+    assert results == {'DevOps/Docker/guide.docx': 'Docker compose guide'}
+    assert pipeline.status('DevOps/Docker/guide.docx') == STATUS_DONE
+    assert pipeline.pending_count() == 0
+
+
+def test_pool_is_not_forked_from_the_bot_process(file_handler, tmp_path):
+    pipeline = ExtractionPipeline(file_handler, cache_dir=str(tmp_path / 'cache'), max_workers=1)
+    pool = pipeline._get_pool()
+    try:
+        assert pool._mp_context.get_start_method() in ('forkserver', 'spawn')
+    finally:
+        pool.shutdown()
+
+
+def test_identical_documents_reuse_cached_text(file_handler, tmp_path):
+    content = docx_bytes('Shared text')
+    file_handler.save_file(None, 'a.docx', content, 'Java')
+    file_handler.save_file(None, 'b.docx', content, 'Other')
+    results = {}
+    pipeline = ExtractionPipeline(
+        file_handler, cache_dir=str(tmp_path / 'cache'), max_workers=1,
+        on_result=lambda entry, text: results.__setitem__(entry['path'], text)
+    )
+
+    extract_all(pipeline, file_handler.iter_entries(), results)
+
+    assert results == {'Java/a.docx': 'Shared text', 'Other/b.docx': 'Shared text'}
+    assert len(list((tmp_path / 'cache').rglob('*.txt'))) == 1
@@ -0,0 +1,75 @@
+import sqlite3
+
+import pytest
+
+from text_search import SearchIndex, tokenize
+
+
+@pytest.fixture
+def index_file(tmp_path):
+    return str(tmp_path / 'search_index.db')
+
+
+def row_seqs(index_file):
+    with sqlite3.connect(index_file) as db:
+        return dict(db.execute("SELECT key, seq FROM docs").fetchall())
+
+
+def test_tokenize_stems_and_drops_stop_words():
+    assert tokenize("Настройка и запуск контейнеров") == ['настройк', 'запуск', 'контейнер']
+    assert tokenize("Running the containers") == ['runn', 'container']
+
+
+def test_search_ranks_documents_and_builds_snippets(index_file):
+    index = SearchIndex(index_file)
+    index.add_document('a.docx', "Docker compose описывает сервисы", 10, 1.0)
+    index.add_document('b.docx', "Kubernetes и minikube", 10, 1.0)
+
+    results = index.search("compose")
+
+    assert [key for key, _, _ in results] == ['a.docx']
+    assert 'compose' in results[0][2]
+
+
+def test_saved_index_is_loaded_by_new_instance(index_file):
+    index = SearchIndex(index_file)
+    index.add_document('a.docx', "Jenkins pipeline", 10, 1.0)
+    index.save()
+
+    reloaded = SearchIndex(index_file)
+    assert not reloaded.needs_update('a.docx', 10, 1.0)
+    assert reloaded.search("pipeline")[0][2] == "Jenkins pipeline"
+
+
+def test_save_writes_only_changed_documents(index_file):
+    index = SearchIndex(index_file)
+    index.add_document('a.docx', "first", 10, 1.0)
+    index.add_document('b.docx', "second", 10, 1.0)
+    index.save()
+    before = row_seqs(index_file)
+
+    index.add_document('b.docx', "second edited", 11, 2.0)
+    index.save()
+    after = row_seqs(index_file)
+
+    assert after['a.docx'] == before['a.docx']
+    assert after['b.docx'] > before['b.docx']
+
+
+def test_reader_picks_up_additions_and_removals(index_file):
+    writer = SearchIndex(index_file)
+    reader = SearchIndex(index_file)
+    writer.add_document('a.docx', "keycloak ldap", 10, 1.0)
+    writer.save()
+    assert [key for key, _, _ in reader.search("keycloak")] == ['a.docx']
+
+    writer.remove_document('a.docx')
+    writer.save()
+    assert reader.search("keycloak") == []
+    assert reader.keys() == []
+
+
+def test_unsaved_documents_are_searchable(index_file):
+    index = SearchIndex(index_file, save_interval=3600)
+    index.add_document('a.docx', "nexus repository", 10, 1.0)
+    assert index.search("nexus")[0][2] == "nexus repository"
@@ -0,0 +1,78 @@
+import threading
+from types import SimpleNamespace
+
+import user_cache as user_cache_module
+from user_cache import UserCache, format_user_name
+
+
+def make_user(user_id, first_name, last_name=None, username=None):
+    return SimpleNamespace(id=user_id, first_name=first_name, last_name=last_name, username=username)
+
+
+def test_format_user_name():
+    assert format_user_name(make_user(1, 'Иван')) == 'Иван'
+    assert format_user_name(make_user(1, 'Иван', 'Петров', 'ivan')) == 'Иван Петров (@ivan)'
+
+
+def test_remembered_users_are_not_fetched():
+    cache = UserCache()
+    cache.remember(make_user(1, 'Анна'))
+    fetched = []
+
+    names = cache.resolve_many([1, '1', 2, 2], lambda user_id: fetched.append(user_id) or make_user(2, 'Борис'))
+
+    assert names == {'1': 'Анна', '2': 'Борис'}
+    assert fetched == ['2']
+    assert cache.get(2) == 'Борис'
+
+
+def test_failed_lookup_is_cached_as_placeholder():
+    cache = UserCache()
+    calls = []
+
+    def fetch_user(user_id):
+        calls.append(user_id)
+        raise RuntimeError('chat not found')
+
+    assert cache.resolve_many([5], fetch_user) == {'5': 'Пользователь 5'}
+    assert cache.resolve_many([5], fetch_user) == {'5': 'Пользователь 5'}
+    assert calls == ['5']
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(user_cache_module.time, 'monotonic', lambda: now[0])
+    cache = UserCache(ttl=60, miss_ttl=10)
+    cache.remember(make_user(1, 'Анна'))
+    cache.resolve_many([2], lambda user_id: None)
+
+    now[0] += 30
+    assert cache.get(1) == 'Анна'
+    assert cache.get(2) is None
+    now[0] += 31
+    assert cache.get(1) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = UserCache(max_size=2)
+    cache.remember(make_user(1, 'Анна'))
+    cache.remember(make_user(2, 'Борис'))
+    cache.get(1)
+
+    cache.remember(make_user(3, 'Вера'))
+
+    assert cache.get(1) == 'Анна'
+    assert cache.get(2) is None
+    assert cache.get(3) == 'Вера'
+
+
+def test_misses_are_fetched_in_parallel():
+    cache = UserCache(max_workers=3)
+    barrier = threading.Barrier(3, timeout=5)
+
+    def fetch_user(user_id):
+        # Все три запроса должны выполняться одновременно
+        barrier.wait()
+        return make_user(int(user_id), f'User{user_id}')
+
+    assert cache.resolve_many([1, 2, 3], fetch_user) == {'1': 'User1', '2': 'User2', '3': 'User3'}
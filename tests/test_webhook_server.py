@@ -0,0 +1,103 @@
+import http.client
+import json
+import threading
+
+import pytest
+
+from webhook_server import WebhookServer
+
+SECRET = 'secret-token'
+
+
+def update_body(update_id, chat_id=10):
+    return json.dumps({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Test'},
+            'text': 'hi',
+        },
+    }).encode('utf-8')
+
+
+def start_server(process_update, **kwargs):
+    server = WebhookServer(process_update, SECRET, host='127.0.0.1', port=0, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def post(server, body, token=SECRET, path='/webhook'):
+    conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    try:
+        conn.request('POST', path, body=body, headers={'X-Telegram-Bot-Api-Secret-Token': token})
+        return conn.getresponse().status
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def received():
+    updates = []
+    done = threading.Event()
+
+    def process_update(update):
+        updates.append(update.update_id)
+        done.set()
+
+    server = start_server(process_update)
+    yield server, updates, done
+    server.shutdown()
+
+
+def test_valid_update_is_processed(received):
+    server, updates, done = received
+
+    assert post(server, update_body(1)) == 200
+    assert done.wait(5)
+    assert updates == [1]
+
+
+def test_requests_are_rejected(received):
+    server, updates, _ = received
+
+    assert post(server, update_body(1), token='wrong') == 403
+    assert post(server, update_body(1), path='/other') == 404
+    assert post(server, b'') == 400
+    assert post(server, b'{not json') == 400
+    assert updates == []
+
+
+def test_full_queue_answers_503():
+    release = threading.Event()
+    server = start_server(lambda update: release.wait(5), queue_size=1, workers=1)
+    try:
+        # Первое обновление занимает рабочий поток, второе - единственное место в очереди
+        statuses = [post(server, update_body(i)) for i in range(1, 4)]
+    finally:
+        release.set()
+        server.shutdown()
+
+    assert statuses[0] == 200
+    assert statuses[-1] == 503
+
+
+def test_updates_of_one_chat_keep_order():
+    processed = []
+    done = threading.Event()
+
+    def process_update(update):
+        processed.append(update.update_id)
+        if len(processed) == 5:
+            done.set()
+
+    server = start_server(process_update, workers=4)
+    try:
+        for update_id in range(1, 6):
+            assert post(server, update_body(update_id, chat_id=77)) == 200
+        assert done.wait(5)
+    finally:
+        server.shutdown()
+
+    assert processed == [1, 2, 3, 4, 5]
@@ -0,0 +1,140 @@
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from error_logger import log_error
+from extraction_worker import extract_text
+
+# Статусы извлечения текста
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_ERROR = 'error'
+
+
+class ExtractionPipeline:
+    """
+    Фоновое извлечение текста из документов в пуле процессов
+
+    Задачи ставятся в очередь при загрузке файлов и при сканировании каталога
+    на старте. Диспетчер держит в работе не больше задач, чем процессов в пуле,
+    а пул создается при появлении задач и закрывается после простоя.
+    """
+
+    def __init__(self, file_handler, cache_dir='cache/text', max_workers=None,
+                 on_result=None, on_drained=None, idle_timeout=30):
+        self.file_handler = file_handler
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.on_result = on_result
+        self.on_drained = on_drained
+        self.idle_timeout = idle_timeout
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        # {путь: (статус, mtime версии файла)}
+        self._status = {}
+        self._in_flight = 0
+        self._slots = threading.Semaphore(self.max_workers)
+        self._pool = None
+        os.makedirs(cache_dir, exist_ok=True)
+        threading.Thread(target=self._dispatch, daemon=True, name='extraction-dispatcher').start()
+
+    def submit(self, entry):
+        """Ставит файл каталога в очередь на извлечение текста"""
+        if not entry['name'].lower().endswith('.docx'):
+            return
+        with self._lock:
+            current = self._status.get(entry['path'])
+            if current and current[0] in (STATUS_PENDING, STATUS_RUNNING) and current[1] == entry['mtime']:
+                return
+            self._status[entry['path']] = (STATUS_PENDING, entry['mtime'])
+        self._queue.put(entry)
+
+    def status(self, path):
+        """Возвращает статус извлечения текста файла или None, если файл не ставился в очередь"""
+        with self._lock:
+            current = self._status.get(path)
+        return current[0] if current else None
+
+    def pending_count(self):
+        """Возвращает количество файлов в очереди и в работе"""
+        with self._lock:
+            return sum(1 for status, _ in self._status.values() if status in (STATUS_PENDING, STATUS_RUNNING))
+
+    def _get_pool(self):
+        """Создает пул процессов при первой задаче после простоя"""
+        if self._pool is None:
+            # Копировать процесс бота через fork нельзя: в нем работают потоки, и
+            # блокировка, захваченная другим потоком, навсегда останется захваченной
+            # в дочернем процессе. Процессы создаются из чистого forkserver, в
+            # котором заранее импортирован только модуль с функцией извлечения
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload(['extraction_worker'])
+            else:
+                context = multiprocessing.get_context('spawn')
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+        return self._pool
+
+    def _dispatch(self):
+        """Передает задачи из очереди в пул процессов"""
+        while True:
+            try:
+                entry = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                # Простаиваем - освобождаем рабочие процессы
+                with self._lock:
+                    idle = self._in_flight == 0
+                if idle and self._pool is not None:
+                    self._pool.shutdown(wait=False)
+                    self._pool = None
+                continue
+
+            self._slots.acquire()
+            with self._lock:
+                self._status[entry['path']] = (STATUS_RUNNING, entry['mtime'])
+                self._in_flight += 1
+            try:
+                future = self._get_pool().submit(
+                    extract_text, self.file_handler.get_file_path(entry), entry.get('sha256'), self.cache_dir
+                )
+            except Exception as e:
+                self._finish(entry, STATUS_ERROR)
+                log_error(f"Не удалось запустить извлечение текста {entry['path']}: {str(e)}",
+                          "system", "text_extraction")
+                continue
+            future.add_done_callback(lambda f, entry=entry: self._on_done(entry, f))
+
+    def _on_done(self, entry, future):
+        """Обрабатывает результат извлечения текста"""
+        try:
+            _, text = future.result()
+        except Exception as e:
+            self._finish(entry, STATUS_ERROR)
+            log_error(f"Не удалось извлечь текст из {entry['path']}: {str(e)}", "system", "text_extraction")
+            return
+
+        try:
+            if self.on_result:
+                self.on_result(entry, text)
+        except Exception as e:
+            log_error(f"Ошибка обработки текста {entry['path']}: {str(e)}", "system", "text_extraction")
+        self._finish(entry, STATUS_DONE)
+
+    def _finish(self, entry, status):
+        """Освобождает слот пула и сообщает, когда очередь опустела"""
+        with self._lock:
+            current = self._status.get(entry['path'])
+            # Пока файл обрабатывался, могла прийти более новая версия
+            if current and current[1] == entry['mtime']:
+                self._status[entry['path']] = (status, entry['mtime'])
+            self._in_flight -= 1
+            drained = self._in_flight == 0 and self._queue.empty()
+        self._slots.release()
+        if drained and self.on_drained:
+            try:
+                self.on_drained()
+            except Exception as e:
+                log_error(f"Ошибка при завершении пакета извлечения: {str(e)}", "system", "text_extraction")
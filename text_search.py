@@ -0,0 +1,302 @@
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+
+from error_logger import log_error
+
+# Окончания для упрощенного стемминга, от длинных к коротким
+RUSSIAN_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ией', 'ия', 'ие', 'ий',
+    'ых', 'их', 'ах', 'ях', 'ов', 'ев', 'ей', 'ой', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые',
+    'ую', 'юю', 'ом', 'ем', 'ам', 'ям', 'ать', 'ять', 'ить', 'еть', 'ться', 'тся', 'ся',
+    'ешь', 'ет', 'ют', 'ут', 'ит', 'ат', 'ят', 'ла', 'ло', 'ли', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь'
+], key=len, reverse=True)
+ENGLISH_ENDINGS = ['ing', 'ed', 'es', 's', 'ly']
+
+STOP_WORDS = {
+    'и', 'в', 'во', 'на', 'с', 'со', 'к', 'по', 'из', 'за', 'от', 'до', 'для', 'не', 'что', 'это',
+    'как', 'а', 'но', 'или', 'то', 'же', 'the', 'a', 'an', 'and', 'or', 'of', 'to', 'in', 'on',
+    'for', 'is', 'are', 'be', 'with', 'by', 'it', 'as', 'at'
+}
+
+WORD_RE = re.compile(r'[a-zа-я0-9]+')
+
+# Параметры ранжирования BM25
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Сколько текста документа хранится в индексе для построения сниппетов
+MAX_STORED_TEXT = 200000
+
+
+def normalize(text):
+    """Приводит текст к нижнему регистру и заменяет ё на е"""
+    return text.lower().replace('ё', 'е')
+
+
+def stem(word):
+    """Отрезает типичное окончание русского или английского слова"""
+    if word.isdigit():
+        return word
+    endings = ENGLISH_ENDINGS if word.isascii() else RUSSIAN_ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text):
+    """Разбивает текст на нормализованные термы"""
+    return [stem(word) for word in WORD_RE.findall(normalize(text))
+            if len(word) > 1 and word not in STOP_WORDS]
+
+
+class SearchIndex:
+    """
+    Полнотекстовый инвертированный индекс по содержимому документов
+
+    Индекс хранится в SQLite по строке на документ: частоты термов и текст
+    для сниппетов. В памяти держатся только частоты и длины документов, по
+    которым строятся списки документов для термов; текст читается из базы
+    только для найденных документов. Изменения лишь запоминаются, а фоновый
+    поток не чаще раза в save_interval секунд записывает измененные строки
+    одной транзакцией, поэтому обновление документа не переписывает индекс.
+
+    Индекс пишет один процесс; остальные процессы бота только ищут по нему и
+    дочитывают строки, измененные после предыдущего чтения: у каждой строки
+    есть номер изменения, а удаленный документ остается строкой без термов.
+    """
+
+    def __init__(self, index_file='search_index.db', save_interval=5.0):
+        self.index_file = index_file
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        # Соединение с базой используют разные потоки по очереди
+        self._db_lock = threading.Lock()
+        # Не дает нескольким поискам дочитывать базу одновременно: иначе
+        # более старое чтение могло бы применить устаревшую версию документа
+        self._reload_lock = threading.Lock()
+        self._db = sqlite3.connect(index_file, timeout=30, check_same_thread=False, isolation_level=None)
+        # WAL: процессы, которые только ищут, читают базу во время записи
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            "key TEXT PRIMARY KEY, seq INTEGER NOT NULL, size INTEGER, mtime REAL, "
+            "length INTEGER, terms TEXT, text TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS docs_seq ON docs (seq)")
+        # {путь документа: {'size', 'mtime', 'length', 'terms': {терм: частота}}}
+        self._docs = {}
+        # {терм: {путь документа: частота}}
+        self._postings = {}
+        self._total_length = 0
+        # Несохраненные изменения: {путь документа: (документ, текст) или None для удаленного}
+        self._changed = {}
+        # Номер последнего изменения, прочитанного из базы
+        self._seq = 0
+        self.reload_if_changed()
+        threading.Thread(target=self._save_loop, daemon=True, name='search-index-saver').start()
+
+    def reload_if_changed(self):
+        """Дочитывает документы, измененные в базе после предыдущего чтения"""
+        with self._reload_lock:
+            self._reload()
+
+    def _reload(self):
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT key, seq, size, mtime, length, terms FROM docs WHERE seq > ? ORDER BY seq",
+                (self._seq,)
+            ).fetchall()
+        if not rows:
+            return
+        # Разбираем строки до блокировки, чтобы не задерживать поиск
+        updates = [
+            (key, seq, None if terms is None else
+             {'size': size, 'mtime': mtime, 'length': length, 'terms': json.loads(terms)})
+            for key, seq, size, mtime, length, terms in rows
+        ]
+        with self._lock:
+            for key, seq, doc in updates:
+                self._seq = max(self._seq, seq)
+                if key in self._changed:
+                    # Несохраненное изменение этого процесса новее
+                    continue
+                self._remove_locked(key)
+                if doc is not None:
+                    self._add_locked(key, doc)
+
+    def save(self):
+        """Записывает измененные документы одной транзакцией"""
+        with self._lock:
+            changed, self._changed = self._changed, {}
+        if not changed:
+            return
+        # Сериализуем копию изменений вне блокировки: документы после добавления не меняются
+        rows = []
+        for key, change in changed.items():
+            if change is None:
+                rows.append((key, None, None, None, None, None))
+            else:
+                doc, text = change
+                rows.append((key, doc['size'], doc['mtime'], doc['length'],
+                             json.dumps(doc['terms'], ensure_ascii=False), text))
+
+        try:
+            with self._db_lock:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    first_seq = self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM docs").fetchone()[0]
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO docs (key, seq, size, mtime, length, terms, text) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [(row[0], first_seq + i) + row[1:] for i, row in enumerate(rows, start=1)]
+                    )
+                    self._db.execute("COMMIT")
+                except BaseException:
+                    self._db.execute("ROLLBACK")
+                    raise
+        except BaseException:
+            # Изменения не сохранены - повторим в следующий раз, если документ не менялся снова
+            with self._lock:
+                for key, change in changed.items():
+                    self._changed.setdefault(key, change)
+            raise
+
+        with self._lock:
+            # Свои строки не перечитываем, если между чтениями никто больше не писал
+            if self._seq == first_seq:
+                self._seq = first_seq + len(rows)
+
+    def save_if_dirty(self):
+        """Сохраняет индекс, если он менялся после последнего сохранения"""
+        self.save()
+
+    def _save_loop(self):
+        """Периодически сохраняет измененные документы"""
+        while True:
+            time.sleep(self.save_interval)
+            try:
+                self.save()
+            except Exception as e:
+                log_error(f"Ошибка при сохранении поискового индекса: {str(e)}", "system", "text_search")
+
+    def needs_update(self, key, size, mtime):
+        """Проверяет, нужно ли переиндексировать документ"""
+        with self._lock:
+            doc = self._docs.get(key)
+        return doc is None or doc['size'] != size or doc['mtime'] != mtime
+
+    def keys(self):
+        """Возвращает пути всех проиндексированных документов"""
+        with self._lock:
+            return list(self._docs)
+
+    def add_document(self, key, text, size, mtime):
+        """Добавляет или обновляет документ в индексе"""
+        terms = tokenize(text)
+        frequencies = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        doc = {'size': size, 'mtime': mtime, 'length': len(terms), 'terms': frequencies}
+
+        with self._lock:
+            self._remove_locked(key)
+            self._add_locked(key, doc)
+            self._changed[key] = (doc, text[:MAX_STORED_TEXT])
+
+    def remove_document(self, key):
+        """Удаляет документ из индекса"""
+        with self._lock:
+            if key in self._docs or key in self._changed:
+                self._remove_locked(key)
+                self._changed[key] = None
+
+    def _add_locked(self, key, doc):
+        for term, count in doc['terms'].items():
+            self._postings.setdefault(term, {})[key] = count
+        self._docs[key] = doc
+        self._total_length += doc['length']
+
+    def _remove_locked(self, key):
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return
+        self._total_length -= doc['length']
+        for term in doc['terms']:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[term]
+
+    def search(self, query, limit=10):
+        """
+        Ищет документы по словам запроса
+
+        Returns:
+            list: кортежи (путь документа, оценка, сниппет), отсортированные по оценке
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        self.reload_if_changed()
+        with self._lock:
+            total_docs = len(self._docs)
+            if not total_docs:
+                return []
+            avg_length = self._total_length / total_docs or 1
+            scores = {}
+            for term in terms:
+                postings = self._postings.get(term, {})
+                if not postings:
+                    continue
+                idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, frequency in postings.items():
+                    length = self._docs[key]['length']
+                    norm = frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                    scores[key] = scores.get(key, 0) + idf * frequency * (BM25_K1 + 1) / norm
+
+            ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:limit]
+            # Текст еще не сохраненных документов берем из памяти
+            texts = {key: self._changed[key][1] for key, _ in ranked if self._changed.get(key)}
+
+        missing = [key for key, _ in ranked if key not in texts]
+        if missing:
+            with self._db_lock:
+                texts.update(self._db.execute(
+                    f"SELECT key, text FROM docs WHERE key IN ({', '.join('?' * len(missing))})", missing
+                ).fetchall())
+        return [(key, score, self._snippet(texts.get(key) or "", terms)) for key, score in ranked]
+
+    def _snippet(self, text, terms, width=80):
+        """Вырезает фрагмент текста вокруг первого найденного слова запроса"""
+        normalized = normalize(text)
+        for match in WORD_RE.finditer(normalized):
+            if stem(match.group()) in terms:
+                start = max(0, match.start() - width)
+                end = min(len(text), match.end() + width)
+                snippet = " ".join(text[start:end].split())
+                prefix = "…" if start > 0 else ""
+                suffix = "…" if end < len(text) else ""
+                return f"{prefix}{snippet}{suffix}"
+        return " ".join(text[:2 * width].split())
+
+
+def sync_with_catalog(search_index, file_handler, pipeline):
+    """Отправляет на индексацию новые и измененные .docx из каталога и удаляет исчезнувшие"""
+    catalog_keys = set()
+    for entry in file_handler.iter_entries():
+        if not entry['name'].lower().endswith('.docx'):
+            continue
+        catalog_keys.add(entry['path'])
+        if search_index.needs_update(entry['path'], entry['size'], entry['mtime']):
+            pipeline.submit(entry)
+
+    for key in search_index.keys():
+        if key not in catalog_keys:
+            search_index.remove_document(key)
@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def format_user_name(user):
+    """Формирует отображаемое имя пользователя Telegram: имя, фамилия и @username"""
+    user_name = user.first_name
+    if user.last_name:
+        user_name += f" {user.last_name}"
+    if user.username:
+        user_name += f" (@{user.username})"
+    return user_name
+
+
+class UserCache:
+    """
+    Кэш отображаемых имен пользователей с TTL и вытеснением LRU
+
+    Заполняется из from_user входящих сообщений, поэтому для активных
+    пользователей запросы к Telegram вообще не нужны. Неудачные запросы
+    кэшируются на более короткий срок.
+    """
+
+    def __init__(self, max_size=10000, ttl=24 * 3600, miss_ttl=600, max_workers=4):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        # {id пользователя: (время истечения, отображаемое имя)}
+        self._names = OrderedDict()
+
+    def _put(self, user_id, name, ttl):
+        with self._lock:
+            self._names[user_id] = (time.monotonic() + ttl, name)
+            self._names.move_to_end(user_id)
+            while len(self._names) > self.max_size:
+                self._names.popitem(last=False)
+
+    def remember(self, user):
+        """Запоминает имя пользователя из объекта User входящего сообщения"""
+        if user is not None:
+            self._put(str(user.id), format_user_name(user), self.ttl)
+
+    def get(self, user_id):
+        """Возвращает имя из кэша или None, если его нет или оно устарело"""
+        user_id = str(user_id)
+        with self._lock:
+            cached = self._names.get(user_id)
+            if cached is None:
+                return None
+            if cached[0] < time.monotonic():
+                del self._names[user_id]
+                return None
+            self._names.move_to_end(user_id)
+            return cached[1]
+
+    def resolve_many(self, user_ids, fetch_user):
+        """
+        Возвращает имена для набора пользователей
+
+        Каждый пользователь запрашивается не больше одного раза, промахи кэша
+        запрашиваются параллельно не более чем в max_workers потоках.
+
+        Args:
+            user_ids: идентификаторы пользователей, возможно с повторами
+            fetch_user: функция, возвращающая User по id или вызывающая исключение
+
+        Returns:
+            dict: {id пользователя: отображаемое имя}
+        """
+        names = {}
+        misses = []
+        for user_id in dict.fromkeys(str(user_id) for user_id in user_ids):
+            name = self.get(user_id)
+            if name is None:
+                misses.append(user_id)
+            else:
+                names[user_id] = name
+
+        if misses:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(misses))) as pool:
+                for user_id, name in zip(misses, pool.map(lambda uid: self._fetch(uid, fetch_user), misses)):
+                    names[user_id] = name
+        return names
+
+    def _fetch(self, user_id, fetch_user):
+        """Запрашивает имя пользователя у Telegram и кэширует результат"""
+        try:
+            user = fetch_user(user_id)
+        except Exception:
+            user = None
+        if user is None:
+            name = f"Пользователь {user_id}"
+            self._put(user_id, name, self.miss_ttl)
+            return name
+        self.remember(user)
+        return format_user_name(user)
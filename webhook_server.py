@@ -0,0 +1,111 @@
+import hmac
+import json
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+from async_intake import update_chat_id
+from error_logger import log_error
+
+# Ограничение на размер тела запроса с обновлением
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class WebhookServer:
+    """
+    Встроенный HTTP-сервер для приема обновлений Telegram через вебхук
+
+    Сервер проверяет секретный токен из заголовка
+    X-Telegram-Bot-Api-Secret-Token, разбирает обновление и кладет его в
+    ограниченную очередь рабочего потока. Обновления одного чата всегда
+    попадают в одну очередь и обрабатываются по порядку. Если очередь
+    заполнена, сервер отвечает 503 - Telegram повторит доставку позже.
+    """
+
+    def __init__(self, process_update, secret_token, host='0.0.0.0', port=8443,
+                 path='/webhook', queue_size=1000, workers=16):
+        self.process_update = process_update
+        self.secret_token = secret_token
+        self.path = path
+        self.queues = [queue.Queue(maxsize=max(1, queue_size // workers)) for _ in range(workers)]
+        for i, worker_queue in enumerate(self.queues):
+            threading.Thread(target=self._worker, args=(worker_queue,), daemon=True,
+                             name=f"webhook-worker-{i}").start()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def port(self):
+        """Порт, на котором слушает сервер (полезно при port=0)"""
+        return self.httpd.server_address[1]
+
+    def serve_forever(self):
+        """Принимает запросы до вызова shutdown"""
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        """Останавливает сервер"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def enqueue(self, update):
+        """
+        Кладет обновление в очередь его чата
+
+        Returns:
+            bool: False, если очередь заполнена
+        """
+        chat_id = update_chat_id(update)
+        worker_queue = self.queues[hash(chat_id) % len(self.queues)]
+        try:
+            worker_queue.put_nowait(update)
+            return True
+        except queue.Full:
+            return False
+
+    def _worker(self, worker_queue):
+        """Рабочий поток: обрабатывает обновления своей очереди"""
+        while True:
+            update = worker_queue.get()
+            try:
+                self.process_update(update)
+            except Exception as e:
+                log_error(f"Ошибка обработки обновления: {str(e)}", update_chat_id(update), "webhook")
+
+    def _make_handler(self):
+        server = self
+
+        class WebhookHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    self._reply(404)
+                    return
+                token = self.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+                if not hmac.compare_digest(token.encode('utf-8'), server.secret_token.encode('utf-8')):
+                    self._reply(403)
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                if length <= 0 or length > MAX_BODY_SIZE:
+                    self._reply(400)
+                    return
+
+                try:
+                    update = types.Update.de_json(json.loads(self.rfile.read(length)))
+                except (ValueError, KeyError, TypeError):
+                    # Невалидный JSON или объект, не похожий на обновление
+                    self._reply(400)
+                    return
+                self._reply(200 if server.enqueue(update) else 503)
+
+            def _reply(self, status):
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                # Не пишем в консоль строку на каждое обновление
+                pass
+
+        return WebhookHandler